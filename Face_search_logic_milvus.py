@@ -4,252 +4,1176 @@
 import numpy as np
 import cv2
 import os
+import datetime
+import glob
+import hashlib
+import re
+import multiprocessing
+import shutil
+import threading
+import time
+from collections import Counter, OrderedDict, deque
+from contextlib import contextmanager
+from concurrent.futures import ProcessPoolExecutor, wait, FIRST_COMPLETED
 import insightface
+import onnxruntime
 from insightface.app import FaceAnalysis
-from pymilvus import (connections, utility, FieldSchema, CollectionSchema, DataType, Collection)
+from insightface.app.common import Face
+from insightface.model_zoo.model_zoo import PickableInferenceSession
 from dotenv import load_dotenv
 
+import database as db
+from ttl_cache import TTLCache
+from vector_store import open_vector_store, partition_name, select_partitions, GUEST_PROFILE_COLLECTION
+
 load_dotenv()
 
 # --- GLOBAL CONFIGURATION ---
-MILVUS_HOST = os.getenv("MILVUS_HOST", "127.0.0.1")
-MILVUS_PORT = os.getenv("MILVUS_PORT", "19530")
 MODEL_NAME = os.getenv("MODEL_NAME", "buffalo_l")
 VECTOR_DIMENSION = int(os.getenv("VECTOR_DIMENSION", 512))
-METRIC_TYPE = os.getenv("METRIC_TYPE", "L2")
-DISTANCE_THRESHOLD = float(os.getenv("DISTANCE_THRESHOLD", 1.0))
-NPROBE = int(os.getenv("NPROBE", 20))
+METRIC_TYPE = os.getenv("METRIC_TYPE", "L2")  # Default metric for new collections; see index_profiles.py
+DISTANCE_THRESHOLD = float(os.getenv("DISTANCE_THRESHOLD", 1.0))  # In squared-L2 units, whatever the metric
 
 # --- PREVIEW IMAGE CONFIGURATION ---
 PREVIEW_IMAGE_DIR = "images_preview"
+PREVIEW_CACHE_DIR = os.path.join(PREVIEW_IMAGE_DIR, "_cache")  # Content-addressed renders shared by every collection
 WATERMARK_TEXT = "Your Park Memories"
+PREVIEW_MAX_SIDE = int(os.getenv("PREVIEW_MAX_SIDE", 1280))      # Lightbox preview, longest side in pixels
+PREVIEW_THUMB_SIDE = int(os.getenv("PREVIEW_THUMB_SIDE", 360))   # Result grid thumbnail, longest side in pixels
+PREVIEW_THUMB_QUALITY = int(os.getenv("PREVIEW_THUMB_QUALITY", 70))
+PREVIEW_WEBP = os.getenv("PREVIEW_WEBP", "false").lower() == "true"  # Also render WebP variants
+PREVIEW_WEBP_QUALITY = int(os.getenv("PREVIEW_WEBP_QUALITY", 75))
+# variant -> (longest side, format, subfolder inside the collection's preview folder)
+PREVIEW_VARIANTS = {
+    "preview": (PREVIEW_MAX_SIDE, "jpg", ""),
+    "thumb": (PREVIEW_THUMB_SIDE, "jpg", "thumbs"),
+}
+if PREVIEW_WEBP:
+    PREVIEW_VARIANTS["preview_webp"] = (PREVIEW_MAX_SIDE, "webp", "webp")
+    PREVIEW_VARIANTS["thumb_webp"] = (PREVIEW_THUMB_SIDE, "webp", "thumbs_webp")
 
 
 # --- TARGET SIZE CONFIGURATION ---
-TARGET_PREVIEW_SIZE_KB = 30  # The goal file size in kilobytes
-TARGET_SIZE_TOLERANCE_KB = 25# How close we need to get (e.g., 15-25 KB is acceptable)
-MAX_ITERATIONS = 10          # Safety limit to prevent infinite loops
+TARGET_PREVIEW_SIZE_KB = int(os.getenv("TARGET_PREVIEW_SIZE_KB", 30))        # The goal file size in kilobytes
+TARGET_SIZE_TOLERANCE_KB = float(os.getenv("TARGET_SIZE_TOLERANCE_KB", 3))  # How close we need to get (e.g., 27-33 KB is acceptable)
+MAX_ITERATIONS = int(os.getenv("PREVIEW_MAX_ENCODES", 6))                   # Hard cap on JPEG encodes per preview
+ENCODE_HISTORY_SIZE = 64     # Recent encodes per collection used to predict the starting quality
+# Typical bits per pixel of a photo at a given JPEG quality. Each collection's recent
+# encodes rescale this curve, so only its shape matters.
+JPEG_QUALITY_PRIOR = ((5, 0.15), (10, 0.25), (20, 0.4), (30, 0.55), (40, 0.65), (50, 0.75),
+                      (60, 0.85), (70, 1.05), (80, 1.4), (90, 2.2), (95, 3.2), (100, 6.0))
+
+# Anything that changes how previews look. Cached renders made under other settings are not reused.
+PREVIEW_RENDER_VERSION = 1
+PREVIEW_RENDER_SIGNATURE = repr((PREVIEW_RENDER_VERSION, WATERMARK_TEXT, sorted(PREVIEW_VARIANTS.items()), PREVIEW_THUMB_QUALITY,
+                                 PREVIEW_WEBP_QUALITY, TARGET_PREVIEW_SIZE_KB, TARGET_SIZE_TOLERANCE_KB))
+# Renders of the current settings; cache folders of other settings are pruned (see prune_preview_cache)
+PREVIEW_RENDER_CACHE_DIR = os.path.join(PREVIEW_CACHE_DIR, hashlib.sha1(PREVIEW_RENDER_SIGNATURE.encode()).hexdigest()[:12])
+PREVIEW_CACHE_GRACE_SECONDS = 3600  # Unlinked cache entries younger than this are kept: a render may be about to link them
+
+# --- INGEST PIPELINE CONFIGURATION ---
+INGEST_WORKERS = int(os.getenv("INGEST_WORKERS", max(1, (os.cpu_count() or 2) // 4)))  # Processes running detection/embedding
+INGEST_THREADS_PER_WORKER = int(os.getenv("INGEST_THREADS_PER_WORKER", 4))             # ONNX intra-op threads per worker
+PREVIEW_WORKERS = int(os.getenv("PREVIEW_WORKERS", max(1, (os.cpu_count() or 2) // 4)))  # Processes rendering previews
+INSERT_BATCH_SIZE = int(os.getenv("INSERT_BATCH_SIZE", 2000))  # Rows buffered before each vector store insert
+MAX_IN_FLIGHT_PER_WORKER = 4  # Pending images per worker, keeps memory flat for any folder size
+IMAGE_EXTENSIONS = ('.png', '.jpg', '.jpeg')
+MANIFEST_SEED_BATCH_SIZE = 1000  # Paths read per batch when seeding a manifest from the vector store
+FOLDER_DATE_PATTERN = re.compile(r"(20\d{2})[-_]?(0[1-9]|1[0-2])[-_]?(0[1-9]|[12]\d|3[01])")  # Capture date fallback, e.g. ".../2026-07-04/"
+
+# --- PER-FACE METADATA CONFIGURATION ---
+FACE_CROPS = os.getenv("FACE_CROPS", "false").lower() == "true"  # Store a small crop of every indexed face
+FACE_CROP_SIZE = int(os.getenv("FACE_CROP_SIZE", 112))            # Longest side of a stored face crop
+FACE_CROP_MARGIN = 0.2                                            # Crop margin around the bbox, as a fraction of its size
+MIN_FACE_DET_SCORE = float(os.getenv("MIN_FACE_DET_SCORE", 0.5))  # Indexed faces below this detection score are not matched
+MIN_FACE_SIZE = float(os.getenv("MIN_FACE_SIZE", 20))             # ...nor faces whose shorter bbox side is under this many pixels
+
+# --- BURST COLLAPSING CONFIGURATION ---
+BURST_COLLAPSE = os.getenv("BURST_COLLAPSE", "true").lower() == "true"            # Index one representative per burst of near-identical frames
+BURST_EMBEDDING_DISTANCE = float(os.getenv("BURST_EMBEDDING_DISTANCE", 0.3))       # Squared L2; every face must be this close to the representative's
+BURST_HASH_DISTANCE = int(os.getenv("BURST_HASH_DISTANCE", 6))                     # Differing bits of the 64-bit dHash for "looks the same"
+BURST_WINDOW_SECONDS = float(os.getenv("BURST_WINDOW_SECONDS", 3))                 # ...or EXIF capture times at most this far apart
+BURST_LOOKBACK = int(os.getenv("BURST_LOOKBACK", 32))                              # Recent representatives a new frame is compared with
+BURST_SIZES_TTL_SECONDS = int(os.getenv("BURST_SIZES_TTL_SECONDS", 60))            # How long a process trusts its burst size cache
+
+# --- TWO-STAGE SEARCH CONFIGURATION ---
+RERANK = os.getenv("RERANK", "false").lower() == "true"                 # Re-score ANN candidates with exact distances
+RERANK_CANDIDATE_FACTOR = int(os.getenv("RERANK_CANDIDATE_FACTOR", 4))  # Candidates fetched per query face, as a multiple of top_k
+RERANK_NPROBE = int(os.getenv("RERANK_NPROBE", 8))                      # Cheaper IVF breadth for the candidate stage
+RERANK_DISTANCE_THRESHOLD = float(os.getenv("RERANK_DISTANCE_THRESHOLD", DISTANCE_THRESHOLD))  # Applied to exact distances
+
+# --- GUEST FACE PROFILE CONFIGURATION ---
+PROFILE_MAX_SAMPLES = int(os.getenv("PROFILE_MAX_SAMPLES", 5))  # Selfies a profile averages over; later ones still count this much
+PROFILE_MATCH_THRESHOLD = float(os.getenv("PROFILE_MATCH_THRESHOLD", DISTANCE_THRESHOLD))  # A selfie further than this is someone else
+
+GUEST_MATCH_TOP_K = int(os.getenv("GUEST_MATCH_TOP_K", 3))  # Enrolled guests considered per newly ingested face
+GUEST_MATCH_THRESHOLD = float(os.getenv("GUEST_MATCH_THRESHOLD", DISTANCE_THRESHOLD))
+GUEST_PROFILE_INDEX_PROFILE = os.getenv("GUEST_PROFILE_INDEX_PROFILE", "ivf_flat_small")
+
+# --- LOADED COLLECTION CACHE CONFIGURATION ---
+LOADED_COLLECTIONS_BUDGET_MB = int(os.getenv("LOADED_COLLECTIONS_BUDGET_MB", 4096))  # Milvus memory we allow loaded collections to use
+
+# --- QUERY EMBEDDING CACHE CONFIGURATION ---
+QUERY_CACHE_MAX_ENTRIES = int(os.getenv("QUERY_CACHE_MAX_ENTRIES", 2048))
+QUERY_CACHE_TTL_SECONDS = int(os.getenv("QUERY_CACHE_TTL_SECONDS", 900))
+
+# --- DETECTION PROFILE CONFIGURATION ---
+QUERY_DET_SIZE = int(os.getenv("QUERY_DET_SIZE", 640))     # Detector input for guest selfies (one or a few large faces)
+INGEST_DET_SIZE = int(os.getenv("INGEST_DET_SIZE", 1024))  # Detector input for wide park/crowd shots
+QUERY_MAX_SIDE = int(os.getenv("QUERY_MAX_SIDE", 1280))    # Query uploads are downscaled to this longest side on decode
+DETECTION_PROFILES = {
+    "query": (QUERY_DET_SIZE, QUERY_DET_SIZE),
+    "ingest": (INGEST_DET_SIZE, INGEST_DET_SIZE),
+}
 
 # --- SINGLETON MODEL LOADER ---
 APP_MODEL_INSTANCE = None
+PROFILED_MODELS = {}
+_MODEL_LOCK = threading.Lock()
 
-def get_model():
-    """Singleton pattern to ensure the InsightFace model is loaded only once."""
+class ProfiledFaceModel:
+    """
+    Same interface as FaceAnalysis.get, but detects at the profile's own input size.
+    Every profile shares the one loaded FaceAnalysis, so ONNX sessions are never duplicated.
+    """
+
+    def __init__(self, base_model: FaceAnalysis, det_size: tuple):
+        self.base_model = base_model
+        self.det_size = det_size
+
+    def get(self, img, max_num=0):
+        bboxes, kpss = self.base_model.det_model.detect(img, input_size=self.det_size, max_num=max_num, metric='default')
+        faces = []
+        for i in range(bboxes.shape[0]):
+            face = Face(bbox=bboxes[i, 0:4], kps=kpss[i] if kpss is not None else None, det_score=bboxes[i, 4])
+            for taskname, model in self.base_model.models.items():
+                if taskname == 'detection': continue
+                model.get(img, face)
+            faces.append(face)
+        return faces
+
+def limit_model_threads(face_analysis: FaceAnalysis, intra_op_threads: int):
+    """
+    Rebuilds every model's ONNX session capped at intra_op_threads. insightface only passes
+    providers to the sessions it creates, so SessionOptions cannot be given to FaceAnalysis.
+    """
+    sess_options = onnxruntime.SessionOptions()
+    sess_options.intra_op_num_threads = intra_op_threads
+    sess_options.inter_op_num_threads = 1
+    for model in face_analysis.models.values():
+        model.session = PickableInferenceSession(model.model_file, sess_options=sess_options, providers=model.session.get_providers())
+
+def get_model(profile: str = "ingest", intra_op_threads: int = None):
+    """Singleton pattern to ensure the InsightFace model is loaded only once, shared by every detection profile."""
     global APP_MODEL_INSTANCE
-    if APP_MODEL_INSTANCE is None:
-        print("Initializing InsightFace model for the first time...")
-        APP_MODEL_INSTANCE = FaceAnalysis(name=MODEL_NAME, allowed_modules=['detection', 'recognition'])
-        APP_MODEL_INSTANCE.prepare(ctx_id=-1, det_size=(1024, 1024))
-        print("InsightFace model loaded successfully.")
-    return APP_MODEL_INSTANCE
+    with _MODEL_LOCK:
+        if APP_MODEL_INSTANCE is None:
+            print("Initializing InsightFace model for the first time...")
+            APP_MODEL_INSTANCE = FaceAnalysis(name=MODEL_NAME, allowed_modules=['detection', 'recognition'])
+            if intra_op_threads:
+                limit_model_threads(APP_MODEL_INSTANCE, intra_op_threads)
+            APP_MODEL_INSTANCE.prepare(ctx_id=-1, det_size=DETECTION_PROFILES["ingest"])
+            print("InsightFace model loaded successfully.")
+        if profile not in PROFILED_MODELS:
+            PROFILED_MODELS[profile] = ProfiledFaceModel(APP_MODEL_INSTANCE, DETECTION_PROFILES[profile])
+        return PROFILED_MODELS[profile]
+
+# --- QUERY IMAGE DECODING ---
+def _jpeg_dimensions(contents: bytes):
+    """Reads (width, height) from a JPEG's SOF header without decoding pixels; None if not a JPEG."""
+    if contents[:2] != b"\xff\xd8": return None
+    i = 2
+    while i + 9 < len(contents):
+        if contents[i] != 0xFF:
+            i += 1
+            continue
+        marker = contents[i + 1]
+        if marker in (0xD8, 0x01) or 0xD0 <= marker <= 0xD7 or marker == 0xFF:
+            i += 1 if marker == 0xFF else 2
+            continue
+        segment_length = int.from_bytes(contents[i + 2:i + 4], "big")
+        if 0xC0 <= marker <= 0xCF and marker not in (0xC4, 0xC8, 0xCC):
+            height = int.from_bytes(contents[i + 5:i + 7], "big")
+            width = int.from_bytes(contents[i + 7:i + 9], "big")
+            return width, height
+        i += 2 + segment_length
+    return None
+
+def _exif_capture_time(contents: bytes):
+    """Reads DateTimeOriginal (or DateTime) from a JPEG's EXIF block as a datetime; None if absent."""
+    if contents[:2] != b"\xff\xd8": return None
+    i = 2
+    while i + 4 < len(contents) and contents[i] == 0xFF:
+        marker, segment_length = contents[i + 1], int.from_bytes(contents[i + 2:i + 4], "big")
+        if marker == 0xDA: return None  # Start of scan: no EXIF ahead
+        if marker == 0xE1 and contents[i + 4:i + 10] == b"Exif\x00\x00":
+            return _tiff_capture_time(contents[i + 10:i + 2 + segment_length])
+        i += 2 + segment_length
+    return None
+
+def _tiff_capture_time(tiff: bytes):
+    try:
+        order = {b"II": "little", b"MM": "big"}[tiff[:2]]
+        read = lambda offset, size: int.from_bytes(tiff[offset:offset + size], order)
+        def ifd_entries(offset):
+            return {read(offset + 2 + 12 * n, 2): offset + 2 + 12 * n for n in range(read(offset, 2))}
+        ifd0 = ifd_entries(read(4, 4))
+        candidates = []
+        if 0x8769 in ifd0:  # Exif sub-IFD pointer
+            exif_ifd = ifd_entries(read(ifd0[0x8769] + 8, 4))
+            if 0x9003 in exif_ifd: candidates.append(exif_ifd[0x9003])  # DateTimeOriginal
+        if 0x0132 in ifd0: candidates.append(ifd0[0x0132])  # DateTime
+        for entry in candidates:
+            value_offset = read(entry + 8, 4)
+            match = re.match(rb"(\d{4}):(\d{2}):(\d{2})(?: (\d{2}):(\d{2}):(\d{2}))?", tiff[value_offset:value_offset + 19])
+            if match and match.group(1) != b"0000":
+                return datetime.datetime(*(int(part) for part in match.groups(b"0")))
+    except (KeyError, IndexError, ValueError):
+        pass
+    return None
+
+def perceptual_hash(img):
+    """64-bit difference hash: near-identical frames differ in only a few bits."""
+    small = cv2.resize(cv2.cvtColor(img, cv2.COLOR_BGR2GRAY), (9, 8), interpolation=cv2.INTER_AREA)
+    return int("".join("1" if bit else "0" for bit in (small[:, 1:] > small[:, :-1]).flatten()), 2)
+
+def capture_date_from_path(path: str):
+    """A YYYY-MM-DD / YYYYMMDD date in the file's folder path (e.g. one folder per park day), or None."""
+    match = FOLDER_DATE_PATTERN.search(os.path.dirname(os.path.abspath(path)))
+    return "-".join(match.groups()) if match else None
+
+def decode_query_image(contents: bytes, max_side: int = QUERY_MAX_SIDE):
+    """
+    Decodes an uploaded query image no larger than max_side. JPEGs are reduced by the
+    decoder itself (1/2, 1/4 or 1/8 scale), so full-resolution phone photos are never
+    fully materialized; anything still too large is resized down.
+    """
+    buffer = np.frombuffer(contents, np.uint8)
+    flag = cv2.IMREAD_COLOR
+    dimensions = _jpeg_dimensions(contents)
+    if dimensions:
+        longest = max(dimensions)
+        for factor, reduced_flag in ((8, cv2.IMREAD_REDUCED_COLOR_8), (4, cv2.IMREAD_REDUCED_COLOR_4), (2, cv2.IMREAD_REDUCED_COLOR_2)):
+            if longest // factor >= max_side:
+                flag = reduced_flag
+                break
+    img = cv2.imdecode(buffer, flag)
+    if img is None: return None
+    h, w = img.shape[:2]
+    if max(h, w) > max_side:
+        scale = max_side / max(h, w)
+        img = cv2.resize(img, (int(w * scale), int(h * scale)), interpolation=cv2.INTER_AREA)
+    return img
 
 # --- SMART SAVE FUNCTION ---
-def save_image_to_target_size(cv_image, output_path: str):
+_PRIOR_QUALITIES = np.array([q for q, _ in JPEG_QUALITY_PRIOR], dtype=np.float64)
+_PRIOR_LOG_BPP = np.log([bpp for _, bpp in JPEG_QUALITY_PRIOR])
+_ENCODE_HISTORY = {}  # history_key -> recent "complexity" factors (observed bpp / prior bpp); per worker process
+
+def _prior_bpp(quality: int):
+    return float(np.exp(np.interp(quality, _PRIOR_QUALITIES, _PRIOR_LOG_BPP)))
+
+def _quality_for_bpp(bpp: float, complexity: float):
+    """Inverts the prior curve, scaled by how hard this kind of image is to compress."""
+    return int(round(np.interp(np.log(bpp / complexity), _PRIOR_LOG_BPP, _PRIOR_QUALITIES)))
+
+def save_image_to_target_size(cv_image, output_path: str, history_key: str = None):
     """
-    Iteratively saves a CV2 image to get as close as possible to the target file size.
-    Uses a binary search on the JPEG quality setting for efficiency.
+    Saves a CV2 image as a JPEG as close as possible to the target file size.
+    The starting quality is predicted from the resolution and the recent encodes of the
+    same history_key (e.g. the collection); every encode then refines the estimate within
+    a shrinking [low, high] bracket. Stops once inside the tolerance or when no untried
+    quality is left to gain from. The closest encoded buffer is written as-is, never re-encoded.
+    Returns {"quality", "size_kb", "encodes", "encode_ms"}.
     """
-    low_quality = 0
-    high_quality = 100
-    best_quality = 50 # Start in the middle
-    
-    # Binary search to find the best quality setting
-    for _ in range(MAX_ITERATIONS):
-        current_quality = (low_quality + high_quality) // 2
-        print(f"Current quality of image {current_quality}")
-        # Prevent quality from being 0 which can cause issues
-        if current_quality == 0: current_quality = 1
+    start = time.perf_counter()
+    h, w = cv_image.shape[:2]
+    target_bytes = TARGET_PREVIEW_SIZE_KB * 1024
+    tolerance_bytes = TARGET_SIZE_TOLERANCE_KB * 1024
+    target_bpp = target_bytes * 8 / (h * w)
 
+    history = _ENCODE_HISTORY.setdefault(history_key, deque(maxlen=ENCODE_HISTORY_SIZE))
+    complexity = float(np.median(history)) if history else 1.0
+    low_quality, high_quality = 1, 100
+    quality = min(high_quality, max(low_quality, _quality_for_bpp(target_bpp, complexity)))
+    tried = {}  # quality -> encoded buffer
 
-        result, buffer = cv2.imencode('.jpg', cv_image, [cv2.IMWRITE_JPEG_QUALITY, current_quality])
-        
+    for _ in range(MAX_ITERATIONS):
+        result, buffer = cv2.imencode('.jpg', cv_image, [cv2.IMWRITE_JPEG_QUALITY, quality])
         if not result:
-            cv2.imwrite(output_path, cv_image, [cv2.IMWRITE_JPEG_QUALITY, 25])
-            return
-
-        current_size_kb = len(buffer) / 1024
-        print(f"current_size {current_size_kb}")
+            break
+        tried[quality] = buffer
+        size = len(buffer)
+        complexity = (size * 8 / (h * w)) / _prior_bpp(quality)
 
-        if abs(current_size_kb - TARGET_PREVIEW_SIZE_KB) <= TARGET_SIZE_TOLERANCE_KB:
-            best_quality = current_quality
+        if abs(size - target_bytes) <= tolerance_bytes:
             break
-        elif current_size_kb > TARGET_PREVIEW_SIZE_KB:
-            high_quality = current_quality - 1
+        if size > target_bytes:
+            high_quality = quality - 1
         else:
-            low_quality = current_quality + 1
-        
-        best_quality = current_quality
+            low_quality = quality + 1
+        if low_quality > high_quality:
+            break
+        quality = min(high_quality, max(low_quality, _quality_for_bpp(target_bpp, complexity)))
+        if quality in tried:
+            break  # The estimate has converged on a quality already encoded
+
+    if not tried:
+        cv2.imwrite(output_path, cv_image, [cv2.IMWRITE_JPEG_QUALITY, 25])
+        return {"quality": 25, "size_kb": os.path.getsize(output_path) / 1024, "encodes": 0, "encode_ms": (time.perf_counter() - start) * 1000}
 
-    cv2.imwrite(output_path, cv_image, [cv2.IMWRITE_JPEG_QUALITY, best_quality])
-    final_size = os.path.getsize(output_path) / 1024
-    print(f"Saved {os.path.basename(output_path)} with quality {best_quality} -> {final_size:.2f} KB (Target: {TARGET_PREVIEW_SIZE_KB} KB)")
+    # Closest to the target, preferring results that do not overshoot the tolerance band
+    best_quality = min(tried, key=lambda q: (len(tried[q]) > target_bytes + tolerance_bytes, abs(len(tried[q]) - target_bytes)))
+    best_buffer = tried[best_quality]
+    history.append((len(best_buffer) * 8 / (h * w)) / _prior_bpp(best_quality))
+    with open(output_path, "wb") as f:
+        f.write(best_buffer.tobytes())
+
+    stats = {"quality": best_quality, "size_kb": len(best_buffer) / 1024, "encodes": len(tried), "encode_ms": (time.perf_counter() - start) * 1000}
+    print(f"Saved {os.path.basename(output_path)} with quality {best_quality} -> {stats['size_kb']:.2f} KB "
+          f"(Target: {TARGET_PREVIEW_SIZE_KB} KB) in {stats['encodes']} encodes, {stats['encode_ms']:.1f} ms")
+    return stats
 
 # --- REUSABLE PREVIEW GENERATION ---
-# --- REPLACE THE OLD FUNCTION WITH THIS ONE ---
+def preview_variant_paths(collection_name: str, original_path: str):
+    """Per-collection file path of every enabled preview variant of an original."""
+    stem, _ = os.path.splitext(os.path.basename(original_path))
+    paths = {}
+    for variant, (_, ext, subdir) in PREVIEW_VARIANTS.items():
+        filename = os.path.basename(original_path) if ext == "jpg" else f"{stem}.{ext}"
+        paths[variant] = os.path.join(PREVIEW_IMAGE_DIR, collection_name, subdir, filename)
+    return paths
+
+def face_crop_dir(collection_name: str):
+    return os.path.join(PREVIEW_IMAGE_DIR, collection_name, "faces")
+
+def remove_preview_images(collection_name: str, original_path: str):
+    """
+    Unlinks a collection's previews and face crops of an original. Cache entries nothing
+    links any more are removed by the next prune_preview_cache().
+    """
+    for preview_file in preview_variant_paths(collection_name, original_path).values():
+        if os.path.exists(preview_file): os.remove(preview_file)
+    stem, _ = os.path.splitext(os.path.basename(original_path))
+    for crop_file in glob.glob(os.path.join(glob.escape(face_crop_dir(collection_name)), f"{glob.escape(stem)}_face*.jpg")):
+        os.remove(crop_file)
+
+def remove_collection_previews(collection_name: str):
+    """Deletes a collection's preview folder, then the cache entries only it was using."""
+    shutil.rmtree(os.path.join(PREVIEW_IMAGE_DIR, collection_name), ignore_errors=True)
+    prune_preview_cache()
+
+def _cache_path(render_key: str, variant: str):
+    _, ext, _ = PREVIEW_VARIANTS[variant]
+    return os.path.join(PREVIEW_RENDER_CACHE_DIR, render_key[:2], f"{render_key}_{variant}.{ext}")
+
+def prune_preview_cache():
+    """
+    Removes render cache entries no collection preview links any more (link count 1), and the
+    cache folders of earlier render settings, whose entries can never be reused; previews still
+    linking those keep their own copy of the data. Returns the cache's usage after pruning.
+    With the copy fallback of _link_preview every entry has one link, so all old ones go.
+    """
+    usage = {"files": 0, "bytes": 0, "pruned_files": 0, "pruned_bytes": 0}
+    if not os.path.isdir(PREVIEW_CACHE_DIR): return usage
+    for entry in os.scandir(PREVIEW_CACHE_DIR):
+        if entry.path == PREVIEW_RENDER_CACHE_DIR: continue
+        if entry.is_dir(follow_symlinks=False):
+            shutil.rmtree(entry.path, ignore_errors=True)
+        else:
+            os.remove(entry.path)
+    keep_after = time.time() - PREVIEW_CACHE_GRACE_SECONDS
+    for directory, _, filenames in os.walk(PREVIEW_RENDER_CACHE_DIR):
+        for filename in filenames:
+            path = os.path.join(directory, filename)
+            try:
+                stat = os.stat(path)
+                if ".tmp." not in filename and stat.st_nlink <= 1 and stat.st_mtime < keep_after:
+                    os.remove(path)
+                    usage["pruned_files"] += 1
+                    usage["pruned_bytes"] += stat.st_size
+                    continue
+            except FileNotFoundError:
+                continue
+            usage["files"] += 1
+            usage["bytes"] += stat.st_size
+    if usage["pruned_files"]: print(f"--- Pruned {usage['pruned_files']} unused preview cache files ({usage['pruned_bytes'] / 1048576:.1f} MB). ---")
+    return usage
+
+def _link_preview(cache_file: str, preview_file: str):
+    """Points a collection preview at its cache entry: a hard link, or a copy where links are unsupported."""
+    if os.path.exists(preview_file):
+        if os.path.samefile(cache_file, preview_file): return
+        os.remove(preview_file)
+    os.makedirs(os.path.dirname(preview_file), exist_ok=True)
+    try:
+        os.link(cache_file, preview_file)
+    except OSError:
+        shutil.copyfile(cache_file, preview_file)
+
+def _render_preview_variants(data: bytes, render_key: str, collection_name: str):
+    """
+    One decode, resized before anything else, then every variant is encoded from the
+    watermarked preview. Returns the milliseconds spent encoding, or None if undecodable.
+    """
+    img = decode_query_image(data, PREVIEW_MAX_SIDE)  # JPEGs are reduced by the decoder itself
+    if img is None:
+        return None
+    (h, w) = img.shape[:2]
+    font_scale = max(0.5, h / 700)
+    thickness = max(1, int(h / 300))
+    cv2.putText(img, WATERMARK_TEXT, (20, h - 20), cv2.FONT_HERSHEY_SIMPLEX, font_scale, (255, 255, 255, 128), thickness, cv2.LINE_AA)
+
+    encode_start = time.perf_counter()
+    for variant, (max_side, ext, _) in PREVIEW_VARIANTS.items():
+        variant_img = img
+        if max_side < max(h, w):
+            scale = max_side / max(h, w)
+            variant_img = cv2.resize(img, (int(w * scale), int(h * scale)), interpolation=cv2.INTER_AREA)
+        cache_file = _cache_path(render_key, variant)
+        os.makedirs(os.path.dirname(cache_file), exist_ok=True)
+        tmp_file = f"{cache_file}.{os.getpid()}.tmp.{ext}"
+        if variant == "preview":
+            save_image_to_target_size(variant_img, tmp_file, history_key=collection_name)
+        elif ext == "webp":
+            cv2.imwrite(tmp_file, variant_img, [cv2.IMWRITE_WEBP_QUALITY, PREVIEW_WEBP_QUALITY])
+        else:
+            cv2.imwrite(tmp_file, variant_img, [cv2.IMWRITE_JPEG_QUALITY, PREVIEW_THUMB_QUALITY])
+        os.replace(tmp_file, cache_file)  # Atomic, so concurrent workers never see half-written entries
+    return (time.perf_counter() - encode_start) * 1000
+
 def create_preview_image(original_path: str, collection_name: str):
     """
-    Creates a watermarked, web-optimized preview image and saves it
-    into a subdirectory named after its collection.
+    Creates the watermarked preview variants (lightbox preview, grid thumbnail and
+    optional WebP) of an original and links them into a subdirectory named after its
+    collection. Renders are cached under a key of the source content hash and the
+    render settings, so they are only redone when either changes.
+    Returns (preview_path, encode_ms); encode_ms is 0 when the cache already had the renders.
     """
     if not os.path.exists(original_path):
-        return None
+        return None, 0.0
+
+    preview_paths = preview_variant_paths(collection_name, original_path)
+    try:
+        with open(original_path, "rb") as f:
+            data = f.read()
+        render_key = hashlib.sha1(hashlib.sha1(data).digest() + PREVIEW_RENDER_SIGNATURE.encode()).hexdigest()
+        encode_ms = 0.0
+        for attempt in range(2):
+            if attempt or not all(os.path.exists(_cache_path(render_key, variant)) for variant in PREVIEW_VARIANTS):
+                encode_ms = _render_preview_variants(data, render_key, collection_name)
+                if encode_ms is None:
+                    return None, 0.0
+            try:
+                for variant, preview_file in preview_paths.items():
+                    _link_preview(_cache_path(render_key, variant), preview_file)
+                return preview_paths["preview"], encode_ms
+            except FileNotFoundError:
+                if attempt: raise  # Otherwise pruned between the check and the link: render it again
+    except Exception as e:
+        print(f"Error creating instant preview for {original_path}: {e}")
+        return None, 0.0
+
+# --- INGEST PIPELINE WORKERS ---
+# These run inside worker processes, so they must stay at module level to be picklable.
+def _init_embed_worker(intra_op_threads: int):
+    """Loads the InsightFace model once per worker process, its ONNX sessions capped at intra_op_threads."""
+    cv2.setNumThreads(1)
+    os.environ["OMP_NUM_THREADS"] = str(intra_op_threads)  # For OpenMP builds of onnxruntime, read when the sessions are created
+    get_model("ingest", intra_op_threads=intra_op_threads)
 
-    # CHANGE 1: Construct the new path with the collection name as a subfolder
-    preview_path = os.path.join(PREVIEW_IMAGE_DIR, collection_name, os.path.basename(original_path))
+def _init_preview_worker():
+    cv2.setNumThreads(1)
 
-    if os.path.exists(preview_path):
-        return preview_path
+def face_metadata(img, face, crop_path: str = None):
+    """
+    The per-face fields stored next to an embedding: bbox as fractions of the image size
+    (so it maps onto any preview size), detection score, shorter bbox side in pixels and,
+    if crop_path is given, a small JPEG crop of the face written there.
+    """
+    h, w = img.shape[:2]
+    x1, y1, x2, y2 = [float(v) for v in face.bbox]
+    meta = {
+        "bbox": [round(max(0.0, x1 / w), 4), round(max(0.0, y1 / h), 4), round(min(1.0, x2 / w), 4), round(min(1.0, y2 / h), 4)],
+        "det_score": round(float(face.det_score), 4),
+        "face_size": round(min(x2 - x1, y2 - y1), 1),
+        "face_crop": "",
+    }
+    if crop_path:
+        margin_x, margin_y = (x2 - x1) * FACE_CROP_MARGIN, (y2 - y1) * FACE_CROP_MARGIN
+        crop = img[max(0, int(y1 - margin_y)):min(h, int(y2 + margin_y)), max(0, int(x1 - margin_x)):min(w, int(x2 + margin_x))]
+        if crop.size:
+            scale = FACE_CROP_SIZE / max(crop.shape[:2])
+            if scale < 1:
+                crop = cv2.resize(crop, (max(1, int(crop.shape[1] * scale)), max(1, int(crop.shape[0] * scale))), interpolation=cv2.INTER_AREA)
+            if cv2.imwrite(crop_path, crop, [cv2.IMWRITE_JPEG_QUALITY, 80]):
+                meta["face_crop"] = crop_path
+    return meta
+
+def _decode_and_embed(img_path: str, crop_dir: str = None):
+    """
+    Decode stage + detect/embed stage for one image. Pixels never leave the worker.
+    Returns (img_path, embeddings, faces_meta, content_hash, image_info); embeddings is None
+    if the file could not be read. image_info holds capture_date ("YYYY-MM-DD" or None),
+    capture_time (epoch seconds or None) and phash. Face crops are written to crop_dir when one is given.
+    """
     try:
-        img = cv2.imread(original_path)
+        with open(img_path, "rb") as f:
+            data = f.read()
+        content_hash = hashlib.sha1(data).hexdigest()
+        capture_time = _exif_capture_time(data)
+        image_info = {"capture_date": capture_time.date().isoformat() if capture_time else capture_date_from_path(img_path),
+                      "capture_time": capture_time.timestamp() if capture_time else None, "phash": None}
+        img = cv2.imdecode(np.frombuffer(data, np.uint8), cv2.IMREAD_COLOR)
         if img is None:
-            return None
-        preview_img = img.copy()
-        (h, w) = preview_img.shape[:2]
-        font_scale = max(1, h / 700)
-        thickness = max(1, int(h / 300))
-        cv2.putText(preview_img, WATERMARK_TEXT, (20, h - 20), cv2.FONT_HERSHEY_SIMPLEX, font_scale, (255, 255, 255, 128), thickness, cv2.LINE_AA)
-
-        # CHANGE 2: Ensure the subdirectory exists before saving the file
-        os.makedirs(os.path.dirname(preview_path), exist_ok=True)
-        
-        save_image_to_target_size(preview_img, preview_path)
-        return preview_path
+            print(f"Warning: Could not read image {img_path}")
+            return img_path, None, None, content_hash, image_info
+        image_info["phash"] = perceptual_hash(img)
+        faces = get_model("ingest").get(img)
+        stem, _ = os.path.splitext(os.path.basename(img_path))
+        if crop_dir and faces: os.makedirs(crop_dir, exist_ok=True)
+        faces_meta = [face_metadata(img, face, os.path.join(crop_dir, f"{stem}_face{i}.jpg") if crop_dir else None) for i, face in enumerate(faces)]
+        return img_path, [face.normed_embedding for face in faces], faces_meta, content_hash, image_info
     except Exception as e:
-        print(f"Error creating instant preview for {original_path}: {e}")
+        print(f"Error processing {img_path}: {e}")
+        return img_path, None, None, None, None
+
+def _bounded_map(executor, fn, items, max_in_flight: int, *args):
+    """Yields results of fn(item, *args) as they complete, never holding more than max_in_flight pending tasks."""
+    pending = set()
+    for item in items:
+        if len(pending) >= max_in_flight:
+            done, pending = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                yield future.result()
+        pending.add(executor.submit(fn, item, *args))
+    while pending:
+        done, pending = wait(pending, return_when=FIRST_COMPLETED)
+        for future in done:
+            yield future.result()
+
+# --- FILE MANIFEST HELPERS ---
+def scan_image_directory(image_directory: str):
+    """Stats every image in the folder in a single pass: {normalized_path: (size, mtime_ns)}."""
+    disk_files = {}
+    with os.scandir(image_directory) as entries:
+        for entry in entries:
+            if entry.is_file() and entry.name.lower().endswith(IMAGE_EXTENSIONS):
+                stat = entry.stat()
+                disk_files[os.path.normpath(os.path.join(image_directory, entry.name))] = (stat.st_size, stat.st_mtime_ns)
+    return disk_files
+
+def file_content_hash(path: str):
+    sha1 = hashlib.sha1()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(1024 * 1024), b""):
+            sha1.update(chunk)
+    return sha1.hexdigest()
+
+def plan_manifest_changes(disk_files: dict, manifest: dict):
+    """
+    Diffs a folder scan against the manifest. Files whose size and mtime match are
+    skipped outright; files whose stat changed are hashed, so a touched-but-identical
+    file is only re-stamped while real edits are re-embedded.
+    Returns (to_index, replaced, touched_entries, removed).
+    """
+    to_index, replaced, touched_entries = [], [], []
+    for path, (size, mtime_ns) in disk_files.items():
+        entry = manifest.get(path)
+        if entry is None:
+            to_index.append(path)
+            continue
+        if entry.file_size == size and entry.mtime_ns == mtime_ns:
+            continue
+        content_hash = file_content_hash(path)
+        if content_hash == entry.content_hash:
+            touched_entries.append({"image_path": path, "file_size": size, "mtime_ns": mtime_ns, "content_hash": content_hash, "face_count": entry.face_count})
+        else:
+            replaced.append(path)
+            to_index.append(path)
+    removed = [path for path in manifest if path not in disk_files]
+    return to_index, replaced, touched_entries, removed
+
+# --- BURST COLLAPSING ---
+class BurstDetector:
+    """
+    Finds near-duplicate frames within one ingest run. A frame joins a recent representative
+    when both show the same number of faces, every face is within BURST_EMBEDDING_DISTANCE,
+    and the frames either look the same (dHash) or were shot within BURST_WINDOW_SECONDS.
+    """
+
+    def __init__(self, lookback: int = BURST_LOOKBACK):
+        self._recent = deque(maxlen=lookback)  # (image_path, partition, phash, capture_time, embeddings)
+
+    def representative_for(self, img_path: str, partition: str, image_info: dict, embeddings: list):
+        """The representative this frame collapses into, or None after registering it as a new representative."""
+        vectors = np.asarray(embeddings, dtype=np.float32)
+        phash, capture_time = image_info.get("phash"), image_info.get("capture_time")
+        for rep_path, rep_partition, rep_phash, rep_time, rep_vectors in reversed(self._recent):
+            if rep_partition != partition or len(rep_vectors) != len(vectors): continue
+            looks_same = phash is not None and rep_phash is not None and bin(phash ^ rep_phash).count("1") <= BURST_HASH_DISTANCE
+            same_moment = capture_time is not None and rep_time is not None and abs(capture_time - rep_time) <= BURST_WINDOW_SECONDS
+            if not (looks_same or same_moment): continue
+            if ((2.0 - 2.0 * (vectors @ rep_vectors.T)).min(axis=1) <= BURST_EMBEDDING_DISTANCE).all():
+                return rep_path
+        self._recent.append((img_path, partition, phash, capture_time, vectors))
+        return None
+
+# --- QUERY EMBEDDING CACHE ---
+# An upload's content hash -> its detected faces, so a guest re-running the same selfie skips detection entirely.
+query_embedding_cache = TTLCache(QUERY_CACHE_MAX_ENTRIES, QUERY_CACHE_TTL_SECONDS)
+
+# --- SEARCH HELPERS ---
+def embed_query_image(query_image_np):
+    """Detects every face in a query image and returns their normalized embeddings."""
+    if query_image_np is None: return []
+    return [face.normed_embedding for face in get_model("query").get(query_image_np)]
+
+def embed_query_bytes(contents: bytes):
+    """
+    Decodes and embeds an uploaded query image, served from the query cache when the
+    same bytes were seen recently. Returns (embeddings, bboxes).
+    """
+    key = hashlib.sha256(contents).hexdigest()
+    cached = query_embedding_cache.get(key)
+    if cached is not None: return cached
+    img = decode_query_image(contents)
+    faces = get_model("query").get(img) if img is not None else []
+    value = ([face.normed_embedding for face in faces], [face.bbox.tolist() for face in faces])
+    query_embedding_cache.put(key, value)
+    return value
+
+def best_hits_per_path(list_of_results, distance_threshold: float = DISTANCE_THRESHOLD):
+    """
+    Keeps confident hits only, with the best distance per image path across all query faces,
+    closest first. Each result keeps the face metadata (bbox, det_score, ...) of its best hit.
+    """
+    best_hits = {}
+    for hits_for_one_face in list_of_results:
+        for hit in hits_for_one_face:
+            if hit["distance"] >= distance_threshold: continue
+            path = hit["image_path"]
+            if path not in best_hits or hit["distance"] < best_hits[path]["distance"]:
+                best_hits[path] = {key: value for key, value in hit.items() if key != "row_id"}
+    return sorted(best_hits.values(), key=lambda x: x['distance'])
+
+# --- GUEST FACE PROFILES ---
+def main_face_index(bboxes: list):
+    """Index of the largest detected face, taken to be the person holding the camera."""
+    return max(range(len(bboxes)), key=lambda i: (bboxes[i][2] - bboxes[i][0]) * (bboxes[i][3] - bboxes[i][1]))
+
+def blend_face_profile(profile_embedding, sample_count: int, new_embedding):
+    """
+    Folds a new selfie embedding into a guest's profile as a weighted running mean.
+    Returns (embedding, sample_count), or None when the selfie does not match the
+    enrolled face (e.g. the guest searched for a friend), leaving the profile alone.
+    """
+    new_embedding = np.asarray(new_embedding, dtype=np.float32)
+    if profile_embedding is None:
+        return new_embedding / np.linalg.norm(new_embedding), 1
+    profile_embedding = np.asarray(profile_embedding, dtype=np.float32)
+    if 2.0 - 2.0 * float(profile_embedding @ new_embedding) >= PROFILE_MATCH_THRESHOLD:
         return None
+    blended = profile_embedding * min(sample_count, PROFILE_MAX_SAMPLES) + new_embedding
+    return blended / np.linalg.norm(blended), sample_count + 1
+
+class GuestProfileIndex:
+    """
+    A vector collection mirroring every enrolled guest face (row key: the guest id), so an
+    ingest batch can be matched against all enrolled guests with one search: the reverse of
+    a guest search. MySQL stays the source of truth; the index is reconciled with it on load.
+    """
+
+    def __init__(self):
+        self._store = None
+        self._lock = threading.Lock()
+
+    def _get_store(self):
+        with self._lock:
+            if self._store is None:
+                store = open_vector_store(GUEST_PROFILE_COLLECTION, VECTOR_DIMENSION)
+                store.load(GUEST_PROFILE_INDEX_PROFILE, METRIC_TYPE)
+                self._reconcile(store)
+                self._store = store
+            return self._store
+
+    def _reconcile(self, store):
+        """
+        Compares the guest ids in the index with the enrolled guests in MySQL and fixes only
+        the difference: missing or duplicated guests are (re)inserted, guests no longer
+        enrolled are removed. Reads rows rather than num_entities, which misses unflushed rows.
+        """
+        indexed = Counter(path for batch in store.iter_image_paths() for path in batch)
+        with db.SessionLocal() as session:
+            enrolled = {str(row.guest_id) for row in session.query(db.GuestFaceProfile.guest_id).all()}
+            stale = [key for key in indexed if key not in enrolled]
+            repaired = [key for key in enrolled if indexed[key] != 1]
+            if not stale and not repaired: return
+            profiles = session.query(db.GuestFaceProfile).filter(db.GuestFaceProfile.guest_id.in_([int(key) for key in repaired])).all() if repaired else []
+        store.delete_paths(stale + [key for key in repaired if indexed[key]])
+        if profiles:
+            store.insert([str(profile.guest_id) for profile in profiles], [np.frombuffer(profile.embedding, dtype=np.float32) for profile in profiles])
+        store.flush()
+        print(f"--- Guest profile index reconciled: {len(profiles)} guests (re)indexed, {len(stale)} removed. ---")
+
+    def upsert(self, guest_id: int, embedding):
+        store = self._get_store()
+        store.delete_paths([str(guest_id)])
+        store.insert([str(guest_id)], [np.asarray(embedding, dtype=np.float32)])
+        store.flush()
+
+    def remove(self, guest_ids: list):
+        if not guest_ids: return
+        store = self._get_store()
+        store.delete_paths([str(guest_id) for guest_id in guest_ids])
+        store.flush()
+
+    def match(self, image_paths: list, embeddings: list):
+        """Returns (guest_id, image_path, distance) for every new face close enough to an enrolled guest."""
+        if not embeddings: return []
+        matches = []
+        for image_path, hits in zip(image_paths, self._get_store().search(embeddings, GUEST_MATCH_TOP_K)):
+            for hit in hits:
+                if hit["distance"] < GUEST_MATCH_THRESHOLD:
+                    matches.append((int(hit["image_path"]), image_path, hit["distance"]))
+        return matches
+
+
+guest_profile_index = GuestProfileIndex()
 
 # --- CORE LOGIC CLASS ---
 class FaceSearchEngine:
-    """Manages face search logic and Milvus collection interactions."""
+    """Manages face search logic and vector store interactions (Milvus or the local backend)."""
 
     def __init__(self, collection_name: str):
         if not collection_name: raise ValueError("Collection name must be provided.")
         self.collection_name = collection_name
-        self.app_model = get_model()
-        self.collection = None
-
-    def connect_to_milvus(self):
-        if not connections.has_connection("default"):
-            connections.connect("default", host=MILVUS_HOST, port=MILVUS_PORT)
-
-    def load_or_create_index(self):
-        self.connect_to_milvus()
-        if not utility.has_collection(self.collection_name):
-            fields = [
-                FieldSchema(name="pk_id", dtype=DataType.INT64, is_primary=True, auto_id=True),
-                FieldSchema(name="image_path", dtype=DataType.VARCHAR, max_length=1024),
-                FieldSchema(name="embedding", dtype=DataType.FLOAT_VECTOR, dim=VECTOR_DIMENSION)
-            ]
-            schema = CollectionSchema(fields, f"Face search collection: {self.collection_name}")
-            self.collection = Collection(name=self.collection_name, schema=schema)
-            index_params = {"metric_type": METRIC_TYPE, "index_type": "IVF_FLAT", "params": {"nlist": 1024}}
-            self.collection.create_index(field_name="embedding", index_params=index_params)
-        else:
-            self.collection = Collection(name=self.collection_name)
-        self.collection.load()
+        self.app_model = get_model("query")
+        self.store = None
+        self._measured_load_events = 0
+        self._burst_sizes = None  # (loaded_at, {representative_path: collapsed members})
+
+    def load_or_create_index(self, index_profile: str = None, metric_type: str = None):
+        """Loads the collection, creating it with the given index profile and metric if it does not exist yet."""
+        store = open_vector_store(self.collection_name, VECTOR_DIMENSION)
+        store.load(index_profile, metric_type or METRIC_TYPE)
+        self.store = store
+
+    def rebuild_index(self, index_profile: str, metric_type: str = None):
+        """Rebuilds the vector index with another profile/metric. Raw vectors are kept, so nothing is re-embedded."""
+        if self.store is None: self.load_or_create_index()
+        self.store.rebuild_index(index_profile, metric_type)
+        return {"status": "success", "message": f"Rebuilt '{self.collection_name}' as {self.store.index_type} ({self.store.metric_type}).",
+                "index_type": self.store.index_type, "metric_type": self.store.metric_type}
+
+    def estimated_memory_mb(self):
+        """Rough in-memory size of the loaded collection: raw float32 vectors plus path overhead."""
+        if self.store is None: return 0.0
+        return self.store.estimated_memory_mb()
 
     def search_person(self, query_image_np, top_k=100):
-        if self.collection is None: self.load_or_create_index()
-        faces = self.app_model.get(query_image_np)
-        if not faces: return {"status": "No faces detected in the uploaded image.", "results": []}
-        query_embeddings = [face.normed_embedding for face in faces]
-        search_params = {"metric_type": METRIC_TYPE, "params": {"nprobe": NPROBE}}
-        list_of_results = self.collection.search(data=query_embeddings, anns_field="embedding", param=search_params, limit=top_k, output_fields=["image_path"])
-        all_hits = []
-        for hits_for_one_face in list_of_results:
-            for hit in hits_for_one_face:
-                if hit.distance < DISTANCE_THRESHOLD:
-                    all_hits.append({"image_path": hit.entity.get("image_path"), "distance": hit.distance})
-        if not all_hits: return {"status": f"Detected {len(faces)} face(s), but no confident matches found.", "results": []}
-        best_hits = {}
-        for hit in all_hits:
-            path = hit["image_path"]
-            if path not in best_hits or hit["distance"] < best_hits[path]["distance"]:
-                best_hits[path] = hit
-        final_results = sorted(list(best_hits.values()), key=lambda x: x['distance'])
+        return self.search_faces(embed_query_image(query_image_np), top_k=top_k)
+
+    def search_faces(self, query_embeddings: list, top_k=100, dates: list = None, zones: list = None):
+        """Same response as search_person, for query faces that were already embedded (e.g. from the cache)."""
+        if not query_embeddings: return {"status": "No faces detected in the uploaded image.", "results": []}
+        final_results = self.search_embeddings(query_embeddings, top_k=top_k, dates=dates, zones=zones)
+        if not final_results: return {"status": f"Detected {len(query_embeddings)} face(s), but no confident matches found.", "results": []}
         status_msg = f"Search complete. Found {len(final_results)} potential matches."
         return {"status": status_msg, "results": final_results}
 
-    # --- REPLACE your existing 'add_images_from_directory' function with this complete code ---
+    def search_embeddings(self, query_embeddings: list, top_k=100, dates: list = None, zones: list = None):
+        """
+        Searches already-computed query embeddings, so one detection can be reused across collections.
+        dates ("YYYY-MM-DD") and zones restrict the search to the matching partitions.
+        """
+        if self.store is None: self.load_or_create_index()
+        partitions = select_partitions(self.store.partition_names(), dates, zones)
+        return self._with_burst_sizes(best_hits_per_path(self._search_store(query_embeddings, top_k, partitions), self._distance_threshold()))
 
-    def add_images_from_directory(self, image_directory: str):
+    def _with_burst_sizes(self, results: list):
+        """Marks results standing in for collapsed burst frames with burst_size, so the UI can expand them."""
+        cached = self._burst_sizes
+        if cached is None or time.monotonic() - cached[0] > BURST_SIZES_TTL_SECONDS:
+            with db.SessionLocal() as session:
+                cached = self._burst_sizes = (time.monotonic(), db.get_burst_sizes(session, self.collection_name))
+        for result in results:
+            if result["image_path"] in cached[1]: result["burst_size"] = cached[1][result["image_path"]]
+        return results
+
+    def _search_store(self, query_embeddings: list, top_k: int, partitions: list = None):
+        """
+        Vector search that skips low-confidence and tiny indexed faces within the same query.
+        With RERANK, a wider but cheaper ANN pass gathers candidates which are then re-scored exactly.
+        """
+        if not self._reranking():
+            results = self.store.search(query_embeddings, top_k, min_det_score=MIN_FACE_DET_SCORE, min_face_size=MIN_FACE_SIZE, partitions=partitions)
+        else:
+            candidates = self.store.search(query_embeddings, top_k * RERANK_CANDIDATE_FACTOR, min_det_score=MIN_FACE_DET_SCORE,
+                                           min_face_size=MIN_FACE_SIZE, nprobe=RERANK_NPROBE, partitions=partitions)
+            results = self._rerank(query_embeddings, candidates, top_k)
+        load_events = getattr(self.store, "load_events", 0)
+        if load_events != self._measured_load_events:
+            # Lazily loaded partitions grew the collection's footprint; let the registry re-measure it.
+            self._measured_load_events = load_events
+            engine_registry.refresh(self.collection_name)
+        return results
+
+    def _reranking(self):
+        return RERANK and self.store.index_type != "EXACT"  # The local backend's distances are already exact
+
+    def _distance_threshold(self):
+        return RERANK_DISTANCE_THRESHOLD if self._reranking() else DISTANCE_THRESHOLD
+
+    def _rerank(self, query_embeddings: list, candidates: list, top_k: int):
+        """
+        Exact re-ranking stage. The union of every query face's candidates is fetched from the store
+        in one bulk read and scored against all query faces with one matrix product, so a face found
+        by only one query face is still scored against the others. Returns hits in search() format.
+        """
+        hits_by_row = {}
+        for hits_for_one_face in candidates:
+            for hit in hits_for_one_face:
+                hits_by_row.setdefault(hit["row_id"], hit)
+        if not hits_by_row:
+            return [[] for _ in query_embeddings]
+        row_ids, stored = self.store.get_embeddings(list(hits_by_row))  # Rows deleted since the search are dropped
+        if not row_ids:
+            return [[] for _ in query_embeddings]
+        queries = np.asarray(query_embeddings, dtype=np.float32).reshape(-1, stored.shape[1])
+        distances = 2.0 - 2.0 * (queries @ stored.T)  # Squared L2 between unit vectors
+        keep = min(top_k, len(row_ids))
+        reranked = []
+        for face_distances in distances:
+            best = np.argpartition(face_distances, keep - 1)[:keep]
+            best = best[np.argsort(face_distances[best])]
+            reranked.append([{**hits_by_row[row_ids[i]], "distance": float(face_distances[i])} for i in best])
+        return reranked
+
+    def search_people(self, query_images_np: list, top_k=100):
+        """
+        Searches several query images at once (a family group shot, or multiple selfies).
+        Faces from every image go to the vector store in a single search call; results are returned
+        merged across all images and per image, keeping the best distance per path.
+        """
+        if self.store is None: self.load_or_create_index()
+        faces_per_image = [self.app_model.get(img) if img is not None else [] for img in query_images_np]
+        query_embeddings, owners = [], []
+        for image_index, faces in enumerate(faces_per_image):
+            for face in faces:
+                query_embeddings.append(face.normed_embedding)
+                owners.append(image_index)
+        per_image = [{"index": i, "faces_detected": len(faces), "results": []} for i, faces in enumerate(faces_per_image)]
+        if not query_embeddings:
+            return {"status": "No faces detected in the uploaded images.", "results": [], "per_image": per_image}
+
+        list_of_results = self._search_store(query_embeddings, top_k)
+        hits_per_image = [[] for _ in query_images_np]
+        for image_index, hits_for_one_face in zip(owners, list_of_results):
+            hits_per_image[image_index].append(hits_for_one_face)
+        for entry, hit_lists in zip(per_image, hits_per_image):
+            entry["results"] = self._with_burst_sizes(best_hits_per_path(hit_lists, self._distance_threshold()))
+
+        final_results = self._with_burst_sizes(best_hits_per_path(list_of_results, self._distance_threshold()))
+        if not final_results:
+            return {"status": f"Detected {len(query_embeddings)} face(s), but no confident matches found.", "results": [], "per_image": per_image}
+        status_msg = f"Search complete. Found {len(final_results)} potential matches."
+        return {"status": status_msg, "results": final_results, "per_image": per_image}
+
+    def _insert_batch(self, image_path_list: list, embedding_list: list, faces_meta_list: list, partition_list: list, manifest_entries: list, burst_members: list):
+        """
+        Insert stage: flushes one bounded chunk of rows to the vector store (each into its date/zone
+        partition), links collapsed burst frames and records the chunk's files in the manifest, then
+        matches the chunk against enrolled guests. Returns the guest matches recorded.
+        """
+        if embedding_list:
+            self.store.insert(image_path_list, embedding_list, faces_meta_list, partition_list)
+        if manifest_entries:
+            with db.SessionLocal() as session:
+                # Links first: a burst frame in the manifest but without its link would vanish from search
+                db.record_burst_members(session, self.collection_name, burst_members)
+                db.upsert_manifest_entries(session, self.collection_name, manifest_entries)
+        return self._match_enrolled_guests(image_path_list, embedding_list)
+
+    def _match_enrolled_guests(self, image_path_list: list, embedding_list: list):
+        """One search of the whole batch against the guest profile index; failures never fail the ingest."""
+        if not embedding_list: return 0
         try:
-            # --- Load the collection at the start of the operation ---
-            self.load_or_create_index()
-            
-            # Get a list of image paths already processed and stored in Milvus
-            res = self.collection.query(expr="", output_fields=["image_path"], limit=16384)
-            processed_paths = {os.path.normpath(item['image_path']).lower() for item in res}
-            
-            # Get a list of all valid image files currently on the disk
-            all_disk_images = [os.path.normpath(os.path.join(image_directory, f)) for f in os.listdir(image_directory) if f.lower().endswith(('.png', '.jpg', '.jpeg'))]
-            
-            # Determine which images are new and need to be processed
-            new_images = [p for p in all_disk_images if p.lower() not in processed_paths]
-            
+            matches = guest_profile_index.match(image_path_list, embedding_list)
+            with db.SessionLocal() as session:
+                db.record_guest_matches(session, self.collection_name, matches)
+            return len(matches)
+        except Exception as e:
+            print(f"--- Could not match new photos against enrolled guests: {e} ---")
+            return 0
+
+    def _load_manifest(self, disk_files: dict):
+        with db.SessionLocal() as session:
+            manifest = db.get_manifest(session, self.collection_name)
+            if not manifest and self.store.num_entities() > 0:
+                manifest = self._bootstrap_manifest(session, disk_files)
+        return manifest
+
+    def _bootstrap_manifest(self, session, disk_files: dict):
+        """One-time migration for collections indexed before the manifest existed: seeds it from the vector store."""
+        print(f"--- Building file manifest for existing collection: {self.collection_name} ---")
+        face_counts = {}
+        for batch in self.store.iter_image_paths(MANIFEST_SEED_BATCH_SIZE):
+            for image_path in batch:
+                path = os.path.normpath(image_path)
+                face_counts[path] = face_counts.get(path, 0) + 1
+        entries = []
+        for path, face_count in face_counts.items():
+            if path in disk_files:
+                size, mtime_ns = disk_files[path]
+                entries.append({"image_path": path, "file_size": size, "mtime_ns": mtime_ns, "content_hash": file_content_hash(path), "face_count": face_count})
+            else:
+                # Already gone from disk; kept so the next sync removes its rows.
+                entries.append({"image_path": path, "file_size": -1, "mtime_ns": -1, "content_hash": None, "face_count": face_count})
+        db.upsert_manifest_entries(session, self.collection_name, entries)
+        return db.get_manifest(session, self.collection_name)
+
+    def add_images_from_directory(self, image_directory: str, workers: int = None, preview_workers: int = None, progress_callback=None, zone: str = None):
+        """
+        Indexes every new or changed image in the directory with a staged, multi-process
+        pipeline: decode + detect/embed in model-loaded worker processes, previews in a
+        separate pool, and inserts flushed to the store every INSERT_BATCH_SIZE rows.
+        Rows go to a partition per capture date (EXIF, else a date in the folder path) and zone.
+        With BURST_COLLAPSE, near-identical burst frames are linked to one indexed representative.
+        The file manifest decides what to index, so unchanged files never reach the store.
+        progress_callback, if given, receives a dict of images_total, images_decoded,
+        faces_embedded and rows_inserted after every image and every insert.
+        """
+        workers = workers or INGEST_WORKERS
+        preview_workers = preview_workers or PREVIEW_WORKERS
+        progress = {"images_total": 0, "images_decoded": 0, "faces_embedded": 0, "rows_inserted": 0}
+        def report():
+            if progress_callback: progress_callback(dict(progress))
+        try:
+            # --- Reuse the loaded collection if the registry already holds it ---
+            if self.store is None: self.load_or_create_index()
+            if not os.path.isdir(image_directory): return {"status": "error", "message": f"Source directory '{image_directory}' not found."}
+
+            disk_files = scan_image_directory(image_directory)
+            manifest = self._load_manifest(disk_files)
+            new_images, replaced, touched_entries, _ = plan_manifest_changes(disk_files, manifest)
+
+            if touched_entries:
+                with db.SessionLocal() as session:
+                    db.upsert_manifest_entries(session, self.collection_name, touched_entries)
             if not new_images:
                 return {"status": "Collection is already up-to-date.", "images_added": 0, "faces_added": 0}
+
+            if replaced:
+                # Edited files: drop their old faces and stale previews before re-indexing.
+                self.store.delete_paths(replaced)
+                for path in replaced:
+                    remove_preview_images(self.collection_name, path)
+                prune_preview_cache()
+                with db.SessionLocal() as session:
+                    db.delete_guest_matches(session, self.collection_name, replaced)
+                    orphaned = db.delete_bursts(session, self.collection_name, replaced)
+                # Burst frames of an edited representative are re-indexed along with it
+                new_images += [path for path in orphaned if path in disk_files and path not in new_images]
+            new_images.sort()  # Burst frames are usually numbered consecutively; keep them adjacent
             
-            image_path_list, embedding_list, images_processed_count = [], [], 0
-            print(f"Processing {len(new_images)} new images from '{image_directory}'...")
-            
-            # Loop through only the new images
-            for img_path in new_images:
-                try:
-                    # ================================================================= #
-                    # THE ONLY CHANGE IS ON THE NEXT LINE:
-                    # We now pass `self.collection_name` to create_preview_image
-                    # so it knows which subfolder to save the preview in.
-                    create_preview_image(img_path, self.collection_name)
-                    # ================================================================= #
-                    
-                    img = cv2.imread(img_path)
-                    if img is None:
-                        print(f"Warning: Could not read image {img_path}")
-                        continue
-                        
-                    faces = self.app_model.get(img)
-                    if not faces:
+            image_path_list, embedding_list, faces_meta_list, partition_list, manifest_entries, burst_members = [], [], [], [], [], []
+            images_processed_count, faces_added_count, guest_matches_count, bursts_collapsed_count = 0, 0, 0, 0
+            burst_detector = BurstDetector() if BURST_COLLAPSE else None
+            crop_dir = face_crop_dir(self.collection_name) if FACE_CROPS else None
+            progress["images_total"] = len(new_images)
+            report()
+            print(f"Processing {len(new_images)} new images from '{image_directory}' with {workers} embed / {preview_workers} preview workers...")
+
+            # Spawned (not forked) workers so each gets a clean ONNX runtime.
+            mp_context = multiprocessing.get_context("spawn")
+            with ProcessPoolExecutor(max_workers=preview_workers, mp_context=mp_context, initializer=_init_preview_worker) as preview_pool, \
+                 ProcessPoolExecutor(max_workers=workers, mp_context=mp_context, initializer=_init_embed_worker, initargs=(INGEST_THREADS_PER_WORKER,)) as embed_pool:
+
+                # Preview stage runs alongside embedding; results are only needed on disk.
+                preview_futures = [preview_pool.submit(create_preview_image, img_path, self.collection_name) for img_path in new_images]
+
+                for img_path, embeddings, faces_meta, content_hash, image_info in _bounded_map(embed_pool, _decode_and_embed, new_images, workers * MAX_IN_FLIGHT_PER_WORKER, crop_dir):
+                    progress["images_decoded"] += 1
+                    progress["faces_embedded"] += len(embeddings or [])
+                    report()
+                    if embeddings is None:
+                        continue  # Unreadable: left out of the manifest so the next ingest retries it
+                    size, mtime_ns = disk_files[img_path]
+                    manifest_entries.append({"image_path": img_path, "file_size": size, "mtime_ns": mtime_ns, "content_hash": content_hash, "face_count": len(embeddings)})
+                    if not embeddings:
                         continue
-                        
                     images_processed_count += 1
-                    for face in faces:
+                    partition = partition_name(image_info["capture_date"], zone)
+                    representative = burst_detector.representative_for(img_path, partition, image_info, embeddings) if burst_detector else None
+                    if representative:
+                        burst_members.append((img_path, representative))
+                        bursts_collapsed_count += 1
+                        continue
+                    for embedding, face_meta in zip(embeddings, faces_meta):
                         image_path_list.append(img_path)
-                        embedding_list.append(face.normed_embedding)
-                        
-                except Exception as e:
-                    print(f"Error processing {img_path}: {e}")
-            
-            if not embedding_list:
-                return {"status": "New images found, but no new faces could be extracted.", "images_added": images_processed_count, "faces_added": 0}
+                        embedding_list.append(embedding)
+                        faces_meta_list.append(face_meta)
+                        partition_list.append(partition)
+
+                    if len(embedding_list) >= INSERT_BATCH_SIZE:
+                        guest_matches_count += self._insert_batch(image_path_list, embedding_list, faces_meta_list, partition_list, manifest_entries, burst_members)
+                        faces_added_count += len(embedding_list)
+                        progress["rows_inserted"] = faces_added_count
+                        report()
+                        image_path_list, embedding_list, faces_meta_list, partition_list, manifest_entries, burst_members = [], [], [], [], [], []
+
+                guest_matches_count += self._insert_batch(image_path_list, embedding_list, faces_meta_list, partition_list, manifest_entries, burst_members)
+                faces_added_count += len(embedding_list)
+                progress["rows_inserted"] = faces_added_count
+                report()
+
+                encode_times = [encode_ms for _, encode_ms in (future.result() for future in preview_futures) if encode_ms]
+                preview_stats = {"previews_rendered": len(encode_times), "preview_encode_ms_avg": round(float(np.mean(encode_times)), 1) if encode_times else 0.0}
+                if encode_times:
+                    print(f"Rendered {len(encode_times)} previews: {preview_stats['preview_encode_ms_avg']} ms avg, {max(encode_times):.1f} ms max encode time.")
+
+            if not faces_added_count:
+                return {"status": "New images found, but no new faces could be extracted.", "images_added": images_processed_count, "faces_added": 0, **preview_stats}
             
-            # Insert the new data into the Milvus collection
-            self.collection.insert([image_path_list, embedding_list])
-            self.collection.flush()
+            self.store.flush()
             
-            return {"status": f"Successfully added new faces to '{self.collection_name}'.", "images_added": images_processed_count, "faces_added": len(embedding_list)}
+            return {"status": f"Successfully added new faces to '{self.collection_name}'.", "images_added": images_processed_count, "faces_added": faces_added_count,
+                    "burst_frames_collapsed": bursts_collapsed_count, "guest_matches": guest_matches_count, **preview_stats}
 
         finally:
-            # --- Always release the collection when the operation is done ---
-            if self.collection:
-                self.collection.release()
-                print(f"--- Released collection: {self.collection_name} ---")
+            self._burst_sizes = None
+            # The collection stays loaded: new rows are searchable without a reload,
+            # and the registry re-measures it so eviction sees the new size.
+            engine_registry.refresh(self.collection_name)
 
     def sync_directory(self, image_directory: str):
-        if self.collection is None: self.load_or_create_index()
+        if self.store is None: self.load_or_create_index()
         if not os.path.exists(image_directory): return {"status": "error", "message": f"Source directory '{image_directory}' not found."}
-        res = self.collection.query(expr="", output_fields=["image_path"], limit=16384)
-        paths_in_milvus = {os.path.normpath(item['image_path']) for item in res}
-        paths_on_disk = {os.path.normpath(os.path.join(image_directory, f)) for f in os.listdir(image_directory) if f.lower().endswith(('.png', '.jpg', '.jpeg'))}
-        stale_paths = list(paths_in_milvus - paths_on_disk)
+        disk_files = scan_image_directory(image_directory)
+        manifest = self._load_manifest(disk_files)
+        stale_paths = [path for path in manifest if path not in disk_files]
         if not stale_paths: return {"status": "success", "message": "Collection is already in sync.", "removed_count": 0}
-        expr = f'image_path in {stale_paths}'
         try:
-            self.collection.delete(expr)
-            self.collection.flush()
+            self.store.delete_paths(stale_paths)
+            self.store.flush()
+            with db.SessionLocal() as session:
+                orphaned = db.delete_bursts(session, self.collection_name, stale_paths, commit=False)
+                # Burst frames whose representative is gone leave the manifest, so the next ingest indexes them
+                db.delete_manifest_entries(session, self.collection_name, stale_paths + orphaned)
+                db.delete_guest_matches(session, self.collection_name, stale_paths)
             for path in stale_paths:
-                preview_file = os.path.join(PREVIEW_IMAGE_DIR, os.path.basename(path))
-                if os.path.exists(preview_file): os.remove(preview_file)
-            return {"status": "success", "message": f"Successfully removed {len(stale_paths)} stale entries.", "removed_count": len(stale_paths)}
+                remove_preview_images(self.collection_name, path)
+            prune_preview_cache()
+            self._burst_sizes = None
+            engine_registry.refresh(self.collection_name)
+            message = f"Successfully removed {len(stale_paths)} stale entries."
+            if orphaned: message += f" {len(orphaned)} burst frames will be re-indexed by the next update."
+            return {"status": "success", "message": message, "removed_count": len(stale_paths)}
         except Exception as e:
-            return {"status": "error", "message": f"An error occurred during deletion: {e}", "removed_count": 0}
\ No newline at end of file
+            return {"status": "error", "message": f"An error occurred during deletion: {e}", "removed_count": 0}
+
+
+# --- PROCESS-WIDE ENGINE REGISTRY ---
+class EngineRegistry:
+    """
+    Shares one FaceSearchEngine (and its loaded vector store) per collection
+    across all requests. Collections are kept loaded until their combined estimated
+    size exceeds the memory budget, then the least recently used ones are released.
+    A collection is never released while it is leased (see lease()). Leases are per process,
+    while a Milvus release unloads the collection on the server for every worker: their
+    stores reload it on their next search (see MilvusVectorStore._while_loaded).
+    """
+
+    def __init__(self, memory_budget_mb: float):
+        self.memory_budget_mb = memory_budget_mb
+        self._engines = OrderedDict()   # collection_name -> FaceSearchEngine, oldest first
+        self._sizes_mb = {}             # collection_name -> estimated loaded size
+        self._leases = {}               # collection_name -> searches/ingests currently using the engine
+        self._lock = threading.Lock()
+        self._load_locks = {}           # Per-collection locks so one slow load doesn't block others
+        self._write_locks = {}          # Per-collection locks serializing ingest, sync and rebuild
+
+    def write_lock(self, collection_name: str) -> threading.Lock:
+        """The lock an ingest, sync or rebuild of the collection holds; searches never take it. Process-local."""
+        with self._lock:
+            return self._write_locks.setdefault(collection_name, threading.Lock())
+
+    @contextmanager
+    def lease(self, collection_name: str, index_profile: str = None, metric_type: str = None):
+        """The shared engine for a collection, kept loaded (never evicted) until the block exits."""
+        engine = self._acquire(collection_name, index_profile, metric_type)
+        try:
+            yield engine
+        finally:
+            with self._lock:
+                self._leases[collection_name] -= 1
+                if not self._leases[collection_name]: del self._leases[collection_name]
+
+    def _acquire(self, collection_name: str, index_profile: str, metric_type: str):
+        """Returns the engine, loading it on first use, with one more lease taken on it."""
+        with self._lock:
+            engine = self._engines.get(collection_name)
+            if engine is not None:
+                self._engines.move_to_end(collection_name)
+                self._leases[collection_name] = self._leases.get(collection_name, 0) + 1
+                return engine
+            load_lock = self._load_locks.setdefault(collection_name, threading.Lock())
+
+        with load_lock:
+            with self._lock:
+                engine = self._engines.get(collection_name)
+                if engine is not None: self._leases[collection_name] = self._leases.get(collection_name, 0) + 1
+            if engine is None:
+                engine = FaceSearchEngine(collection_name=collection_name)
+                engine.load_or_create_index(index_profile, metric_type)
+                size_mb = engine.estimated_memory_mb()
+                with self._lock:
+                    self._engines[collection_name] = engine
+                    self._sizes_mb[collection_name] = size_mb
+                    self._leases[collection_name] = self._leases.get(collection_name, 0) + 1
+                print(f"--- Loaded collection: {collection_name} (~{size_mb:.1f} MB) ---")
+                self._evict(keep=collection_name)
+        return engine
+
+    def refresh(self, collection_name: str):
+        """Re-measures a loaded collection after ingest/sync changed its size."""
+        with self._lock:
+            engine = self._engines.get(collection_name)
+        if engine is None: return
+        size_mb = engine.estimated_memory_mb()
+        with self._lock:
+            if collection_name in self._engines:
+                self._sizes_mb[collection_name] = size_mb
+        self._evict(keep=collection_name)
+
+    def discard(self, collection_name: str):
+        """Forgets a collection (e.g. before it is dropped), releasing it if loaded."""
+        with self._lock:
+            engine = self._engines.pop(collection_name, None)
+            self._sizes_mb.pop(collection_name, None)
+            self._load_locks.pop(collection_name, None)
+        if engine is not None and engine.store is not None:
+            try:
+                engine.store.release()
+            except Exception as e:
+                print(f"Error releasing collection {collection_name}: {e}")
+
+    def _evict(self, keep: str):
+        to_release = []
+        with self._lock:
+            total_mb = sum(self._sizes_mb.values())
+            for name in list(self._engines):
+                if total_mb <= self.memory_budget_mb: break
+                if name == keep or self._leases.get(name): continue  # In use: releasing it would fail or empty its searches
+                to_release.append(self._engines.pop(name))
+                total_mb -= self._sizes_mb.pop(name, 0.0)
+        for engine in to_release:
+            try:
+                engine.store.release()
+                print(f"--- Released cold collection: {engine.collection_name} ---")
+            except Exception as e:
+                print(f"Error releasing collection {engine.collection_name}: {e}")
+
+
+engine_registry = EngineRegistry(LOADED_COLLECTIONS_BUDGET_MB)
@@ -23,6 +23,12 @@ document.addEventListener('DOMContentLoaded', () => {
     const showEmpty = (tbody, message) => {
         tbody.innerHTML = `<tr><td colspan="10" class="text-center text-slate-500 py-12">${message}</td></tr>`;
     };
+    const formatBytes = (bytes) => {
+        const units = ['B', 'KB', 'MB', 'GB', 'TB'];
+        let value = bytes || 0, unit = 0;
+        while (value >= 1024 && unit < units.length - 1) { value /= 1024; unit++; }
+        return `${value.toFixed(unit === 0 ? 0 : 1)} ${units[unit]}`;
+    };
     
     // --- Map & Geocoding Functions ---
     async function updateReverseGeocodedAddress(lat, lon) {
@@ -68,31 +74,40 @@ document.addEventListener('DOMContentLoaded', () => {
             if (!response.ok) throw new Error('Failed to fetch collections');
             const data = await response.json();
             renderCollections(data.collections);
+            renderPreviewCache(data.preview_cache);
             fetchedViews.add('view-collections');
         } catch (error) { showEmpty(tbody, `Error: ${error.message}`); }
     }
-    async function fetchGuestsData() {
-        const tbody = document.getElementById('guests-table-body');
-        showLoader(tbody);
-        try {
-            const response = await fetch('/api/admin/guests');
-            if (!response.ok) throw new Error('Failed to fetch guests');
-            const data = await response.json();
-            renderGuests(data.guests);
-            fetchedViews.add('view-guests');
-        } catch (error) { showEmpty(tbody, `Error: ${error.message}`); }
-    }
-    async function fetchActivitiesData() {
-        const tbody = document.getElementById('activities-table-body');
-        showLoader(tbody);
+    // Guests and activities are keyset-paged: one page per request, the next one fetched when
+    // the "Load more" button scrolls into view. A filter change starts over from the first page.
+    const pagedTables = {
+        guests: { endpoint: '/api/admin/guests', render: renderGuests, cursor: null, loading: false },
+        activities: { endpoint: '/api/admin/activities', render: renderActivities, cursor: null, loading: false },
+    };
+    async function fetchPage(table, reset) {
+        const state = pagedTables[table];
+        if (state.loading || (!reset && !state.cursor)) return;
+        const tbody = document.getElementById(`${table}-table-body`);
+        const loadMoreBtn = document.getElementById(`${table}-load-more`);
+        state.loading = true; loadMoreBtn.disabled = true;
+        if (reset) { state.cursor = null; loadMoreBtn.classList.add('hidden'); showLoader(tbody); }
         try {
-            const response = await fetch('/api/admin/activities');
-            if (!response.ok) throw new Error('Failed to fetch activities');
+            const params = new URLSearchParams(new FormData(document.getElementById(`${table}-filter`)));
+            [...params.keys()].forEach(key => { if (!params.get(key)) params.delete(key); });
+            if (state.cursor) params.set('cursor', state.cursor);
+            const response = await fetch(`${state.endpoint}?${params}`);
+            if (!response.ok) throw new Error(`Failed to fetch ${table}`);
             const data = await response.json();
-            renderActivities(data.activities);
-            fetchedViews.add('view-activities');
-        } catch (error) { showEmpty(tbody, `Error: ${error.message}`); }
+            state.render(data[table], !reset);
+            state.cursor = data.next_cursor;
+            loadMoreBtn.classList.toggle('hidden', !state.cursor);
+            fetchedViews.add(`view-${table}`);
+        } catch (error) {
+            if (reset) showEmpty(tbody, `Error: ${error.message}`); else alert(`Error: ${error.message}`);
+        } finally { state.loading = false; loadMoreBtn.disabled = false; }
     }
+    function fetchGuestsData() { return fetchPage('guests', true); }
+    function fetchActivitiesData() { return fetchPage('activities', true); }
     async function fetchAdminsData() {
         const tbody = document.getElementById('admins-table-body');
         showLoader(tbody);
@@ -122,23 +137,33 @@ document.addEventListener('DOMContentLoaded', () => {
                 <td class="location-cell text-gray-600">${col.location || 'N/A'}</td>
                 <td class="text-gray-600">${col.upload_datetime}</td>
                 <td class="font-bold ${countClass}">${imageCount}</td>
+                <td class="text-gray-600">${col.status}</td>
+                <td class="text-gray-600" title="${col.stats_refreshed_at ? `Originals and previews, as of ${col.stats_refreshed_at} UTC` : 'Not counted yet'}">${col.disk_bytes === null ? 'pending' : formatBytes(col.disk_bytes)}</td>
                 <td class="space-x-2 text-center">
                     <button class="action-btn sync" data-name="${col.name}" data-source-folder="${col.source_folder}" title="Sync Collection"><i class="fa-solid fa-arrows-rotate"></i></button>
                 </td>
             </tr>`;
         }).join('');
     }
-    function renderGuests(guests) {
+    function renderPreviewCache(usage) {
+        // Cache files are hard-linked into collection folders, so their bytes overlap the collections' Disk Size
+        document.getElementById('preview-cache-usage').textContent = usage
+            ? `Shared preview cache: ${usage.files} files, ${formatBytes(usage.bytes)} (shared with the collections linking them)`
+            : 'Shared preview cache: not measured yet.';
+    }
+    function renderGuests(guests, append = false) {
         const tbody = document.getElementById('guests-table-body');
-        if (!guests || guests.length === 0) return showEmpty(tbody, 'No guests have logged in yet.');
+        if (!append && (!guests || guests.length === 0)) return showEmpty(tbody, 'No guests found.');
         // FIX: Changed text-white to text-gray-900
-        tbody.innerHTML = guests.map(g => `<tr><td><input type="checkbox" class="check-item" data-table="guests" data-id="${g.id}"></td><td class="font-mono">${g.id}</td><td class="font-semibold text-gray-900">${g.name}</td><td>${g.mobile_number}</td><td>${g.created_at}</td></tr>`).join('');
+        const rows = guests.map(g => `<tr><td><input type="checkbox" class="check-item" data-table="guests" data-id="${g.id}"></td><td class="font-mono">${g.id}</td><td class="font-semibold text-gray-900">${g.name}</td><td>${g.mobile_number}</td><td>${g.created_at}</td></tr>`).join('');
+        if (append) tbody.insertAdjacentHTML('beforeend', rows); else tbody.innerHTML = rows;
     }
-    function renderActivities(activities) {
+    function renderActivities(activities, append = false) {
         const tbody = document.getElementById('activities-table-body');
-        if (!activities || activities.length === 0) return showEmpty(tbody, 'No guest activity recorded yet.');
+        if (!append && (!activities || activities.length === 0)) return showEmpty(tbody, 'No matching guest activity.');
         // FIX: Changed text-white and text-slate-400 to more readable colors
-        tbody.innerHTML = activities.map(act => `<tr><td><input type="checkbox" class="check-item" data-table="activities" data-id="${act.id}"></td><td>${act.timestamp}</td><td class="font-semibold text-gray-900">${act.guest_name}</td><td>${act.action}</td><td class="text-gray-500 font-mono text-sm">${act.details || ''}</td></tr>`).join('');
+        const rows = activities.map(act => `<tr><td><input type="checkbox" class="check-item" data-table="activities" data-id="${act.id}"></td><td>${act.timestamp}</td><td class="font-semibold text-gray-900">${act.guest_name}</td><td>${act.action}</td><td class="text-gray-500 font-mono text-sm">${act.details || ''}</td></tr>`).join('');
+        if (append) tbody.insertAdjacentHTML('beforeend', rows); else tbody.innerHTML = rows;
     }
     function renderAdmins(admins) {
         const tbody = document.getElementById('admins-table-body');
@@ -172,6 +197,19 @@ document.addEventListener('DOMContentLoaded', () => {
         });
     });
 
+    const loadMoreObserver = new IntersectionObserver(entries => entries.forEach(entry => {
+        if (entry.isIntersecting) fetchPage(entry.target.id.split('-')[0], false);
+    }));
+    Object.keys(pagedTables).forEach(table => {
+        const loadMoreBtn = document.getElementById(`${table}-load-more`);
+        loadMoreBtn.addEventListener('click', () => fetchPage(table, false));
+        loadMoreObserver.observe(loadMoreBtn);
+        document.getElementById(`${table}-filter`).addEventListener('submit', (e) => {
+            e.preventDefault();
+            fetchPage(table, true);
+        });
+    });
+
     document.getElementById('open-create-modal-btn').addEventListener('click', async () => {
         collectionNameInput.value = '';
         collectionSourceDropdown.value = '';
@@ -188,6 +226,18 @@ document.addEventListener('DOMContentLoaded', () => {
         } catch (error) { collectionSourceDropdown.innerHTML = '<option value="">Error loading folders</option>'; }
     });
     
+    async function waitForIngestJob(jobId, btn) {
+        while (true) {
+            const response = await fetch(`/api/admin/ingest-jobs/${jobId}`);
+            const job = await response.json();
+            if (!response.ok) throw new Error(job.detail || 'Failed to fetch indexing progress.');
+            if (job.status === 'COMPLETED' || job.status === 'FAILED') return job;
+            btn.innerHTML = job.status === 'QUEUED' ? 'Queued...'
+                : `Indexing ${job.images_decoded}/${job.images_total || '?'} (${job.images_per_second} img/s)`;
+            await new Promise(resolve => setTimeout(resolve, 2000));
+        }
+    }
+
     document.getElementById('update-modal-start-btn').addEventListener('click', async () => {
         const collectionName = collectionNameInput.value.trim().replace(/-/g, '_').replace(/\s+/g, '_').toLowerCase();
         const selectedFolder = collectionSourceDropdown.value;
@@ -203,7 +253,9 @@ document.addEventListener('DOMContentLoaded', () => {
             });
             const data = await response.json();
             if (!response.ok) throw new Error(data.detail || 'Failed to update collection.');
-            alert('Collection created/updated successfully!');
+            const job = await waitForIngestJob(data.job_id, btn);
+            if (job.status === 'FAILED') throw new Error(job.message || 'Indexing failed.');
+            alert(`Collection created/updated successfully! ${job.images_decoded} images, ${job.faces_embedded} faces indexed.`);
             createCollectionModal.classList.add('hidden');
             fetchCollectionsData();
         } catch (error) {
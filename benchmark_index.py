@@ -0,0 +1,182 @@
+# benchmark_index.py
+"""
+Offline recall/latency benchmark for the Milvus index profiles in index_profiles.py.
+
+Generates synthetic 512-d normalized "face" embeddings (several photos per identity),
+computes the exact top-k with a NumPy brute-force baseline, then builds a temporary
+Milvus collection per profile/metric and measures recall@k and p50/p99 latency of
+single-query searches, the way guest searches hit Milvus. With --local the in-process
+memory-mapped backend from vector_store.py is measured the same way, and --rerank-factor
+adds the two-stage (cheap candidates + exact re-rank) variant of each Milvus profile.
+
+Example:
+    python benchmark_index.py --rows 200000 --queries 500 --top-k 100 --profiles ivf_flat_small ivf_flat hnsw --metrics L2 IP
+"""
+
+import os
+import time
+import tempfile
+import argparse
+
+import numpy as np
+from pymilvus import connections, utility, FieldSchema, CollectionSchema, DataType, Collection
+from dotenv import load_dotenv
+
+import vector_store
+from index_profiles import INDEX_PROFILES, SUPPORTED_METRICS, get_index_params, get_search_params
+
+load_dotenv()
+
+MILVUS_HOST = os.getenv("MILVUS_HOST", "127.0.0.1")
+MILVUS_PORT = os.getenv("MILVUS_PORT", "19530")
+VECTOR_DIMENSION = int(os.getenv("VECTOR_DIMENSION", 512))
+INSERT_CHUNK = 10000
+
+
+def normalize(vectors):
+    return vectors / np.linalg.norm(vectors, axis=1, keepdims=True)
+
+
+def synthetic_embeddings(rows: int, queries: int, dim: int, photos_per_identity: int, noise: float, seed: int):
+    """Clustered unit vectors: each identity is a random direction, each photo a noisy copy of it."""
+    rng = np.random.default_rng(seed)
+    identities = max(1, rows // photos_per_identity)
+    centers = normalize(rng.standard_normal((identities, dim)).astype(np.float32))
+    data = normalize(centers[rng.integers(0, identities, rows)] + noise * rng.standard_normal((rows, dim)).astype(np.float32) / np.sqrt(dim))
+    query_vectors = normalize(centers[rng.integers(0, identities, queries)] + noise * rng.standard_normal((queries, dim)).astype(np.float32) / np.sqrt(dim))
+    return data.astype(np.float32), query_vectors.astype(np.float32)
+
+
+def exact_top_k(data, query_vectors, top_k: int):
+    """Brute-force baseline. On unit vectors the L2 and IP orderings are identical."""
+    ids, latencies = [], []
+    for query in query_vectors:
+        start = time.perf_counter()
+        scores = data @ query
+        candidates = np.argpartition(-scores, top_k)[:top_k]
+        ids.append(candidates[np.argsort(-scores[candidates])])
+        latencies.append(time.perf_counter() - start)
+    return ids, latencies
+
+
+def recall_at_k(approx_ids, exact_ids):
+    return float(np.mean([len(set(a) & set(e)) / len(e) for a, e in zip(approx_ids, exact_ids)]))
+
+
+def summarize(name: str, latencies, recall: float):
+    latencies_ms = np.array(latencies) * 1000
+    return {"name": name, "recall": recall, "p50_ms": float(np.percentile(latencies_ms, 50)), "p99_ms": float(np.percentile(latencies_ms, 99))}
+
+
+def benchmark_profile(profile_name: str, metric_type: str, data, query_vectors, exact_ids, top_k: int, rerank_factor: int = 0, rerank_nprobe: int = None):
+    collection_name = f"bench_{profile_name}_{metric_type.lower()}"
+    if utility.has_collection(collection_name): utility.drop_collection(collection_name)
+    fields = [
+        FieldSchema(name="pk_id", dtype=DataType.INT64, is_primary=True, auto_id=False),
+        FieldSchema(name="embedding", dtype=DataType.FLOAT_VECTOR, dim=data.shape[1]),
+    ]
+    collection = Collection(name=collection_name, schema=CollectionSchema(fields, "Index benchmark (temporary)"))
+    try:
+        for i in range(0, len(data), INSERT_CHUNK):
+            collection.insert([list(range(i, min(i + INSERT_CHUNK, len(data)))), data[i:i + INSERT_CHUNK]])
+        collection.flush()
+        index_params = get_index_params(profile_name, metric_type)
+        build_start = time.perf_counter()
+        collection.create_index(field_name="embedding", index_params=index_params)
+        utility.wait_for_index_building_complete(collection_name)
+        build_seconds = time.perf_counter() - build_start
+        collection.load()
+
+        search_params = get_search_params(index_params["index_type"], metric_type)
+        collection.search(data=[query_vectors[0]], anns_field="embedding", param=search_params, limit=top_k)  # Warm-up
+        approx_ids, latencies = [], []
+        for query in query_vectors:
+            start = time.perf_counter()
+            hits = collection.search(data=[query], anns_field="embedding", param=search_params, limit=top_k)[0]
+            latencies.append(time.perf_counter() - start)
+            approx_ids.append([hit.id for hit in hits])
+        result = summarize(f"{profile_name} ({index_params['index_type']}, {metric_type})", latencies, recall_at_k(approx_ids, exact_ids))
+        result["build_s"] = build_seconds
+        results = [result]
+
+        if rerank_factor:
+            # Two-stage: wider, cheaper candidate pass, bulk fetch of stored vectors, exact NumPy re-score
+            cheap_params = get_search_params(index_params["index_type"], metric_type, nprobe=rerank_nprobe, limit=top_k * rerank_factor)
+            reranked_ids, latencies = [], []
+            for query in query_vectors:
+                start = time.perf_counter()
+                candidates = [hit.id for hit in collection.search(data=[query], anns_field="embedding", param=cheap_params, limit=top_k * rerank_factor)[0]]
+                rows = {row["pk_id"]: row["embedding"] for row in collection.query(expr=f"pk_id in {candidates}", output_fields=["embedding"])}
+                scores = np.asarray([rows[pk] for pk in candidates], dtype=np.float32) @ query
+                reranked_ids.append([candidates[i] for i in np.argsort(-scores)[:top_k]])
+                latencies.append(time.perf_counter() - start)
+            results.append(summarize(f"  + rerank x{rerank_factor}, nprobe={cheap_params['params'].get('nprobe', '-')}", latencies, recall_at_k(reranked_ids, exact_ids)))
+        return results
+    finally:
+        collection.release()
+        utility.drop_collection(collection_name)
+
+
+def benchmark_local_store(data, query_vectors, exact_ids, top_k: int):
+    """Same measurement for the in-process memory-mapped backend (no Milvus round trip)."""
+    with tempfile.TemporaryDirectory() as directory:
+        vector_store.LOCAL_STORE_DIR = directory
+        store = vector_store.LocalVectorStore("bench_local", data.shape[1])
+        store.load()
+        paths = [str(i) for i in range(len(data))]
+        for i in range(0, len(data), INSERT_CHUNK):
+            store.insert(paths[i:i + INSERT_CHUNK], data[i:i + INSERT_CHUNK])
+        store.search([query_vectors[0]], top_k)  # Warm-up, pages the matrix in
+        approx_ids, latencies = [], []
+        for query in query_vectors:
+            start = time.perf_counter()
+            hits = store.search([query], top_k)[0]
+            latencies.append(time.perf_counter() - start)
+            approx_ids.append([int(hit["image_path"]) for hit in hits])
+        store.release()
+    return summarize("local (mmap exact, IP)", latencies, recall_at_k(approx_ids, exact_ids))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Recall@k and latency benchmark for Milvus index profiles.")
+    parser.add_argument("--rows", type=int, default=100000, help="Synthetic faces to index.")
+    parser.add_argument("--queries", type=int, default=300, help="Single-face queries to time.")
+    parser.add_argument("--top-k", type=int, default=100)
+    parser.add_argument("--photos-per-identity", type=int, default=20)
+    parser.add_argument("--noise", type=float, default=0.6, help="Per-photo spread around an identity.")
+    parser.add_argument("--profiles", nargs="+", default=list(INDEX_PROFILES), choices=list(INDEX_PROFILES))
+    parser.add_argument("--metrics", nargs="+", default=["L2"], choices=list(SUPPORTED_METRICS))
+    parser.add_argument("--seed", type=int, default=7)
+    parser.add_argument("--local", action="store_true", help="Also benchmark the local memory-mapped backend.")
+    parser.add_argument("--skip-milvus", action="store_true", help="Only run the NumPy baseline (and --local).")
+    parser.add_argument("--rerank-factor", type=int, default=0, help="Also measure two-stage search with this candidate multiple.")
+    parser.add_argument("--rerank-nprobe", type=int, default=8, help="IVF nprobe of the cheaper candidate stage.")
+    args = parser.parse_args()
+
+    print(f"Generating {args.rows} synthetic {VECTOR_DIMENSION}-d embeddings and {args.queries} queries...")
+    data, query_vectors = synthetic_embeddings(args.rows, args.queries, VECTOR_DIMENSION, args.photos_per_identity, args.noise, args.seed)
+    exact_ids, exact_latencies = exact_top_k(data, query_vectors, args.top_k)
+    results = [summarize("exact (NumPy brute force)", exact_latencies, 1.0)]
+
+    if args.local:
+        print("Benchmarking local memory-mapped store...")
+        results.append(benchmark_local_store(data, query_vectors, exact_ids, args.top_k))
+
+    if not args.skip_milvus:
+        connections.connect("default", host=MILVUS_HOST, port=MILVUS_PORT)
+        try:
+            for profile_name in args.profiles:
+                for metric_type in args.metrics:
+                    print(f"Benchmarking {profile_name} / {metric_type}...")
+                    results.extend(benchmark_profile(profile_name, metric_type, data, query_vectors, exact_ids, args.top_k, args.rerank_factor, args.rerank_nprobe))
+        finally:
+            connections.disconnect("default")
+
+    print(f"\n{'profile':<40} {'recall@' + str(args.top_k):>10} {'p50 ms':>9} {'p99 ms':>9} {'build s':>9}")
+    for result in results:
+        build = f"{result['build_s']:.1f}" if "build_s" in result else "-"
+        print(f"{result['name']:<40} {result['recall']:>10.4f} {result['p50_ms']:>9.2f} {result['p99_ms']:>9.2f} {build:>9}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,109 @@
+# collection_stats.py
+
+import os
+import time
+import threading
+
+from dotenv import load_dotenv
+
+import database as db
+import vector_store
+from Face_search_logic_milvus import PREVIEW_IMAGE_DIR, prune_preview_cache
+
+load_dotenv()
+
+# --- COLLECTION STATS CONFIGURATION ---
+COLLECTION_STATS_REFRESH_SECONDS = float(os.getenv("COLLECTION_STATS_REFRESH_SECONDS", 900))  # Full recount of every collection; ingest/sync recount their own right away
+
+
+def preview_usage(collection_name: str):
+    """
+    (previews, bytes) of a collection's preview folder: previews are the top-level renders,
+    bytes also cover thumbnails, WebP variants and face crops. Renders hard-linked from the
+    shared cache are counted for every collection that links them.
+    """
+    root = os.path.join(PREVIEW_IMAGE_DIR, collection_name)
+    previews, total_bytes = 0, 0
+    pending = [root]
+    while pending:
+        directory = pending.pop()
+        try:
+            with os.scandir(directory) as entries:
+                for entry in entries:
+                    if entry.is_dir(follow_symlinks=False):
+                        pending.append(entry.path)
+                    elif entry.is_file():
+                        total_bytes += entry.stat().st_size
+                        if directory == root: previews += 1
+        except FileNotFoundError:
+            continue
+    return previews, total_bytes
+
+
+def recount_collection_stats(collection_name: str):
+    """
+    Recounts one collection and stores the result: rows from the vector store (one call),
+    images and source bytes from the manifest (one query) and the preview folder.
+    Called after an ingest or sync of the collection and by the periodic refresh;
+    failures are logged and never fail the ingest or sync.
+    """
+    try:
+        try:
+            row_count = vector_store.collection_row_count(collection_name)
+        except Exception as e:
+            print(f"--- Could not read the row count of '{collection_name}': {e} ---")
+            row_count = None
+        preview_count, preview_bytes = preview_usage(collection_name)
+        with db.SessionLocal() as session:
+            image_count, source_bytes = db.manifest_totals(session, collection_name)
+            db.save_collection_stats(session, collection_name, {"row_count": row_count, "image_count": image_count, "source_bytes": source_bytes,
+                                                                "preview_count": preview_count, "preview_bytes": preview_bytes})
+    except Exception as e:
+        print(f"--- Could not update stats of '{collection_name}': {e} ---")
+
+
+class CollectionStatsRefresher:
+    """
+    Recounts every collection on a background thread at startup and then every
+    COLLECTION_STATS_REFRESH_SECONDS, so the dashboard's numbers catch up with changes made
+    outside ingest/sync (files edited on disk, another process) and stats rows of dropped
+    collections are removed. Each refresh also prunes the shared preview cache and records its usage.
+    """
+
+    def __init__(self):
+        self._stop = threading.Event()
+        self._thread = None
+        self.last_refresh_seconds = None
+        self.preview_cache = None  # Usage of the shared render cache (see prune_preview_cache), as of the last refresh
+
+    def start(self):
+        self._thread = threading.Thread(target=self._run, name="collection-stats-refresher", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+
+    def _run(self):
+        while not self._stop.is_set():
+            try:
+                self.refresh_all()
+            except Exception as e:
+                print(f"--- Collection stats refresh failed: {e} ---")
+            self._stop.wait(COLLECTION_STATS_REFRESH_SECONDS)
+
+    def refresh_all(self):
+        start = time.monotonic()
+        names = vector_store.list_collections()
+        for name in names:
+            if self._stop.is_set(): return
+            recount_collection_stats(name)
+        live = set(vector_store.list_collections())  # Listed again: a collection dropped mid-refresh must not keep its row
+        with db.SessionLocal() as session:
+            stale = [row.collection_name for row in session.query(db.CollectionStats.collection_name).all() if row.collection_name not in live]
+            db.delete_collection_stats(session, stale)
+        self.preview_cache = prune_preview_cache()
+        self.last_refresh_seconds = round(time.monotonic() - start, 2)
+        print(f"--- Collection stats refreshed for {len(names)} collections in {self.last_refresh_seconds} s. ---")
+
+
+collection_stats_refresher = CollectionStatsRefresher()
@@ -1,9 +1,100 @@
 # dependencies.py
 
+import os
+import time
+import uuid
+import threading
+
 from fastapi import Depends, HTTPException, Request, status
+from jose import jwt, JWTError
 from sqlalchemy.orm import Session
+from dotenv import load_dotenv
 
 import database as db
+from ttl_cache import TTLCache
+
+load_dotenv()
+
+# --- SESSION TOKEN CONFIGURATION ---
+SESSION_SECRET_KEY = os.getenv("SESSION_SECRET_KEY")  # Must be the same for every worker, e.g. python -c "import secrets; print(secrets.token_urlsafe(32))"
+if not SESSION_SECRET_KEY:
+    raise ValueError("SESSION_SECRET_KEY is not set. Every worker must sign sessions with the same key; add it to .env.")
+SESSION_ALGORITHM = "HS256"
+GUEST_SESSION_HOURS = float(os.getenv("GUEST_SESSION_HOURS", 12))
+ADMIN_SESSION_HOURS = float(os.getenv("ADMIN_SESSION_HOURS", 8))
+PRINCIPAL_CACHE_TTL_SECONDS = int(os.getenv("PRINCIPAL_CACHE_TTL_SECONDS", 60))  # Bounds how stale a cached guest/admin can be in another process
+PRINCIPAL_CACHE_MAX_ENTRIES = int(os.getenv("PRINCIPAL_CACHE_MAX_ENTRIES", 10000))
+
+# role -> (cookie name, session lifetime in hours, model)
+SESSION_ROLES = {
+    "guest": ("guest_session", GUEST_SESSION_HOURS, db.Guest),
+    "admin": ("admin_session", ADMIN_SESSION_HOURS, db.Admin),
+}
+
+# ===================================================================
+# SESSION TOKENS AND PRINCIPAL CACHE
+# ===================================================================
+
+# (role, id) -> detached Guest/Admin row, so a request with a valid session token is authenticated without a database round trip
+principal_cache = TTLCache(PRINCIPAL_CACHE_MAX_ENTRIES, PRINCIPAL_CACHE_TTL_SECONDS)
+# jti -> token expiry (epoch seconds), for sessions ended by logout. Process-local: with several
+# workers a logged-out token stays valid in the others until it expires (the cookie is deleted, though)
+_revoked_tokens = {}
+_revoked_lock = threading.Lock()
+
+def create_session_token(role: str, principal_id: int):
+    """A signed token naming the guest/admin, valid for the role's session lifetime."""
+    expires_at = int(time.time() + SESSION_ROLES[role][1] * 3600)
+    return jwt.encode({"sub": str(principal_id), "role": role, "jti": uuid.uuid4().hex, "exp": expires_at}, SESSION_SECRET_KEY, algorithm=SESSION_ALGORITHM)
+
+def decode_session_token(token: str, role: str):
+    """The token's claims if its signature, expiry and role check out and it was not revoked; otherwise None."""
+    if not token: return None
+    try:
+        claims = jwt.decode(token, SESSION_SECRET_KEY, algorithms=[SESSION_ALGORITHM])
+    except JWTError:
+        return None
+    if claims.get("role") != role or not str(claims.get("sub", "")).isdigit(): return None
+    with _revoked_lock:
+        if claims.get("jti") in _revoked_tokens: return None
+    return claims
+
+def set_session_cookie(response, role: str, principal_id: int):
+    cookie_name, hours, _ = SESSION_ROLES[role]
+    response.set_cookie(key=cookie_name, value=create_session_token(role, principal_id), httponly=True, samesite="lax", max_age=int(hours * 3600))
+
+def end_session(request: Request, response, role: str):
+    """Logout: revokes the presented token in this process only (see _revoked_tokens) and deletes the cookie."""
+    cookie_name = SESSION_ROLES[role][0]
+    claims = decode_session_token(request.cookies.get(cookie_name), role)
+    if claims:
+        now = time.time()
+        with _revoked_lock:
+            for jti in [jti for jti, expires_at in _revoked_tokens.items() if expires_at < now]:
+                del _revoked_tokens[jti]  # Expired tokens are rejected anyway
+            _revoked_tokens[claims["jti"]] = claims["exp"]
+        principal_cache.discard([(role, int(claims["sub"]))])
+    response.delete_cookie(cookie_name)
+
+def forget_principals(role: str, principal_ids: list):
+    """Drops cached rows of deleted guests/admins, so their tokens stop working right away."""
+    principal_cache.discard([(role, principal_id) for principal_id in principal_ids])
+
+def _resolve_principal(request: Request, db_session: Session, role: str):
+    """
+    Returns the session's Guest/Admin attached to db_session, or None. A cached row is merged
+    without loading, so only a cache miss queries the database; relationships still lazy-load.
+    """
+    claims = decode_session_token(request.cookies.get(SESSION_ROLES[role][0]), role)
+    if claims is None: return None
+    key, model = (role, int(claims["sub"])), SESSION_ROLES[role][2]
+    principal = principal_cache.get(key)
+    if principal is None:
+        principal = db_session.query(model).filter(model.id == key[1]).first()
+        if principal is None: return None
+        db_session.expunge(principal)
+        principal_cache.put(key, principal)
+    return db_session.merge(principal, load=False)
 
 # ===================================================================
 # GUEST DEPENDENCIES
@@ -14,11 +105,9 @@ def get_current_guest(request: Request, db_session: Session = Depends(db.get_db)
     FastAPI dependency for HTML pages that require a guest to be logged in.
     If the guest is not authenticated, this will redirect them to the guest login page.
     """
-    guest_id = request.cookies.get("guest_session")
-    if guest_id and guest_id.isdigit():
-        guest = db_session.query(db.Guest).filter(db.Guest.id == int(guest_id)).first()
-        if guest:
-            return guest
+    guest = _resolve_principal(request, db_session, "guest")
+    if guest:
+        return guest
     # For pages, a redirect is the expected behavior for an unauthenticated user.
     raise HTTPException(
         status_code=status.HTTP_307_TEMPORARY_REDIRECT,
@@ -31,11 +120,9 @@ def get_current_guest_api(request: Request, db_session: Session = Depends(db.get
     FastAPI dependency for API endpoints that require a guest to be logged in.
     If the guest is not authenticated, this will raise a 401 Unauthorized error.
     """
-    guest_id = request.cookies.get("guest_session")
-    if guest_id and guest_id.isdigit():
-        guest = db_session.query(db.Guest).filter(db.Guest.id == int(guest_id)).first()
-        if guest:
-            return guest
+    guest = _resolve_principal(request, db_session, "guest")
+    if guest:
+        return guest
     # For APIs, a 401 error is the correct response for an unauthenticated user.
     raise HTTPException(
         status_code=status.HTTP_401_UNAUTHORIZED,
@@ -52,11 +139,9 @@ def get_current_admin(request: Request, db_session: Session = Depends(db.get_db)
     FastAPI dependency for HTML pages that require an admin to be logged in.
     If the admin is not authenticated, this will redirect them to the admin login page.
     """
-    admin_id = request.cookies.get("admin_session")
-    if admin_id and admin_id.isdigit():
-        admin = db_session.query(db.Admin).filter(db.Admin.id == int(admin_id)).first()
-        if admin:
-            return admin
+    admin = _resolve_principal(request, db_session, "admin")
+    if admin:
+        return admin
     raise HTTPException(
         status_code=status.HTTP_307_TEMPORARY_REDIRECT,
         detail="Not authenticated, redirecting to admin login.",
@@ -68,13 +153,11 @@ def get_current_admin_api(request: Request, db_session: Session = Depends(db.get
     FastAPI dependency for API endpoints that require an admin to be logged in.
     If the admin is not authenticated, this will raise a 401 Unauthorized error.
     """
-    admin_id = request.cookies.get("admin_session")
-    if admin_id and admin_id.isdigit():
-        admin = db_session.query(db.Admin).filter(db.Admin.id == int(admin_id)).first()
-        if admin:
-            return admin
+    admin = _resolve_principal(request, db_session, "admin")
+    if admin:
+        return admin
     raise HTTPException(
         status_code=status.HTTP_401_UNAUTHORIZED,
         detail="Admin not authenticated for API access",
         headers={"WWW-Authenticate": "Bearer"},
-    )
\ No newline at end of file
+    )
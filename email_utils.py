@@ -1,12 +1,13 @@
 import os
-import io
 import smtplib
-import zipfile
+import tempfile
 from email.mime.multipart import MIMEMultipart
 from email.mime.text import MIMEText
 from email.mime.application import MIMEApplication
 from dotenv import load_dotenv
 
+from zip_stream import write_zip
+
 
 ##
 # Load environment variables from .env file
@@ -18,24 +19,19 @@ SMTP_PORT = int(os.getenv("SMTP_PORT", 465))
 SMTP_USERNAME = os.getenv("SMTP_USERNAME")
 SMTP_SENDER_EMAIL = os.getenv("SMTP_SENDER_EMAIL")
 SMTP_PASSWORD = os.getenv("SMTP_PASSWORD")
+EMAIL_ZIP_SPOOL_BYTES = int(os.getenv("EMAIL_ZIP_SPOOL_BYTES", 8 * 1024 * 1024))
 
 def send_photos_email(recipient_email: str, image_paths: list, guest_name: str):
     """
-    Creates a zip of photos in-memory and emails it to the recipient using Gmail.
+    Streams a zip of photos to a temporary file and emails it to the recipient using Gmail.
     """
     if not all([SMTP_SERVER, SMTP_PORT, SMTP_USERNAME, SMTP_PASSWORD, SMTP_SENDER_EMAIL]):
         print("--- FATAL: SMTP environment variables are not fully configured. Cannot send email. ---")
         return False
 
     try:
-        # 1. Create the ZIP file in-memory
-        zip_io = io.BytesIO()
-        with zipfile.ZipFile(zip_io, mode='w', compression=zipfile.ZIP_DEFLATED) as temp_zip:
-            for original_path in image_paths:
-                if os.path.exists(original_path):
-                    temp_zip.write(original_path, arcname=os.path.basename(original_path))
-        zip_io.seek(0)
-        if len(zip_io.getvalue()) == 0:
+        # 1. Make sure there is something to zip
+        if not any(os.path.isfile(path) for path in image_paths):
             print(f"--- WARNING: Created empty ZIP for {recipient_email}. No valid image paths found. Aborting email. ---")
             return False
 
@@ -60,8 +56,11 @@ def send_photos_email(recipient_email: str, image_paths: list, guest_name: str):
         """
         msg.attach(MIMEText(html_body, 'html'))
 
-        # 4. Attach the ZIP file
-        attachment = MIMEApplication(zip_io.read(), _subtype="zip")
+        # 4. Stream the ZIP to a temporary file (spills to disk past EMAIL_ZIP_SPOOL_BYTES) and attach it
+        with tempfile.SpooledTemporaryFile(max_size=EMAIL_ZIP_SPOOL_BYTES) as zip_file:
+            write_zip(image_paths, zip_file)
+            zip_file.seek(0)
+            attachment = MIMEApplication(zip_file.read(), _subtype="zip")
         attachment.add_header('Content-Disposition', 'attachment', filename="FaceSearch_Memories.zip")
         msg.attach(attachment)
 
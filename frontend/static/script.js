@@ -1,6 +1,7 @@
 document.addEventListener('DOMContentLoaded', () => {
     // --- UI Elements ---
     const API_BASE_URL = '';
+    const ALL_COLLECTIONS = '__all__';
     const screens = { 
         upload: document.getElementById('screen-upload'), 
         loading: document.getElementById('screen-loading'), 
@@ -12,6 +13,9 @@ document.addEventListener('DOMContentLoaded', () => {
     // UI Elements for Camera-Only flow
     const previewContainer = document.getElementById('preview-container');
     const searchBtn = document.getElementById('search-btn');
+    const savedFaceSearchBtn = document.getElementById('saved-face-search-btn');
+    const newPhotosBtn = document.getElementById('new-photos-btn');
+    const newPhotosCount = document.getElementById('new-photos-count');
     const uploadPreviewSection = document.getElementById('upload-preview-section');
     const webcamVideo = document.getElementById('webcam');
     const cameraPlaceholder = document.getElementById('camera-placeholder');
@@ -19,6 +23,7 @@ document.addEventListener('DOMContentLoaded', () => {
     const captureBtn = document.getElementById('capture-btn');
     const toastContainer = document.getElementById('toast-container');
     const collectionDropdown = document.getElementById('collection-dropdown');
+    const visitDateDropdown = document.getElementById('visit-date-dropdown');
     const guestLogoutBtn = document.getElementById('guest-logout-btn');
     const emailInput = document.getElementById('email-input');
     const sendEmailBtn = document.getElementById('send-email-btn');
@@ -113,26 +118,76 @@ document.addEventListener('DOMContentLoaded', () => {
             if (data.collections.length === 0) {
                 collectionDropdown.innerHTML = '<option>No collections available</option>';
             } else {
+                if (data.collections.length > 1) collectionDropdown.innerHTML = `<option value="${ALL_COLLECTIONS}">All collections</option>`;
                 data.collections.forEach(name => collectionDropdown.innerHTML += `<option value="${name}">${name}</option>`);
             }
+            populateVisitDates();
         } catch (error) { showToast(error.message, 'error'); }
     };
 
-    const performSearch = async () => {
+    // Collections partitioned by capture date offer a day filter, so the search only scans that day.
+    const populateVisitDates = async () => {
+        visitDateDropdown.innerHTML = '';
+        visitDateDropdown.classList.add('hidden');
         const selectedCollection = collectionDropdown.value;
-        if (!currentFile || !selectedCollection) return showToast('Please capture a photo and select a collection.', 'error');
+        if (!selectedCollection || selectedCollection === ALL_COLLECTIONS) return;
+        try {
+            const response = await fetch(`${API_BASE_URL}/api/collections/${selectedCollection}/partitions`);
+            if (!response.ok) return;
+            const data = await response.json();
+            if (data.dates.length < 2) return;
+            visitDateDropdown.innerHTML = '<option value="">Any day</option>' + data.dates.map(d => `<option value="${d}">${d}</option>`).join('');
+            visitDateDropdown.classList.remove('hidden');
+        } catch (error) { /* Optional filter */ }
+    };
+
+    const refreshSavedFaceButton = async () => {
+        try {
+            const response = await fetch(`${API_BASE_URL}/api/guest/face-profile`);
+            if (!response.ok) return;
+            const data = await response.json();
+            savedFaceSearchBtn.classList.toggle('hidden', !data.enrolled);
+        } catch (error) { /* Optional shortcut; the selfie flow still works */ }
+    };
+
+    // Photos ingested after the guest enrolled that matched their face; viewing them marks them as seen.
+    let newPhotosData = null;
+    const refreshNewPhotosButton = async () => {
+        try {
+            const response = await fetch(`${API_BASE_URL}/api/guest/new-photos`);
+            if (!response.ok) return;
+            newPhotosData = await response.json();
+            newPhotosCount.textContent = newPhotosData.results.length;
+            newPhotosBtn.classList.toggle('hidden', newPhotosData.results.length === 0);
+        } catch (error) { /* Optional notification */ }
+    };
+
+    const showNewPhotos = async () => {
+        if (!newPhotosData || newPhotosData.results.length === 0) return;
+        renderResults(newPhotosData);
+        showScreen('results');
+        newPhotosBtn.classList.add('hidden');
+        try { await fetch(`${API_BASE_URL}/api/guest/new-photos/seen`, { method: 'POST' }); } catch (error) { /* Shown again next visit */ }
+    };
+
+    // With useSavedFace the request carries no photo and the server searches with the guest's enrolled face.
+    const performSearch = async (useSavedFace = false) => {
+        const selectedCollection = collectionDropdown.value;
+        if ((!useSavedFace && !currentFile) || !selectedCollection) return showToast('Please capture a photo and select a collection.', 'error');
         showScreen('loading');
         const formData = new FormData();
-        formData.append('file', currentFile);
+        if (!useSavedFace) formData.append('file', currentFile);
+        if (visitDateDropdown.value) formData.append('dates', visitDateDropdown.value);
         try {
-            const response = await fetch(`${API_BASE_URL}/api/search/${selectedCollection}`, { method: 'POST', body: formData });
+            const searchUrl = selectedCollection === ALL_COLLECTIONS ? `${API_BASE_URL}/api/search-all` : `${API_BASE_URL}/api/search/${selectedCollection}`;
+            const response = await fetch(searchUrl, { method: 'POST', body: formData });
             if (!response.ok) {
                 if(response.status === 401 || response.status === 307) window.location.href = '/';
                 throw new Error((await response.json()).detail);
             }
             const data = await response.json();
-            screens.results.innerHTML = createResultsScreenHtml(data);
-            attachResultsScreenListeners(data.results);
+            if (data.face_profile === 'enrolled') savedFaceSearchBtn.classList.remove('hidden');  // Saved after the response
+            renderResults(data);
             showScreen('results');
         } catch (error) {
             showToast(`Error: ${error.message}`, 'error');
@@ -143,6 +198,25 @@ document.addEventListener('DOMContentLoaded', () => {
     // =========================================================================
     // MODIFIED: This function NO LONGER creates the individual print button
     // =========================================================================
+    const renderResults = (data, preselected = new Set()) => {
+        screens.results.innerHTML = createResultsScreenHtml(data);
+        attachResultsScreenListeners(data, preselected);
+    };
+
+    // A result with burst_size stands in for near-identical burst frames; fetch and show them right after it.
+    const expandBurst = async (data, index) => {
+        const representative = data.results[index];
+        const collection = representative.collection || collectionDropdown.value;
+        try {
+            const response = await fetch(`${API_BASE_URL}/api/search/${collection}/burst?image_path=${encodeURIComponent(representative.original_path)}`);
+            if (!response.ok) throw new Error('Could not load the similar shots.');
+            const members = (await response.json()).results.map(m => ({ ...m, distance: representative.distance }));
+            delete representative.burst_size;
+            data.results.splice(index + 1, 0, ...members);
+            renderResults(data, new Set(selectedImages));
+        } catch (error) { showToast(error.message, 'error'); }
+    };
+
     const createResultsScreenHtml = (data) => {
         const hasResults = data.results && data.results.length > 0;
         let resultsContent;
@@ -153,7 +227,11 @@ document.addEventListener('DOMContentLoaded', () => {
                         <div class="thumbnail-grid">
                             ${data.results.map((r, i) => `
                                 <div class="thumbnail-image" data-index="${i}" data-original-path="${r.original_path}" title="Click to select, hover to view">
-                                    <img src="${API_BASE_URL}${r.web_path}" loading="lazy">
+                                    <picture>
+                                        ${r.thumb_webp_path ? `<source srcset="${API_BASE_URL}${r.thumb_webp_path}" type="image/webp">` : ''}
+                                        <img src="${API_BASE_URL}${r.thumb_path || r.web_path}" loading="lazy">
+                                    </picture>
+                                    ${r.burst_size ? `<button class="burst-badge" title="Show ${r.burst_size} similar shots">+${r.burst_size}</button>` : ''}
                                 </div>
                             `).join('')}
                         </div>
@@ -176,8 +254,10 @@ document.addEventListener('DOMContentLoaded', () => {
     // MODIFIED: This function NO LONGER has a listener for an individual
     // print button.
     // ====================================================================
-    const attachResultsScreenListeners = (results) => {
+    const attachResultsScreenListeners = (data, preselected = new Set()) => {
+        const results = data.results;
         selectedImages.clear();
+        preselected.forEach(path => selectedImages.add(path));
         let currentIndex = 0;
         const mainImg = screens.results.querySelector('.main-image-display img');
         const prevBtn = screens.results.querySelector('.prev-btn');
@@ -202,6 +282,11 @@ document.addEventListener('DOMContentLoaded', () => {
             }
         };
         thumbnails.forEach(thumb => {
+            thumb.classList.toggle('selected-thumbnail', selectedImages.has(thumb.dataset.originalPath));
+            thumb.querySelector('.burst-badge')?.addEventListener('click', (e) => {
+                e.stopPropagation();
+                expandBurst(data, parseInt(thumb.dataset.index));
+            });
             thumb.addEventListener('mouseover', () => { currentIndex = parseInt(thumb.dataset.index); updateGalleryView(); });
             thumb.addEventListener('click', (e) => {
                 const originalPath = e.currentTarget.dataset.originalPath;
@@ -245,7 +330,10 @@ document.addEventListener('DOMContentLoaded', () => {
     };
     
     // --- Event Listeners ---
-    searchBtn.addEventListener('click', performSearch);
+    searchBtn.addEventListener('click', () => performSearch());
+    savedFaceSearchBtn.addEventListener('click', () => performSearch(true));
+    newPhotosBtn.addEventListener('click', showNewPhotos);
+    collectionDropdown.addEventListener('change', populateVisitDates);
     startCameraBtn.addEventListener('click', () => { stream ? stopCamera() : startCamera(); });
     captureBtn.addEventListener('click', capturePhoto);
 
@@ -351,5 +439,7 @@ document.addEventListener('DOMContentLoaded', () => {
     // --- Initial Load ---
     showScreen('upload');
     populateCollections();
+    refreshSavedFaceButton();
+    refreshNewPhotosButton();
     startCamera();
 });
\ No newline at end of file
@@ -0,0 +1,93 @@
+# inference_executor.py
+
+import os
+import asyncio
+import functools
+from concurrent.futures import ThreadPoolExecutor, wait
+
+from fastapi import HTTPException, status
+from dotenv import load_dotenv
+
+load_dotenv()
+
+# --- EXECUTOR CONFIGURATION ---
+SEARCH_WORKERS = int(os.getenv("SEARCH_WORKERS", 4))        # Concurrent guest searches running the model
+SEARCH_QUEUE_SIZE = int(os.getenv("SEARCH_QUEUE_SIZE", 16))  # Guest searches allowed to wait for a worker
+INGEST_JOBS = int(os.getenv("INGEST_JOBS", 1))               # Concurrent admin ingest/sync operations
+INGEST_QUEUE_SIZE = int(os.getenv("INGEST_QUEUE_SIZE", 2))   # Admin operations allowed to wait
+RETRY_AFTER_SECONDS = int(os.getenv("RETRY_AFTER_SECONDS", 5))
+FANOUT_WORKERS = int(os.getenv("FANOUT_WORKERS", SEARCH_WORKERS))  # Per-collection searches of /api/search-all, shared by all guests
+
+
+class InferenceExecutor:
+    """
+    A bounded thread pool for blocking model and Milvus calls that endpoints can await.
+    InsightFace (onnxruntime) and OpenCV release the GIL, so threads share one loaded
+    model. When workers and queue are both full the call is rejected immediately
+    with `reject_status` instead of piling up on the event loop.
+    """
+
+    def __init__(self, name: str, max_workers: int, max_queue: int, reject_status: int, fanout_workers: int = 0):
+        self.name = name
+        self.capacity = max_workers + max_queue
+        self.reject_status = reject_status
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix=name)
+        self._fanout = ThreadPoolExecutor(max_workers=fanout_workers, thread_name_prefix=f"{name}-fanout") if fanout_workers else None
+        self._in_flight = 0  # Only touched from the event loop thread
+
+    async def run(self, fn, *args, **kwargs):
+        """
+        Runs fn on a worker. The slot stays taken until the worker thread is done, even if the
+        awaiting request is cancelled or times out, so abandoned work still counts against capacity.
+        """
+        if self._in_flight >= self.capacity:
+            raise HTTPException(
+                status_code=self.reject_status,
+                detail=f"The {self.name} service is busy. Please try again shortly.",
+                headers={"Retry-After": str(RETRY_AFTER_SECONDS)},
+            )
+        self._in_flight += 1
+        loop = asyncio.get_running_loop()
+        try:
+            future = self._executor.submit(functools.partial(fn, *args, **kwargs))
+        except BaseException:
+            self._in_flight -= 1
+            raise
+        future.add_done_callback(lambda _: self._release_from_thread(loop))
+        return await asyncio.wrap_future(future)
+
+    def _release_from_thread(self, loop):
+        try:
+            loop.call_soon_threadsafe(self._release)
+        except RuntimeError:
+            pass  # Loop already closed at shutdown
+
+    def _release(self):
+        self._in_flight -= 1
+
+    def fan_out(self, fn, items: list, timeout: float):
+        """
+        Blocking: runs fn(item) for every item on the shared fan-out pool, waiting at most
+        `timeout` seconds in total. Returns one outcome per item: the result, the exception it
+        raised, or TimeoutError if it did not finish in time (queued items are cancelled).
+        Called from inside a run() task, so a request holds one slot however many items it has.
+        """
+        futures = [self._fanout.submit(fn, item) for item in items]
+        _, not_done = wait(futures, timeout=timeout)
+        outcomes = []
+        for future in futures:
+            if future in not_done:
+                future.cancel()
+                outcomes.append(TimeoutError(f"Not finished within {timeout} s"))
+            else:
+                outcomes.append(future.exception() or future.result())
+        return outcomes
+
+    def shutdown(self):
+        self._executor.shutdown(wait=False, cancel_futures=True)
+        if self._fanout: self._fanout.shutdown(wait=False, cancel_futures=True)
+
+
+# --- SHARED EXECUTORS ---
+search_executor = InferenceExecutor("guest-search", SEARCH_WORKERS, SEARCH_QUEUE_SIZE, status.HTTP_503_SERVICE_UNAVAILABLE, FANOUT_WORKERS)
+ingest_executor = InferenceExecutor("admin-ingest", INGEST_JOBS, INGEST_QUEUE_SIZE, status.HTTP_429_TOO_MANY_REQUESTS)
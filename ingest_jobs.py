@@ -0,0 +1,214 @@
+# ingest_jobs.py
+
+import os
+import datetime
+import threading
+
+from sqlalchemy import or_, exists
+from sqlalchemy.orm import aliased
+from dotenv import load_dotenv
+
+import database as db
+from Face_search_logic_milvus import engine_registry
+
+load_dotenv()
+
+# --- JOB WORKER CONFIGURATION ---
+JOB_POLL_SECONDS = float(os.getenv("JOB_POLL_SECONDS", 5))               # Idle wait between queue checks
+JOB_HEARTBEAT_SECONDS = float(os.getenv("JOB_HEARTBEAT_SECONDS", 2))     # How often running progress is persisted
+JOB_STALE_SECONDS = float(os.getenv("JOB_STALE_SECONDS", 120))           # A RUNNING job without heartbeat this long is requeued
+MAX_JOB_ATTEMPTS = int(os.getenv("MAX_JOB_ATTEMPTS", 3))
+ACTIVE_STATUSES = ("QUEUED", "RUNNING")
+
+
+def utcnow():
+    return datetime.datetime.utcnow()
+
+def enqueue_ingest_job(db_session, collection_name: str, source_folder: str, latitude: float = None, longitude: float = None,
+                       index_profile: str = None, metric_type: str = None, zone: str = None):
+    """
+    Queues an ingest, or returns the job already queued/running for the same collection, folder
+    and zone. A different folder or zone gets its own job; the worker runs them one after another.
+    """
+    active = db_session.query(db.IngestJob).filter(db.IngestJob.collection_name == collection_name, db.IngestJob.status.in_(ACTIVE_STATUSES)).all()
+    for existing in active:
+        if os.path.normpath(existing.source_folder) == os.path.normpath(source_folder) and (existing.zone or None) == (zone or None):
+            return existing
+    job = db.IngestJob(collection_name=collection_name, source_folder=source_folder, latitude=latitude, longitude=longitude,
+                       index_profile=index_profile, metric_type=metric_type, zone=zone, status="QUEUED")
+    db_session.add(job)
+    db_session.commit()
+    return job
+
+def collection_has_running_job(db_session, collection_name: str):
+    """Whether any process is ingesting the collection right now."""
+    return db_session.query(db.IngestJob.id).filter(db.IngestJob.collection_name == collection_name, db.IngestJob.status == "RUNNING").first() is not None
+
+def job_progress(job: db.IngestJob):
+    """Serializes a job for the progress endpoint, including throughput since it started."""
+    elapsed = ((job.finished_at or job.heartbeat_at or utcnow()) - job.started_at).total_seconds() if job.started_at else 0
+    return {
+        "job_id": job.id,
+        "collection_name": job.collection_name,
+        "zone": job.zone,
+        "status": job.status,
+        "message": job.message,
+        "images_total": job.images_total,
+        "images_decoded": job.images_decoded,
+        "faces_embedded": job.faces_embedded,
+        "rows_inserted": job.rows_inserted,
+        "elapsed_seconds": round(elapsed, 1),
+        "images_per_second": round(job.images_decoded / elapsed, 2) if elapsed > 0 else 0.0,
+        "created_at": job.created_at.strftime("%Y-%m-%d %H:%M:%S") if job.created_at else None,
+        "finished_at": job.finished_at.strftime("%Y-%m-%d %H:%M:%S") if job.finished_at else None,
+    }
+
+
+class _ProgressHeartbeat:
+    """Keeps the latest counters in memory and persists them (plus a heartbeat) on a timer."""
+
+    def __init__(self, job_id: int):
+        self.job_id = job_id
+        self._counts = {}
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name=f"ingest-job-{job_id}-heartbeat", daemon=True)
+
+    def update(self, counts: dict):
+        with self._lock:
+            self._counts = counts
+
+    def __enter__(self):
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self._stop.set()
+        self._thread.join()
+        self._persist()
+
+    def _run(self):
+        while not self._stop.wait(JOB_HEARTBEAT_SECONDS):
+            self._persist()
+
+    def _persist(self):
+        with self._lock:
+            counts = dict(self._counts)
+        try:
+            with db.SessionLocal() as session:
+                session.query(db.IngestJob).filter(db.IngestJob.id == self.job_id).update({**counts, "heartbeat_at": utcnow()}, synchronize_session=False)
+                session.commit()
+        except Exception as e:
+            print(f"--- Could not record progress for ingest job {self.job_id}: {e} ---")
+
+
+class IngestJobWorker:
+    """
+    Runs queued ingest jobs one at a time on a background thread. Jobs interrupted by a
+    crash or restart are requeued once their heartbeat goes stale; because ingest diffs
+    against the file manifest, a resumed job only embeds files not yet recorded.
+    `on_complete(job)` runs after a successful ingest (e.g. to update the CollectionLog).
+    """
+
+    def __init__(self, on_complete=None):
+        self.on_complete = on_complete
+        self._wake = threading.Event()
+        self._stop = threading.Event()
+        self._thread = None
+
+    def start(self):
+        self._thread = threading.Thread(target=self._run, name="ingest-job-worker", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        self._wake.set()
+
+    def notify(self):
+        """Wakes the worker right away after a job was queued."""
+        self._wake.set()
+
+    def _run(self):
+        while not self._stop.is_set():
+            try:
+                self._requeue_stale_jobs()
+                job_id = self._claim_next_job()
+            except Exception as e:
+                print(f"--- Ingest job queue unavailable: {e} ---")
+                job_id = None
+            if job_id is None:
+                self._wake.wait(JOB_POLL_SECONDS)
+                self._wake.clear()
+                continue
+            self._execute(job_id)
+
+    def _requeue_stale_jobs(self):
+        stale_before = utcnow() - datetime.timedelta(seconds=JOB_STALE_SECONDS)
+        with db.SessionLocal() as session:
+            stale_jobs = session.query(db.IngestJob).filter(
+                db.IngestJob.status == "RUNNING",
+                or_(db.IngestJob.heartbeat_at == None, db.IngestJob.heartbeat_at < stale_before),
+            ).all()
+            for job in stale_jobs:
+                if job.attempts >= MAX_JOB_ATTEMPTS:
+                    job.status, job.finished_at = "FAILED", utcnow()
+                    job.message = f"Gave up after {job.attempts} interrupted attempts."
+                else:
+                    job.status, job.message = "QUEUED", "Resuming after an interrupted run."
+                print(f"--- Ingest job {job.id} was interrupted; now {job.status}. ---")
+            session.commit()
+
+    def _claim_next_job(self):
+        """
+        Atomically moves the oldest QUEUED job to RUNNING, so several app processes never run the
+        same job. Collections with a RUNNING job (in any process) are skipped until it finishes.
+        """
+        with db.SessionLocal() as session:
+            running = aliased(db.IngestJob)
+            job = session.query(db.IngestJob).filter(
+                db.IngestJob.status == "QUEUED",
+                ~exists().where(running.status == "RUNNING", running.collection_name == db.IngestJob.collection_name),
+            ).order_by(db.IngestJob.id).first()
+            if job is None:
+                return None
+            # Checked again in the UPDATE, via a derived table: MySQL rejects a subquery on the table being updated
+            running_jobs = session.query(db.IngestJob.collection_name).filter(db.IngestJob.status == "RUNNING").subquery()
+            collection_busy = exists().where(running_jobs.c.collection_name == job.collection_name)
+            now = utcnow()
+            claimed = session.query(db.IngestJob).filter(db.IngestJob.id == job.id, db.IngestJob.status == "QUEUED", ~collection_busy).update(
+                {"status": "RUNNING", "started_at": now, "heartbeat_at": now, "attempts": db.IngestJob.attempts + 1,
+                 "images_total": 0, "images_decoded": 0, "faces_embedded": 0, "rows_inserted": 0},
+                synchronize_session=False,
+            )
+            session.commit()
+            return job.id if claimed == 1 else None
+
+    def _execute(self, job_id: int):
+        with db.SessionLocal() as session:
+            job = session.query(db.IngestJob).filter(db.IngestJob.id == job_id).first()
+            collection_name, source_folder = job.collection_name, job.source_folder
+            index_profile, metric_type, zone = job.index_profile, job.metric_type, job.zone
+        print(f"--- Starting ingest job {job_id} for collection: {collection_name} ---")
+
+        try:
+            # The write lock waits for a sync or rebuild of the collection in this process to finish
+            with _ProgressHeartbeat(job_id) as heartbeat, engine_registry.write_lock(collection_name), \
+                 engine_registry.lease(collection_name, index_profile, metric_type) as engine:
+                result = engine.add_images_from_directory(source_folder, progress_callback=heartbeat.update, zone=zone)
+            if result.get("status") == "error":
+                self._finish(job_id, "FAILED", result.get("message"))
+                return
+            if self.on_complete:
+                with db.SessionLocal() as session:
+                    self.on_complete(session.query(db.IngestJob).filter(db.IngestJob.id == job_id).first())
+            self._finish(job_id, "COMPLETED", result.get("status"))
+        except Exception as e:
+            print(f"--- Ingest job {job_id} failed: {e} ---")
+            self._finish(job_id, "FAILED", str(e)[:1024])
+
+    def _finish(self, job_id: int, status: str, message: str):
+        with db.SessionLocal() as session:
+            session.query(db.IngestJob).filter(db.IngestJob.id == job_id).update(
+                {"status": status, "message": message, "finished_at": utcnow()}, synchronize_session=False)
+            session.commit()
+        print(f"--- Ingest job {job_id} {status.lower()}: {message} ---")
@@ -2,31 +2,37 @@
 
 # --- Standard Library Imports ---
 import os
-import io
-import zipfile
+import re
 import uvicorn
 import datetime
+from contextlib import contextmanager
 
 # --- Third-Party Imports ---
-import cv2
 import numpy as np
 from fastapi import FastAPI, File, UploadFile, HTTPException, Depends, Request, Form,BackgroundTasks
 from fastapi.responses import JSONResponse, StreamingResponse, HTMLResponse, RedirectResponse
 from fastapi.staticfiles import StaticFiles
 from geopy.geocoders import Nominatim
 from geopy.extra.rate_limiter import RateLimiter
+from fastapi.concurrency import run_in_threadpool
 from pydantic import BaseModel
-from pymilvus import utility
+from sqlalchemy import or_
 from sqlalchemy.orm import Session, joinedload
 from typing import List, Optional
 
 # --- Local Application Imports ---
 import database as db
-from dependencies import get_current_admin, get_current_guest, get_current_admin_api, get_current_guest_api
-from Face_search_logic_milvus import FaceSearchEngine, PREVIEW_IMAGE_DIR
+from dependencies import get_current_admin, get_current_guest, get_current_admin_api, get_current_guest_api, set_session_cookie, end_session, forget_principals
+from Face_search_logic_milvus import engine_registry, embed_query_bytes, decode_query_image, query_embedding_cache, preview_variant_paths, main_face_index, blend_face_profile, guest_profile_index, remove_collection_previews, PREVIEW_IMAGE_DIR
 from payment import router as payment_router
 from payment import DownloadRequest,EmailRequest
 from email_utils import send_photos_email
+from zip_stream import iter_zip_chunks
+from inference_executor import search_executor, ingest_executor
+from ingest_jobs import IngestJobWorker, enqueue_ingest_job, job_progress, collection_has_running_job
+from collection_stats import collection_stats_refresher, recount_collection_stats
+import vector_store
+from index_profiles import INDEX_PROFILES, SUPPORTED_METRICS, DEFAULT_INDEX_PROFILE, get_index_params
 
 # ===================================================================
 # 1. CORE APPLICATION SETUP
@@ -34,6 +40,9 @@ from email_utils import send_photos_email
 
 # --- Configuration & App Initialization ---
 BASE_IMAGE_DIRECTORY = "images"
+MAX_BATCH_SEARCH_IMAGES = int(os.getenv("MAX_BATCH_SEARCH_IMAGES", 8))
+COLLECTION_SEARCH_TIMEOUT = float(os.getenv("COLLECTION_SEARCH_TIMEOUT", 5.0))  # Seconds a fan-out search waits for all of its collections
+DATE_FILTER_PATTERN = re.compile(r"^\d{4}-\d{2}-\d{2}$")
 app = FastAPI(title="FaceSearch AI System", version="4.8.0",
               description="An AI-powered system for theme parks to manage and sell guest photos using face recognition.")
 
@@ -89,7 +98,7 @@ def get_address_from_coords(lat, lon):
 
 @app.on_event("startup")
 def startup_event():
-    """Initializes database tables and connects to Milvus on startup."""
+    """Initializes database tables and connects to the vector store on startup."""
     db.create_db_and_tables()
     os.makedirs(BASE_IMAGE_DIRECTORY, exist_ok=True)
     os.makedirs(PREVIEW_IMAGE_DIR, exist_ok=True)
@@ -100,13 +109,21 @@ def startup_event():
             session.add(default_admin)
             session.commit()
             print("--- Startup: Default admin user 'admin' created. ---")
-    utility.connections.connect("default", host=os.getenv("MILVUS_HOST", "127.0.0.1"), port=os.getenv("MILVUS_PORT", "19530"))
+    vector_store.connect()
+    db.activity_log_writer.start()
+    ingest_job_worker.start()
+    collection_stats_refresher.start()
     print("--- Startup: Application startup complete. ---")
 
 @app.on_event("shutdown")
 def shutdown_event():
-    """Disconnects from Milvus on shutdown."""
-    utility.connections.disconnect("default")
+    """Stops the ingest job worker, stats refresher and inference executors, flushes the activity log and disconnects from the vector store on shutdown."""
+    ingest_job_worker.stop()
+    collection_stats_refresher.stop()
+    search_executor.shutdown()
+    ingest_executor.shutdown()
+    db.activity_log_writer.stop()
+    vector_store.disconnect()
 
 # --- Static File and Asset Mounting ---
 app.mount("/static", StaticFiles(directory="frontend/static"), name="static")
@@ -117,6 +134,9 @@ app.mount("/images_preview", StaticFiles(directory=PREVIEW_IMAGE_DIR), name="ima
 # --- Pydantic API Models ---
 class UpdateRequest(BaseModel):
     source_directory: str; location: Optional[str] = None; latitude: float | None = None; longitude: float | None = None
+    index_profile: Optional[str] = None; metric_type: Optional[str] = None  # Only used when the collection is created
+    zone: Optional[str] = None  # Park zone of these photos; searches can be restricted to it
+class RebuildIndexRequest(BaseModel): index_profile: str; metric_type: Optional[str] = None
 class NewAdmin(BaseModel): username: str; password: str
 class BulkDeleteRequest(BaseModel): ids: List[int]
 class BulkDeleteNamesRequest(BaseModel): names: List[str]
@@ -176,7 +196,7 @@ async def guest_login(name: str = Form(...), mobile_number: str = Form(...), db_
         db_session.commit()
     db.log_activity(db_session, guest_id=guest.id, action="GUEST_LOGIN")
     response = RedirectResponse(url="/app", status_code=303)
-    response.set_cookie(key="guest_session", value=str(guest.id), httponly=True)
+    set_session_cookie(response, "guest", guest.id)
     response.headers["Cache-Control"] = "no-store, no-cache, must-revalidate, max-age=0"
     response.headers["Pragma"] = "no-cache"
     response.headers["Expires"] = "0"
@@ -184,10 +204,10 @@ async def guest_login(name: str = Form(...), mobile_number: str = Form(...), db_
     return response
         
 @app.post("/guest/logout", tags=["Authentication"])
-async def guest_logout():
-    """Logs out a guest by deleting their session cookie."""
+async def guest_logout(request: Request):
+    """Logs out a guest by revoking their session token and deleting the cookie."""
     response = RedirectResponse(url="/")
-    response.delete_cookie("guest_session")
+    end_session(request, response, "guest")
     return response
 
 @app.post("/admin/login", tags=["Authentication"])
@@ -197,155 +217,529 @@ async def admin_login(username: str = Form(...), password: str = Form(...), db_s
     if not admin or not db.verify_password(password, admin.hashed_password):
         raise HTTPException(status_code=400, detail="Incorrect username or password")
     response = RedirectResponse(url="/admin", status_code=303)
-    response.set_cookie(key="admin_session", value=str(admin.id), httponly=True)
+    set_session_cookie(response, "admin", admin.id)
     return response
 
 @app.post("/admin/logout", tags=["Authentication"])
-async def admin_logout():
-    """Logs out an admin by deleting their session cookie."""
+async def admin_logout(request: Request):
+    """Logs out an admin by revoking their session token and deleting the cookie."""
     response = RedirectResponse(url="/admin/login")
-    response.delete_cookie("admin_session")
+    end_session(request, response, "admin")
     return response
 
 # --- Guest-Facing APIs ---
 @app.get("/api/collections", tags=["Guest APIs"])
 async def api_list_collections(guest: db.Guest = Depends(get_current_guest_api)):
     """Returns a list of all available collections for the guest to search in."""
-    return {"collections": utility.list_collections()}
+    return {"collections": await run_in_threadpool(vector_store.list_collections)}
+
+def parse_search_filter(dates: Optional[str], zones: Optional[str]):
+    """Comma-separated YYYY-MM-DD dates and zone names from a search form, as lists (None when not given)."""
+    date_list = [value.strip() for value in dates.split(",") if value.strip()] if dates else None
+    for value in date_list or []:
+        if not DATE_FILTER_PATTERN.match(value):
+            raise HTTPException(status_code=400, detail=f"Invalid date '{value}'. Use YYYY-MM-DD.")
+    zone_list = [value.strip() for value in zones.split(",") if value.strip()] if zones else None
+    return date_list or None, zone_list or None
+
+def collection_partitions(collection_name: str):
+    """Capture dates and zones a collection's photos are partitioned by, for the search filter."""
+    dates, zones = set(), set()
+    with engine_registry.lease(collection_name) as search_engine:
+        partition_names = search_engine.store.partition_names()
+    for name in partition_names:
+        capture_date, zone = vector_store.parse_partition_name(name)
+        if capture_date: dates.add(capture_date)
+        if zone: zones.add(zone)
+    return {"dates": sorted(dates), "zones": sorted(zones)}
+
+@app.get("/api/collections/{collection_name}/partitions", tags=["Guest APIs"])
+async def api_collection_partitions(collection_name: str, guest: db.Guest = Depends(get_current_guest_api)):
+    """Dates and zones a search of this collection can be restricted to."""
+    if collection_name in vector_store.INTERNAL_COLLECTIONS or not await run_in_threadpool(vector_store.has_collection, collection_name):
+        raise HTTPException(status_code=404, detail=f"Collection '{collection_name}' not found.")
+    return await run_in_threadpool(collection_partitions, collection_name)
+
+def run_face_search(collection_name: str, contents: bytes, dates: list = None, zones: list = None):
+    """
+    Blocking part of a guest search: decode, detect/embed and query the vector store. Runs on the search executor.
+    Returns (data, (query_embeddings, bboxes)) so the caller can enroll the guest's face.
+    """
+    query_faces = embed_query_bytes(contents)
+    with engine_registry.lease(collection_name) as search_engine:
+        data = search_engine.search_faces(query_faces[0], dates=dates, zones=zones)
+    return attach_preview_paths(data, collection_name), query_faces
+
+def run_profile_search(collection_name: str, profile_embedding, dates: list = None, zones: list = None):
+    """A repeat search with the guest's enrolled face: a pure vector query, no upload or detection."""
+    with engine_registry.lease(collection_name) as search_engine:
+        data = search_engine.search_faces([profile_embedding], dates=dates, zones=zones)
+    return attach_preview_paths(data, collection_name)
+
+def run_batch_face_search(collection_name: str, contents_list: list):
+    """Blocking part of a multi-image search. Runs on the search executor as a single task."""
+    images_np = [decode_query_image(contents) for contents in contents_list]
+    with engine_registry.lease(collection_name) as search_engine:
+        data = search_engine.search_people(images_np)
+    for entry in data["per_image"]:
+        entry["results"] = with_preview_paths(entry["results"], collection_name)
+    return attach_preview_paths(data, collection_name)
+
+def run_query_embedding(contents: bytes):
+    """Decodes an upload and embeds its faces once, for reuse across collections. Returns (query_embeddings, bboxes)."""
+    return embed_query_bytes(contents)
+
+def load_face_profile(guest: db.Guest):
+    """The guest's enrolled embedding, or None."""
+    profile = guest.face_profile
+    return np.frombuffer(profile.embedding, dtype=np.float32) if profile else None
+
+def face_profile_change(guest: db.Guest, query_embeddings: list, bboxes: list):
+    """
+    What enrolling the main face of an uploaded selfie will do to the guest's face profile:
+    "enrolled", "updated" or "unchanged" (no face, or not the enrolled person). Read-only.
+    """
+    if not query_embeddings:
+        return "unchanged"
+    profile = guest.face_profile
+    blended = blend_face_profile(load_face_profile(guest), profile.sample_count if profile else 0, query_embeddings[main_face_index(bboxes)])
+    if blended is None:
+        return "unchanged"
+    return "enrolled" if profile is None else "updated"
+
+def enroll_guest_face(guest_id: int, embedding):
+    """
+    Background task after a selfie search: creates or refines the guest's face profile, so
+    later searches can skip the upload, and mirrors it into the guest profile index that new
+    photos are matched against. Best effort: the search has already been answered, so a
+    failure (e.g. two first searches racing on the unique guest_id) is logged, not raised.
+    """
+    try:
+        with db.SessionLocal() as session:
+            profile = session.query(db.GuestFaceProfile).filter(db.GuestFaceProfile.guest_id == guest_id).first()
+            current = np.frombuffer(profile.embedding, dtype=np.float32) if profile else None
+            blended = blend_face_profile(current, profile.sample_count if profile else 0, embedding)
+            if blended is None:
+                return
+            embedding, sample_count = blended
+            if profile is None:
+                session.add(db.GuestFaceProfile(guest_id=guest_id, embedding=embedding.astype(np.float32).tobytes(), sample_count=sample_count))
+            else:
+                profile.embedding, profile.sample_count = embedding.astype(np.float32).tobytes(), sample_count
+            session.commit()
+    except Exception as e:
+        print(f"--- Could not save the face profile of guest {guest_id}: {e} ---")
+        return
+    try:
+        guest_profile_index.upsert(guest_id, embedding)
+    except Exception as e:
+        print(f"--- Could not update the guest profile index for guest {guest_id}: {e} ---")
+
+def schedule_enrollment(background_tasks: BackgroundTasks, guest: db.Guest, query_embeddings: list, bboxes: list):
+    """Predicts the face profile change of a selfie search and queues the write to run after the response."""
+    status = face_profile_change(guest, query_embeddings, bboxes)
+    if status != "unchanged":
+        background_tasks.add_task(enroll_guest_face, guest.id, query_embeddings[main_face_index(bboxes)])
+    return status
+
+def run_embedding_search(collection_name: str, query_embeddings: list, dates: list = None, zones: list = None):
+    """Searches one collection with precomputed embeddings and tags each result with its collection."""
+    with engine_registry.lease(collection_name) as search_engine:
+        results = with_preview_paths(search_engine.search_embeddings(query_embeddings, dates=dates, zones=zones), collection_name)
+    for result in results:
+        result["collection"] = collection_name
+    return results
+
+def run_fanout_search(names: list, query_embeddings: list, dates: list = None, zones: list = None):
+    """
+    Blocking multi-collection search, one search executor task per request: the collections are
+    searched on the bounded fan-out pool with COLLECTION_SEARCH_TIMEOUT for all of them.
+    Returns, per collection, its results or the exception (TimeoutError if it ran out of time).
+    """
+    return search_executor.fan_out(lambda name: run_embedding_search(name, query_embeddings, dates, zones), names, COLLECTION_SEARCH_TIMEOUT)
+
+def attach_preview_paths(data: dict, collection_name: str):
+    """Keeps only results with a preview on disk and adds their web paths."""
+    corrected_results = with_preview_paths(data.get("results", []), collection_name)
+    data["results"] = corrected_results
+    if not corrected_results:
+        data["status"] = "Search complete. No matches found."
+    else:
+        data["status"] = f"Search complete. Found {len(corrected_results)} potential matches."
+    return data
+
+def with_preview_paths(results: list, collection_name: str):
+    """Filters a result list down to images whose preview exists, adding web paths of each preview variant and the original path."""
+    corrected_results = []
+    for result in results:
+        original_path = result["image_path"]
+        variant_paths = preview_variant_paths(collection_name, original_path)
+
+        # Only results with a rendered lightbox preview are shown; other variants are optional
+        if os.path.exists(variant_paths["preview"]):
+            result["web_path"] = "/" + variant_paths["preview"].replace('\\', '/')
+            for variant, path_on_disk in variant_paths.items():
+                if variant != "preview" and os.path.exists(path_on_disk):
+                    result[f"{variant}_path"] = "/" + path_on_disk.replace('\\', '/')
+            if result.get("face_crop"):
+                result["face_crop_path"] = "/" + result.pop("face_crop").replace('\\', '/')
+            result["original_path"] = original_path
+            corrected_results.append(result)
+    return corrected_results
 
-# --- REPLACE THE OLD 'api_search_face' FUNCTION WITH THIS ONE ---
 @app.post("/api/search/{collection_name}", tags=["Guest APIs"])
-async def api_search_face(collection_name: str, file: UploadFile = File(...), guest: db.Guest = Depends(get_current_guest_api), db_session: Session = Depends(db.get_db)):
-    """Performs a face search in the specified collection for the guest."""
-    db.log_activity(db_session, guest_id=guest.id, action="PERFORM_SEARCH", details=f"Searched in collection: {collection_name}")
+async def api_search_face(collection_name: str, background_tasks: BackgroundTasks, file: Optional[UploadFile] = File(None), dates: Optional[str] = Form(None), zones: Optional[str] = Form(None),
+                          guest: db.Guest = Depends(get_current_guest_api), db_session: Session = Depends(db.get_db)):
+    """
+    Performs a face search in the specified collection for the guest. An uploaded selfie also
+    enrolls/refines the guest's face profile after the response; without an upload the enrolled face is used.
+    Optional comma-separated dates (YYYY-MM-DD) and zones only search those partitions.
+    """
+    date_list, zone_list = parse_search_filter(dates, zones)
+    profile_embedding = None if file else load_face_profile(guest)
+    if not file and profile_embedding is None:
+        raise HTTPException(status_code=400, detail="Please capture a photo first.")
+    db.log_activity(db_session, guest_id=guest.id, action="PERFORM_SEARCH", details=f"Searched in collection: {collection_name}" + ("" if file else " (saved face)"))
     try:
-        search_engine = FaceSearchEngine(collection_name=collection_name)
+        if not file:
+            return JSONResponse(content=await search_executor.run(run_profile_search, collection_name, profile_embedding, date_list, zone_list))
         contents = await file.read()
-        nparr = np.frombuffer(contents, np.uint8)
-        img_np = cv2.imdecode(nparr, cv2.IMREAD_COLOR)
-        data = search_engine.search_person(img_np)
-        
-        corrected_results = []
-        for result in data.get("results", []):
-            original_path = result["image_path"]
-            preview_filename = os.path.basename(original_path)
-            
-            # --- KEY CHANGE: The web path now includes the collection_name subfolder
-            web_path = f"/{PREVIEW_IMAGE_DIR}/{collection_name}/{preview_filename}".replace('\\', '/')
-            
-            # Check if the file exists on disk using its full, correct path
-            preview_path_on_disk = os.path.join(PREVIEW_IMAGE_DIR, collection_name, preview_filename)
-
-            if os.path.exists(preview_path_on_disk):
-                result["web_path"] = web_path
-                result["original_path"] = original_path
-                corrected_results.append(result)
-
-        data["results"] = corrected_results
-        if not corrected_results:
-            data["status"] = "Search complete. No matches found."
-        else:
-            data["status"] = f"Search complete. Found {len(corrected_results)} potential matches."
+        data, query_faces = await search_executor.run(run_face_search, collection_name, contents, date_list, zone_list)
+    except HTTPException:
+        raise
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+    data["face_profile"] = await run_in_threadpool(schedule_enrollment, background_tasks, guest, *query_faces)
+    return JSONResponse(content=data)
+
+@app.get("/api/search/{collection_name}/burst", tags=["Guest APIs"])
+async def api_expand_burst(collection_name: str, image_path: str, guest: db.Guest = Depends(get_current_guest_api), db_session: Session = Depends(db.get_db)):
+    """The near-identical burst frames a result with a burst_size stands in for."""
+    members = db.get_burst_members(db_session, collection_name, image_path)
+    results = await run_in_threadpool(with_preview_paths, [{"image_path": member} for member in members], collection_name)
+    for result in results:
+        result["collection"] = collection_name
+    return {"results": results}
+
+@app.post("/api/search-batch/{collection_name}", tags=["Guest APIs"])
+async def api_search_faces_batch(collection_name: str, files: List[UploadFile] = File(...), guest: db.Guest = Depends(get_current_guest_api), db_session: Session = Depends(db.get_db)):
+    """Searches several photos (e.g. a group shot plus selfies) in one request and one vector store query."""
+    if not files:
+        raise HTTPException(status_code=400, detail="No images provided.")
+    if len(files) > MAX_BATCH_SEARCH_IMAGES:
+        raise HTTPException(status_code=400, detail=f"A batch search accepts at most {MAX_BATCH_SEARCH_IMAGES} images.")
+    db.log_activity(db_session, guest_id=guest.id, action="PERFORM_SEARCH", details=f"Batch searched {len(files)} images in collection: {collection_name}")
+    try:
+        contents_list = [await file.read() for file in files]
+        data = await search_executor.run(run_batch_face_search, collection_name, contents_list)
         return JSONResponse(content=data)
+    except HTTPException:
+        raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
+@app.post("/api/search-all", tags=["Guest APIs"])
+async def api_search_across_collections(background_tasks: BackgroundTasks, file: Optional[UploadFile] = File(None), collections: Optional[str] = Form(None), dates: Optional[str] = Form(None),
+                                        zones: Optional[str] = Form(None), guest: db.Guest = Depends(get_current_guest_api), db_session: Session = Depends(db.get_db)):
+    """
+    Embeds the query face once (or uses the guest's enrolled face when nothing is uploaded)
+    and searches a comma-separated list of collections (or all of them) concurrently,
+    merging every match by distance. dates/zones restrict every collection's search as in /api/search.
+    """
+    date_list, zone_list = parse_search_filter(dates, zones)
+    profile_embedding = None if file else load_face_profile(guest)
+    if not file and profile_embedding is None:
+        raise HTTPException(status_code=400, detail="Please capture a photo first.")
+    available = await run_in_threadpool(vector_store.list_collections)
+    names = [name.strip() for name in collections.split(",") if name.strip() in available] if collections else available
+    if not names:
+        raise HTTPException(status_code=404, detail="No matching collections to search.")
+    db.log_activity(db_session, guest_id=guest.id, action="PERFORM_SEARCH", details=f"Searched across {len(names)} collections" + ("" if file else " (saved face)"))
+    face_profile_status = "unchanged"
+    if file:
+        try:
+            contents = await file.read()
+            query_embeddings, bboxes = await search_executor.run(run_query_embedding, contents)
+        except HTTPException:
+            raise
+        except Exception as e:
+            raise HTTPException(status_code=500, detail=str(e))
+        face_profile_status = await run_in_threadpool(schedule_enrollment, background_tasks, guest, query_embeddings, bboxes)
+    else:
+        query_embeddings = [profile_embedding]
+    if not query_embeddings:
+        return JSONResponse(content={"status": "No faces detected in the uploaded image.", "results": [], "collections": []})
+
+    outcomes = await search_executor.run(run_fanout_search, names, query_embeddings, date_list, zone_list)
+    merged_results, collection_statuses = [], []
+    for name, outcome in zip(names, outcomes):
+        if isinstance(outcome, TimeoutError):
+            collection_statuses.append({"name": name, "status": "timeout", "matches": 0})
+        elif isinstance(outcome, Exception):
+            print(f"--- Fan-out search failed for {name}: {outcome} ---")
+            collection_statuses.append({"name": name, "status": "error", "matches": 0})
+        else:
+            collection_statuses.append({"name": name, "status": "ok", "matches": len(outcome)})
+            merged_results.extend(outcome)
+    merged_results.sort(key=lambda x: x["distance"])
+
+    status_msg = f"Search complete. Found {len(merged_results)} potential matches across {len(names)} collections." if merged_results else "Search complete. No matches found."
+    return JSONResponse(content={"status": status_msg, "results": merged_results, "collections": collection_statuses, "face_profile": face_profile_status})
+
+@app.get("/api/guest/face-profile", tags=["Guest APIs"])
+async def api_get_face_profile(guest: db.Guest = Depends(get_current_guest_api)):
+    """Whether the guest has an enrolled face, so the UI can offer a search without a new selfie."""
+    profile = guest.face_profile
+    if not profile:
+        return {"enrolled": False}
+    return {"enrolled": True, "samples": profile.sample_count, "updated_at": profile.updated_at.strftime("%Y-%m-%d %H:%M:%S")}
+
+@app.delete("/api/guest/face-profile", tags=["Guest APIs"])
+async def api_delete_face_profile(guest: db.Guest = Depends(get_current_guest_api), db_session: Session = Depends(db.get_db)):
+    """Forgets the guest's enrolled face."""
+    db_session.query(db.GuestFaceProfile).filter(db.GuestFaceProfile.guest_id == guest.id).delete(synchronize_session=False)
+    db_session.commit()
+    await run_in_threadpool(guest_profile_index.remove, [guest.id])
+    return {"status": "success", "message": "Your saved face has been removed."}
+
+def build_new_photo_results(matches: list):
+    """Turns unseen match rows into search-style results, grouped per collection for the preview lookup."""
+    by_collection = {}
+    for match in matches:
+        by_collection.setdefault(match.collection_name, []).append({"image_path": match.image_path, "distance": match.distance, "match_id": match.id})
+    results = []
+    for collection_name, collection_results in by_collection.items():
+        for result in with_preview_paths(collection_results, collection_name):
+            result["collection"] = collection_name
+            results.append(result)
+    results.sort(key=lambda x: x["distance"])
+    return results
+
+@app.get("/api/guest/new-photos", tags=["Guest APIs"])
+async def api_get_new_photos(guest: db.Guest = Depends(get_current_guest_api), db_session: Session = Depends(db.get_db)):
+    """Photos ingested since the guest enrolled their face that matched it and have not been viewed yet."""
+    matches = db_session.query(db.GuestPhotoMatch).filter(db.GuestPhotoMatch.guest_id == guest.id, db.GuestPhotoMatch.seen_at == None).all()
+    results = await run_in_threadpool(build_new_photo_results, matches)
+    status_msg = f"Found {len(results)} new photos of you." if results else "No new photos of you yet."
+    return {"status": status_msg, "results": results}
+
+@app.post("/api/guest/new-photos/seen", tags=["Guest APIs"])
+async def api_mark_new_photos_seen(guest: db.Guest = Depends(get_current_guest_api), db_session: Session = Depends(db.get_db)):
+    """Marks all of the guest's new-photo matches as viewed."""
+    db_session.query(db.GuestPhotoMatch).filter(db.GuestPhotoMatch.guest_id == guest.id, db.GuestPhotoMatch.seen_at == None).update(
+        {"seen_at": datetime.datetime.utcnow()}, synchronize_session=False)
+    db_session.commit()
+    return {"status": "success"}
+
 @app.post("/api/download-selected/", tags=["Guest APIs"])
 async def api_download_selected(request: DownloadRequest, guest: db.Guest = Depends(get_current_guest_api), db_session: Session = Depends(db.get_db)):
     """Creates and streams a ZIP file of the selected high-quality original images."""
     db.log_activity(db_session, guest_id=guest.id, action="DOWNLOAD_PHOTOS", details=f"Downloaded {len(request.image_paths)} photos.")
-    zip_io = io.BytesIO()
-    with zipfile.ZipFile(zip_io, mode='w', compression=zipfile.ZIP_DEFLATED) as temp_zip:
-        for original_path in request.image_paths:
-            if os.path.exists(original_path):
-                temp_zip.write(original_path, arcname=os.path.basename(original_path))
-    zip_io.seek(0)
-    return StreamingResponse(zip_io, media_type="application/zip", headers={"Content-Disposition": "attachment; filename=FaceSearch_Memories.zip"})
+    return StreamingResponse(iter_zip_chunks(request.image_paths), media_type="application/zip", headers={"Content-Disposition": "attachment; filename=FaceSearch_Memories.zip"})
 
 # --- Admin-Only APIs ---
 @app.get("/api/admin/collections", tags=["Admin APIs"])
 async def api_get_collections_data(db_session: Session = Depends(db.get_db), admin: db.Admin = Depends(get_current_admin_api)):
-    """Fetches detailed data for all collections for the admin dashboard."""
-    collections_milvus = utility.list_collections()
-    collection_logs = db_session.query(db.CollectionLog).all()
-    log_map = {log.collection_name: log for log in collection_logs}
-    collections_data = []
-    for name in collections_milvus:
-        embedding_count = "N/A"
-        try:
-            stats = utility.get_collection_stats(collection_name=name)
-            embedding_count = next((stat.value for stat in stats if stat.key == 'row_count'), "N/A")
-        except Exception:
-            embedding_count = "Error"
-        log_entry = log_map.get(name)
-        total_images = 0
-        if log_entry and log_entry.source_folder and os.path.isdir(log_entry.source_folder):
-            total_images = len([f for f in os.listdir(log_entry.source_folder) if f.lower().endswith(('.png', '.jpg', '.jpeg'))])
-        collections_data.append({
-            "name": name,
-            "upload_datetime": log_entry.upload_datetime.strftime("%Y-%m-%d %H:%M") if log_entry else "N/A",
-            "source_folder": log_entry.source_folder if log_entry else "N/A",
-            "location": log_entry.location if log_entry else "N/A",
-            "status": int(embedding_count) if str(embedding_count).isdigit() else embedding_count,
-            "total_images": total_images,
-        })
-    return {"collections": collections_data}
+    """
+    Fetches detailed data for all collections for the admin dashboard: every collection in the
+    vector store, with its precomputed stats, or "pending" until its first recount.
+    """
+    try:
+        names = await run_in_threadpool(vector_store.list_collections)
+    except Exception as e:
+        print(f"--- Could not list collections, showing those with stats: {e} ---")
+        names = [row.collection_name for row in db_session.query(db.CollectionStats.collection_name).all()]
+    if not names:
+        return {"collections": [], "preview_cache": collection_stats_refresher.preview_cache}
+    stats_by_name = {stats.collection_name: stats for stats in db_session.query(db.CollectionStats).filter(db.CollectionStats.collection_name.in_(names))}
+    logs_by_name = {log_entry.collection_name: log_entry for log_entry in db_session.query(db.CollectionLog).filter(db.CollectionLog.collection_name.in_(names))}
+    return {"collections": [collection_summary(name, stats_by_name.get(name), logs_by_name.get(name)) for name in sorted(names)],
+            "preview_cache": collection_stats_refresher.preview_cache}
+
+def collection_summary(name: str, stats: Optional[db.CollectionStats], log_entry: Optional[db.CollectionLog]):
+    summary = {
+        "name": name,
+        "upload_datetime": log_entry.upload_datetime.strftime("%Y-%m-%d %H:%M") if log_entry else "N/A",
+        "source_folder": log_entry.source_folder if log_entry else "N/A",
+        "location": log_entry.location if log_entry else "N/A",
+    }
+    if stats is None:  # Not counted yet: created by another process, or before the first refresh finished
+        return {**summary, "status": "pending", "total_images": "pending", "preview_count": None, "disk_bytes": None, "stats_refreshed_at": None}
+    return {
+        **summary,
+        "status": stats.row_count if stats.row_count is not None else "Error",
+        "total_images": stats.image_count,
+        "preview_count": stats.preview_count,
+        "disk_bytes": (stats.source_bytes or 0) + (stats.preview_bytes or 0),
+        "stats_refreshed_at": stats.refreshed_at.strftime("%Y-%m-%d %H:%M:%S"),
+    }
+
+@app.get("/api/admin/search-cache", tags=["Admin APIs"])
+async def api_get_search_cache_stats(admin: db.Admin = Depends(get_current_admin_api)):
+    """Reports hit/miss counters of the query embedding cache."""
+    return query_embedding_cache.stats()
+
+@app.get("/api/admin/db-pool", tags=["Admin APIs"])
+async def api_get_db_pool_stats(admin: db.Admin = Depends(get_current_admin_api)):
+    """Connection pool utilization and checkout waits of the process serving this request."""
+    return db.pool_status()
+
+def admin_page(query, sort_column, id_column, cursor: Optional[str], limit: int):
+    """Keyset page for the admin tables; a tampered or stale cursor is a 400, not a 500."""
+    try:
+        return db.keyset_page(query, sort_column, id_column, cursor, max(1, min(limit, db.ADMIN_PAGE_SIZE_MAX)))
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+def filter_date_range(query, column, date_from: Optional[datetime.date], date_to: Optional[datetime.date]):
+    """Inclusive YYYY-MM-DD range on a DateTime column, kept sargable so the index still applies."""
+    if date_from: query = query.filter(column >= datetime.datetime.combine(date_from, datetime.time.min))
+    if date_to: query = query.filter(column < datetime.datetime.combine(date_to + datetime.timedelta(days=1), datetime.time.min))
+    return query
 
 @app.get("/api/admin/guests", tags=["Admin APIs"])
-async def api_get_guests_data(db_session: Session = Depends(db.get_db), admin: db.Admin = Depends(get_current_admin_api)):
-    guests = db_session.query(db.Guest).order_by(db.Guest.id.desc()).all()
+async def api_get_guests_data(cursor: Optional[str] = None, limit: int = db.ADMIN_PAGE_SIZE, search: Optional[str] = None,
+                              date_from: Optional[datetime.date] = None, date_to: Optional[datetime.date] = None,
+                              db_session: Session = Depends(db.get_db), admin: db.Admin = Depends(get_current_admin_api)):
+    """Guests newest first, one page at a time. `search` is a name or mobile number prefix."""
+    query = filter_date_range(db_session.query(db.Guest), db.Guest.created_at, date_from, date_to)
+    if search and search.strip():
+        query = query.filter(or_(db.Guest.name.startswith(search.strip(), autoescape=True), db.Guest.mobile_number.startswith(search.strip(), autoescape=True)))
+    guests, next_cursor = admin_page(query, db.Guest.created_at, db.Guest.id, cursor, limit)
     guests_data = [{"id": g.id, "name": g.name, "mobile_number": g.mobile_number, "created_at": g.created_at.strftime("%Y-%m-%d %H:%M:%S")} for g in guests]
-    return {"guests": guests_data}
+    return {"guests": guests_data, "next_cursor": next_cursor}
 
 @app.get("/api/admin/activities", tags=["Admin APIs"])
-async def api_get_activities_data(db_session: Session = Depends(db.get_db), admin: db.Admin = Depends(get_current_admin_api)):
-    activities = db_session.query(db.ActivityLog).options(joinedload(db.ActivityLog.guest)).order_by(db.ActivityLog.timestamp.desc()).limit(200).all()
+async def api_get_activities_data(cursor: Optional[str] = None, limit: int = db.ADMIN_PAGE_SIZE, action: Optional[str] = None, guest_id: Optional[int] = None,
+                                  date_from: Optional[datetime.date] = None, date_to: Optional[datetime.date] = None,
+                                  db_session: Session = Depends(db.get_db), admin: db.Admin = Depends(get_current_admin_api)):
+    """Activity log newest first, one page at a time, optionally for one action and/or guest."""
+    query = filter_date_range(db_session.query(db.ActivityLog).options(joinedload(db.ActivityLog.guest)), db.ActivityLog.timestamp, date_from, date_to)
+    if action: query = query.filter(db.ActivityLog.action == action)
+    if guest_id is not None: query = query.filter(db.ActivityLog.guest_id == guest_id)
+    activities, next_cursor = admin_page(query, db.ActivityLog.timestamp, db.ActivityLog.id, cursor, limit)
     activities_data = [{"id": a.id, "guest_name": a.guest.name if a.guest else "Deleted Guest", "action": a.action, "details": a.details, "timestamp": a.timestamp.strftime("%Y-%m-%d %H:%M:%S")} for a in activities]
-    return {"activities": activities_data}
+    return {"activities": activities_data, "next_cursor": next_cursor}
 
 @app.get("/api/admin/admins", tags=["Admin APIs"])
 async def api_get_admins_data(db_session: Session = Depends(db.get_db), admin: db.Admin = Depends(get_current_admin_api)):
-    admins = db_session.query(db.Admin).all()
-    return {"admins": admins}
+    admins = db_session.query(db.Admin.id, db.Admin.username).order_by(db.Admin.id).all()
+    return {"admins": [{"id": a.id, "username": a.username} for a in admins]}
 
 @app.get("/api/admin/available-folders", tags=["Admin APIs"])
 async def api_get_available_folders(admin: db.Admin = Depends(get_current_admin_api)):
     if not os.path.isdir(BASE_IMAGE_DIRECTORY): return {"folders": []}
     return {"folders": [item for item in os.listdir(BASE_IMAGE_DIRECTORY) if os.path.isdir(os.path.join(BASE_IMAGE_DIRECTORY, item))]}
 
-@app.post("/api/admin/update-collection/{collection_name}", tags=["Admin APIs"])
+def record_collection_log(job: db.IngestJob):
+    """Geocodes and upserts the CollectionLog once an ingest job has finished. Runs on the job worker thread."""
+    location_name = get_address_from_coords(job.latitude, job.longitude)
+    with db.SessionLocal() as session:
+        log = session.query(db.CollectionLog).filter_by(collection_name=job.collection_name).first()
+        if not log:
+            log = db.CollectionLog(collection_name=job.collection_name, source_folder=job.source_folder, location=location_name, latitude=job.latitude, longitude=job.longitude)
+            session.add(log)
+        else:
+            log.upload_datetime = datetime.datetime.now(datetime.UTC)
+            log.location = location_name; log.latitude = job.latitude; log.longitude = job.longitude
+        session.commit()
+    recount_collection_stats(job.collection_name)
+
+ingest_job_worker = IngestJobWorker(on_complete=record_collection_log)
+
+@contextmanager
+def collection_write_access(collection_name: str):
+    """
+    Holds the collection's write lock for a sync or rebuild, or raises 409 if an ingest, sync or
+    rebuild of it is running (in this process, or an ingest job in any process).
+    """
+    lock = engine_registry.write_lock(collection_name)
+    if not lock.acquire(blocking=False):
+        raise HTTPException(status_code=409, detail=f"Collection '{collection_name}' is being updated. Please try again when that finishes.")
+    try:
+        with db.SessionLocal() as session:
+            if collection_has_running_job(session, collection_name):
+                raise HTTPException(status_code=409, detail=f"Collection '{collection_name}' is being ingested. Please try again when the job finishes.")
+        yield
+    finally:
+        lock.release()
+
+def run_rebuild_index(collection_name: str, index_profile: str, metric_type: str = None):
+    """Blocking index rebuild. Runs on the ingest executor."""
+    with collection_write_access(collection_name), engine_registry.lease(collection_name) as engine:
+        rebuild_status = engine.rebuild_index(index_profile, metric_type)
+    engine_registry.refresh(collection_name)
+    return rebuild_status
+
+def run_sync_directory(collection_name: str, source_directory: str):
+    """Blocking removal of stale entries. Runs on the ingest executor."""
+    with collection_write_access(collection_name), engine_registry.lease(collection_name) as engine:
+        sync_status = engine.sync_directory(source_directory)
+    if sync_status.get("removed_count"): recount_collection_stats(collection_name)
+    return sync_status
+
+@app.post("/api/admin/update-collection/{collection_name}", status_code=202, tags=["Admin APIs"])
 async def api_update_collection(collection_name: str, request: UpdateRequest, db_session: Session = Depends(db.get_db), admin: db.Admin = Depends(get_current_admin_api)):
-    """Creates a new collection or updates an existing one with new images."""
-    engine = FaceSearchEngine(collection_name=collection_name)
-    add_status = engine.add_images_from_directory(request.source_directory)
-    if add_status.get("status") == "error":
-        raise HTTPException(status_code=404, detail=add_status["message"])
-    location_name = get_address_from_coords(request.latitude, request.longitude)
-    log = db_session.query(db.CollectionLog).filter_by(collection_name=collection_name).first()
-    if not log:
-        log = db.CollectionLog(collection_name=collection_name, source_folder=request.source_directory, location=location_name, latitude=request.latitude, longitude=request.longitude)
-        db_session.add(log)
-    else:
-        log.upload_datetime = datetime.datetime.now(datetime.UTC)
-        log.location = location_name; log.latitude = request.latitude; log.longitude = request.longitude
-    db_session.commit()
-    return JSONResponse(content=add_status)
+    """Queues creating or updating a collection with new images. Poll the returned job for progress."""
+    if collection_name in vector_store.INTERNAL_COLLECTIONS:
+        raise HTTPException(status_code=400, detail=f"'{collection_name}' is a reserved collection name.")
+    if request.index_profile or request.metric_type:
+        try:
+            get_index_params(request.index_profile, request.metric_type or "L2")
+        except ValueError as e:
+            raise HTTPException(status_code=400, detail=str(e))
+    if not os.path.isdir(request.source_directory):
+        raise HTTPException(status_code=404, detail=f"Source directory '{request.source_directory}' not found.")
+    job = enqueue_ingest_job(db_session, collection_name, request.source_directory, request.latitude, request.longitude, request.index_profile, request.metric_type,
+                             request.zone)
+    ingest_job_worker.notify()
+    return JSONResponse(status_code=202, content={"status": "queued", "message": f"Ingest of '{collection_name}' is {job.status.lower()}.", "job_id": job.id})
+
+@app.get("/api/admin/ingest-jobs/{job_id}", tags=["Admin APIs"])
+async def api_get_ingest_job(job_id: int, db_session: Session = Depends(db.get_db), admin: db.Admin = Depends(get_current_admin_api)):
+    """Progress of a queued or running ingest job."""
+    job = db_session.query(db.IngestJob).filter(db.IngestJob.id == job_id).first()
+    if not job:
+        raise HTTPException(status_code=404, detail="Ingest job not found.")
+    return job_progress(job)
 
 @app.post("/api/admin/sync-collection/{collection_name}", tags=["Admin APIs"])
 async def api_sync_collection(collection_name: str, request: UpdateRequest, admin: db.Admin = Depends(get_current_admin_api)):
-    engine = FaceSearchEngine(collection_name=collection_name)
-    sync_status = engine.sync_directory(request.source_directory)
+    sync_status = await ingest_executor.run(run_sync_directory, collection_name, request.source_directory)
     if sync_status.get("status") == "error":
         raise HTTPException(status_code=404, detail=sync_status["message"])
     return JSONResponse(content=sync_status)
 
+@app.get("/api/admin/index-profiles", tags=["Admin APIs"])
+async def api_get_index_profiles(admin: db.Admin = Depends(get_current_admin_api)):
+    """Lists the vector index profiles a collection can be created or rebuilt with."""
+    return {"profiles": INDEX_PROFILES, "metrics": list(SUPPORTED_METRICS), "default": DEFAULT_INDEX_PROFILE}
+
+@app.post("/api/admin/rebuild-index/{collection_name}", tags=["Admin APIs"])
+async def api_rebuild_index(collection_name: str, request: RebuildIndexRequest, admin: db.Admin = Depends(get_current_admin_api)):
+    """Rebuilds a collection's vector index with another profile and/or metric."""
+    if not await run_in_threadpool(vector_store.has_collection, collection_name):
+        raise HTTPException(status_code=404, detail=f"Collection '{collection_name}' not found.")
+    try:
+        get_index_params(request.index_profile, request.metric_type or "L2")
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    rebuild_status = await ingest_executor.run(run_rebuild_index, collection_name, request.index_profile, request.metric_type)
+    return JSONResponse(content=rebuild_status)
+
 @app.delete("/api/admin/collections/bulk", tags=["Admin APIs"])
 async def api_bulk_delete_collections(request: BulkDeleteNamesRequest, db_session: Session = Depends(db.get_db), admin: db.Admin = Depends(get_current_admin_api)):
     for name in request.names:
-        if utility.has_collection(name):
-            utility.drop_collection(name)
+        if await run_in_threadpool(vector_store.has_collection, name):
+            await run_in_threadpool(engine_registry.discard, name)
+            await run_in_threadpool(vector_store.drop_collection, name)
+            await run_in_threadpool(remove_collection_previews, name)
             log = db_session.query(db.CollectionLog).filter_by(collection_name=name).first()
             if log: db_session.delete(log)
+            db.delete_manifest_entries(db_session, name, commit=False)
+            db.delete_guest_matches(db_session, name, commit=False)
+            db.delete_bursts(db_session, name, commit=False)
+            db.delete_collection_stats(db_session, [name], commit=False)
     db_session.commit()
     return {"status": "success", "message": "Selected collections deleted."}
 
@@ -353,6 +747,8 @@ async def api_bulk_delete_collections(request: BulkDeleteNamesRequest, db_sessio
 async def api_bulk_delete_guests(request: BulkDeleteRequest, db_session: Session = Depends(db.get_db), admin: db.Admin = Depends(get_current_admin_api)):
     db_session.query(db.Guest).filter(db.Guest.id.in_(request.ids)).delete(synchronize_session=False)
     db_session.commit()
+    forget_principals("guest", request.ids)
+    await run_in_threadpool(guest_profile_index.remove, request.ids)
     return {"status": "success", "message": "Selected guests deleted."}
 
 @app.delete("/api/admin/activities/bulk", tags=["Admin APIs"])
@@ -375,6 +771,7 @@ async def api_bulk_delete_admins(request: BulkDeleteRequest, db_session: Session
         raise HTTPException(status_code=400, detail="Bulk delete cannot include your own admin account.")
     db_session.query(db.Admin).filter(db.Admin.id.in_(request.ids)).delete(synchronize_session=False)
     db_session.commit()
+    forget_principals("admin", request.ids)
     return {"status": "success", "message": "Selected admin users deleted."}
 
 @app.post("/api/admin/login-as-guest/{guest_id}", tags=["Admin APIs"])
@@ -383,7 +780,7 @@ async def api_login_as_guest(guest_id: int, admin: db.Admin = Depends(get_curren
     if not guest:
         raise HTTPException(status_code=404, detail="Guest not found.")
     response = JSONResponse(content={"redirect_url": "/app"})
-    response.set_cookie(key="guest_session", value=str(guest.id), httponly=True)
+    set_session_cookie(response, "guest", guest.id)
     return response
 
 # ===================================================================
@@ -0,0 +1,162 @@
+# tests/test_vector_store.py
+"""
+Backend contract for vector_store: every VectorStore must pass the same tests.
+The local memory-mapped backend always runs; the Milvus backend runs only with
+MILVUS_TEST=1 and a reachable server at MILVUS_HOST:MILVUS_PORT.
+
+    python -m pytest -q tests
+"""
+
+import os
+import uuid
+
+import numpy as np
+import pytest
+
+import vector_store
+
+DIM = 16
+
+
+def unit(seed: int):
+    vector = np.random.default_rng(seed).standard_normal(DIM).astype(np.float32)
+    return vector / np.linalg.norm(vector)
+
+
+@pytest.fixture(params=["local", "milvus"])
+def open_store(request, tmp_path, monkeypatch):
+    """Returns open(name=None): a loaded store of the backend under test, reopened by name to simulate a restart."""
+    if request.param == "milvus" and os.getenv("MILVUS_TEST") != "1":
+        pytest.skip("Milvus contract tests need MILVUS_TEST=1 and a running Milvus.")
+    monkeypatch.setattr(vector_store, "LOCAL_STORE_DIR", str(tmp_path))
+    collection_name = f"contract_{uuid.uuid4().hex[:8]}"
+    stores = []
+
+    def open_(name: str = collection_name):
+        store = vector_store.LocalVectorStore(name, DIM) if request.param == "local" else vector_store.MilvusVectorStore(name, DIM)
+        store.load("ivf_flat_small" if request.param == "milvus" else None)
+        stores.append(store)
+        return store
+
+    yield open_
+    for store in stores:
+        store.release()
+    if request.param == "milvus":
+        vector_store.drop_collection(collection_name)
+
+
+def search_paths(store, query, top_k: int = 10, **filters):
+    return [hit["image_path"] for hit in store.search([query], top_k, **filters)[0]]
+
+
+def test_insert_and_search_returns_nearest_first(open_store):
+    store = open_store()
+    store.insert(["a.jpg", "b.jpg", "c.jpg"], [unit(1), unit(2), unit(3)])
+    store.flush()
+    hits = store.search([unit(2)], 3)[0]
+    assert hits[0]["image_path"] == "b.jpg"
+    assert hits[0]["distance"] == pytest.approx(0.0, abs=1e-4)
+    assert [hit["distance"] for hit in hits] == sorted(hit["distance"] for hit in hits)
+    assert store.num_entities() == 3
+
+
+def test_delete_survives_reload(open_store):
+    store = open_store()
+    store.insert(["a.jpg", "a.jpg", "b.jpg"], [unit(1), unit(4), unit(2)])
+    store.delete_paths(["a.jpg"])
+    store.flush()
+    assert "a.jpg" not in search_paths(store, unit(1))
+    store.release()
+    reopened = open_store()
+    assert search_paths(reopened, unit(1)) == ["b.jpg"]
+    assert sorted(path for batch in reopened.iter_image_paths() for path in batch) == ["b.jpg"]
+
+
+def test_writes_after_release_keep_deletes(open_store):
+    store = open_store()
+    store.insert(["a.jpg", "b.jpg"], [unit(1), unit(2)])
+    store.delete_paths(["a.jpg"])
+    store.flush()
+    store.release()
+    store.insert(["c.jpg"], [unit(3)])
+    store.flush()
+    assert search_paths(store, unit(3))[0] == "c.jpg"
+    reopened = open_store()
+    assert "a.jpg" not in search_paths(reopened, unit(1))
+    assert sorted(search_paths(reopened, unit(3))) == ["b.jpg", "c.jpg"]
+
+
+def test_partition_scoped_search(open_store):
+    july_4, july_5 = vector_store.partition_name("2026-07-04"), vector_store.partition_name("2026-07-05", "water park")
+    store = open_store()
+    store.insert(["d4.jpg", "d5.jpg", "old.jpg"], [unit(1), unit(2), unit(3)], partitions=[july_4, july_5, vector_store.DEFAULT_PARTITION])
+    store.flush()
+    assert {july_4, july_5} <= set(store.partition_names())
+    assert search_paths(store, unit(2), partitions=[july_4]) == ["d4.jpg"]
+    wanted = vector_store.select_partitions(store.partition_names(), dates=["2026-07-05"], zones=None)
+    assert set(search_paths(store, unit(2), partitions=wanted)) == {"d5.jpg", "old.jpg"}
+    assert search_paths(store, unit(2), partitions=[]) == []
+
+
+def test_quality_filters_keep_rows_without_metadata(open_store):
+    store = open_store()
+    metas = [{"det_score": 0.9, "face_size": 120.0, "bbox": [0.1, 0.1, 0.3, 0.3]}, {"det_score": 0.4, "face_size": 120.0}, {"det_score": 0.9, "face_size": 20.0}]
+    store.insert(["good.jpg", "blurry.jpg", "tiny.jpg"], [unit(1), unit(2), unit(3)], faces_meta=metas)
+    store.insert(["legacy.jpg"], [unit(4)])
+    store.flush()
+    assert set(search_paths(store, unit(1), min_det_score=0.5, min_face_size=40)) == {"good.jpg", "legacy.jpg"}
+    good = next(hit for hit in store.search([unit(1)], 4)[0] if hit["image_path"] == "good.jpg")
+    assert good["bbox"] == pytest.approx([0.1, 0.1, 0.3, 0.3])
+
+
+def test_partitions_created_by_another_worker_are_searchable(open_store, monkeypatch):
+    store = open_store()
+    monkeypatch.setattr(vector_store, "PARTITION_REFRESH_SECONDS", 0)
+    store.insert(["old.jpg"], [unit(1)])
+    store.flush()
+    july_6 = vector_store.partition_name("2026-07-06")
+    other_worker = open_store()
+    other_worker.insert(["d6.jpg"], [unit(2)], partitions=[july_6])
+    other_worker.flush()
+    assert july_6 in store.partition_names()
+    assert search_paths(store, unit(2), partitions=[july_6]) == ["d6.jpg"]
+
+
+def test_workers_sharing_a_collection_keep_each_others_rows_and_deletes(open_store):
+    worker_a, worker_b = open_store(), open_store()
+    worker_a.insert(["a.jpg", "b.jpg"], [unit(1), unit(2)])
+    worker_a.flush()
+    worker_b.insert(["c.jpg"], [unit(3)])
+    worker_b.delete_paths(["a.jpg"])
+    worker_b.flush()
+    worker_a.insert(["d.jpg"], [unit(4)])
+    worker_a.delete_paths(["b.jpg"])
+    worker_a.flush()
+    for store in (worker_a, worker_b, open_store()):
+        assert sorted(search_paths(store, unit(1))) == ["c.jpg", "d.jpg"]
+        assert search_paths(store, unit(3))[0] == "c.jpg"
+
+
+def test_get_embeddings_leaves_out_rows_deleted_since_the_search(open_store):
+    store = open_store()
+    store.insert(["a.jpg", "b.jpg"], [unit(1), unit(2)])
+    store.flush()
+    row_ids = {hit["image_path"]: hit["row_id"] for hit in store.search([unit(1)], 2)[0]}
+    store.delete_paths(["a.jpg"])
+    store.flush()
+    found, vectors = store.get_embeddings([row_ids["a.jpg"], row_ids["b.jpg"]])
+    assert found == [row_ids["b.jpg"]]
+    assert vectors.shape == (1, DIM)
+    assert vectors[0] == pytest.approx(unit(2), abs=1e-5)
+
+
+def test_local_row_count_leaves_out_deleted_rows(tmp_path, monkeypatch):
+    monkeypatch.setattr(vector_store, "LOCAL_STORE_DIR", str(tmp_path))
+    monkeypatch.setattr(vector_store, "VECTOR_BACKEND", "local")
+    store = vector_store.LocalVectorStore("counted", DIM)
+    store.load()
+    store.insert(["a.jpg", "b.jpg", "c.jpg"], [unit(1), unit(2), unit(3)])
+    store.delete_paths(["b.jpg"])
+    assert vector_store.collection_row_count("counted") == 2
+    store.rebuild_index()
+    assert vector_store.collection_row_count("counted") == 2
@@ -0,0 +1,723 @@
+# vector_store.py
+
+import os
+import re
+import json
+import shutil
+import threading
+import time
+from contextlib import contextmanager
+
+import numpy as np
+from pymilvus import (connections, utility, FieldSchema, CollectionSchema, DataType, Collection, MilvusException)
+from dotenv import load_dotenv
+
+try:
+    import fcntl
+except ImportError:  # Windows: no advisory file locks, so run the local backend with a single worker there
+    fcntl = None
+
+from index_profiles import get_index_params, get_search_params, to_l2_distance
+
+load_dotenv()
+
+# --- BACKEND CONFIGURATION ---
+VECTOR_BACKEND = os.getenv("VECTOR_BACKEND", "milvus").lower()  # "milvus" or "local"
+MILVUS_HOST = os.getenv("MILVUS_HOST", "127.0.0.1")
+MILVUS_PORT = os.getenv("MILVUS_PORT", "19530")
+LOCAL_STORE_DIR = os.getenv("LOCAL_STORE_DIR", "vector_store")
+LOCAL_SEARCH_CHUNK_ROWS = int(os.getenv("LOCAL_SEARCH_CHUNK_ROWS", 65536))  # Rows scored per matrix product
+PARTITION_LAZY_LOAD = os.getenv("PARTITION_LAZY_LOAD", "false").lower() == "true"  # Milvus: load only the partitions searches ask for
+PARTITION_REFRESH_SECONDS = float(os.getenv("PARTITION_REFRESH_SECONDS", 30))  # Milvus: max age of the cached partition list; other workers' new partitions show up within it
+DELETE_BATCH_SIZE = 1000  # Paths per Milvus delete expression
+FACE_FIELDS = ("bbox", "det_score", "face_size", "face_crop")  # Per-face metadata stored next to each embedding
+COLLECTION_NAME_PATTERN = re.compile(r"^[A-Za-z_][A-Za-z0-9_]*$")
+DEFAULT_PARTITION = "_default"  # Rows ingested before partitioning, or without a capture date and zone
+UNDATED_PARTITION_PREFIX = "undated"
+GUEST_PROFILE_COLLECTION = "_guest_profiles"      # Enrolled guest faces, searched at ingest time
+INTERNAL_COLLECTIONS = {GUEST_PROFILE_COLLECTION}  # Never listed as photo collections
+
+
+class VectorStore:
+    """
+    Storage and nearest-neighbour search for one collection's face embeddings.
+    Every backend reports hit distances in squared-L2 units (see index_profiles.to_l2_distance),
+    so thresholds and result merging do not depend on the backend or metric.
+    """
+
+    index_type = None
+    metric_type = None
+
+    def load(self, index_profile: str = None, metric_type: str = None):
+        """Opens the collection, creating it with the given index profile and metric if needed."""
+        raise NotImplementedError
+
+    def insert(self, image_paths: list, embeddings: list, faces_meta: list = None, partitions: list = None):
+        """
+        Appends one row per face. faces_meta, if given, holds one dict per face with
+        "bbox" ([x1, y1, x2, y2] as fractions of the image size), "det_score",
+        "face_size" (shorter bbox side in original pixels) and "face_crop" (path or "").
+        partitions, if given, names the partition of each row (see partition_name).
+        """
+        raise NotImplementedError
+
+    def delete_paths(self, image_paths: list):
+        """Deletes every row belonging to the given image paths."""
+        raise NotImplementedError
+
+    def search(self, query_embeddings: list, top_k: int, min_det_score: float = None, min_face_size: float = None, nprobe: int = None,
+               partitions: list = None):
+        """
+        Returns, per query embedding, a list of {"image_path", "distance", "row_id"} hits, closest
+        first, plus the FACE_FIELDS known for the row. Rows below min_det_score or min_face_size are
+        excluded inside the search itself; rows stored without metadata are never excluded.
+        nprobe overrides the index's default search breadth (ignored where it does not apply).
+        partitions, if not None, restricts the search to those partitions (see select_partitions).
+        """
+        raise NotImplementedError
+
+    def partition_names(self):
+        """Names of the partitions that hold (or held) rows."""
+        raise NotImplementedError
+
+    def get_embeddings(self, row_ids: list):
+        """
+        Stored embeddings of the given rows as (row_ids, float32 matrix), in row_ids order. Rows
+        deleted since a search returned them (a concurrent sync or delete) are left out of both.
+        """
+        raise NotImplementedError
+
+    def iter_image_paths(self, batch_size: int = 1000):
+        """Yields the image paths of all live rows in batches."""
+        raise NotImplementedError
+
+    def rebuild_index(self, index_profile: str, metric_type: str = None):
+        raise NotImplementedError
+
+    def num_entities(self):
+        raise NotImplementedError
+
+    def flush(self):
+        pass
+
+    def release(self):
+        pass
+
+    def estimated_memory_mb(self):
+        """Rough in-memory size when loaded: raw float32 vectors plus path overhead."""
+        return self.num_entities() * (self.dim * 4 + 256) / (1024 * 1024)
+
+
+def _make_hit(image_path: str, distance: float, row_id, meta: dict = None):
+    hit = {"image_path": image_path, "distance": distance, "row_id": row_id}
+    if meta:
+        hit.update({field: meta[field] for field in FACE_FIELDS if meta.get(field) not in (None, "")})
+    return hit
+
+
+# ===================================================================
+# MILVUS BACKEND
+# ===================================================================
+
+class MilvusVectorStore(VectorStore):
+    """The original Milvus-backed collection, one Milvus collection per face collection."""
+
+    def __init__(self, collection_name: str, dim: int):
+        self.collection_name = collection_name
+        self.dim = dim
+        self.collection = None
+        self.search_params = None
+        self.has_face_fields = False
+        self._partitions = set()
+        self._partitions_read_at = 0.0
+        self._loaded_partitions = None  # None: the whole collection is loaded
+        self._partition_lock = threading.Lock()
+        self.load_events = 0  # Bumped whenever more partitions get loaded, so callers can re-measure memory
+
+    def load(self, index_profile: str = None, metric_type: str = None):
+        connect()
+        if not utility.has_collection(self.collection_name):
+            fields = [
+                FieldSchema(name="pk_id", dtype=DataType.INT64, is_primary=True, auto_id=True),
+                FieldSchema(name="image_path", dtype=DataType.VARCHAR, max_length=1024),
+                FieldSchema(name="embedding", dtype=DataType.FLOAT_VECTOR, dim=self.dim),
+                FieldSchema(name="det_score", dtype=DataType.FLOAT),
+                FieldSchema(name="face_size", dtype=DataType.FLOAT),
+                FieldSchema(name="bbox", dtype=DataType.JSON),
+                FieldSchema(name="face_crop", dtype=DataType.VARCHAR, max_length=1024),
+            ]
+            schema = CollectionSchema(fields, f"Face search collection: {self.collection_name}")
+            self.collection = Collection(name=self.collection_name, schema=schema)
+            index_params = get_index_params(index_profile, metric_type or "L2")
+            self.collection.create_index(field_name="embedding", index_params=index_params)
+        else:
+            self.collection = Collection(name=self.collection_name)
+        self._refresh_partitions(force=True)
+        self._load_collection()
+        # Collections created before face metadata existed keep working, without it.
+        self.has_face_fields = set(FACE_FIELDS) <= {field.name for field in self.collection.schema.fields}
+        self._read_index_config()
+
+    def _load_collection(self):
+        """Loads everything, or with PARTITION_LAZY_LOAD nothing yet: searches load the partitions they need."""
+        if PARTITION_LAZY_LOAD:
+            self._loaded_partitions = set()
+        else:
+            self.collection.load()
+            self._loaded_partitions = None
+
+    def _ensure_loaded(self, partitions: list = None):
+        """Makes the given partitions (or, for None, the whole collection) searchable."""
+        with self._partition_lock:
+            if self._loaded_partitions is None: return
+            if partitions is None:
+                self.collection.load()
+                self._loaded_partitions = None
+            else:
+                missing = [name for name in partitions if name not in self._loaded_partitions]
+                if not missing: return
+                self.collection.load(partition_names=missing)
+                self._loaded_partitions = self._loaded_partitions | set(missing)
+            self.load_events += 1
+
+    def _while_loaded(self, call, partitions: list = None):
+        """
+        Runs a search/query call. Milvus load state is shared by every worker, so another
+        worker's LRU may have released the collection since this one loaded it: on a
+        "not loaded" error the needed partitions (or the whole collection) are loaded again
+        and the call is retried once.
+        """
+        try:
+            return call()
+        except MilvusException as e:
+            if getattr(e, "code", None) != 101 and "not loaded" not in str(e).lower(): raise
+        print(f"--- Collection '{self.collection_name}' was released by another worker; reloading. ---")
+        with self._partition_lock:
+            self._loaded_partitions = set()
+        self._ensure_loaded(partitions if PARTITION_LAZY_LOAD else None)
+        return call()
+
+    def _refresh_partitions(self, force: bool = False):
+        """
+        Re-reads the partition list once it is older than PARTITION_REFRESH_SECONDS, so
+        partitions another worker created (e.g. an ingest of a new date) become listable and searchable.
+        """
+        with self._partition_lock:
+            if not force and time.monotonic() - self._partitions_read_at < PARTITION_REFRESH_SECONDS: return
+            self._partitions = {partition.name for partition in self.collection.partitions}
+            self._partitions_read_at = time.monotonic()
+
+    def _read_index_config(self):
+        """Derives metric and search parameters from the index the collection was actually built with."""
+        index_params = self.collection.indexes[0].params if self.collection.indexes else {}
+        self.index_type = index_params.get("index_type", "IVF_FLAT")
+        self.metric_type = index_params.get("metric_type", "L2")
+        self.search_params = get_search_params(self.index_type, self.metric_type)
+
+    def rebuild_index(self, index_profile: str, metric_type: str = None):
+        index_params = get_index_params(index_profile, metric_type or self.metric_type)
+        self.collection.release()
+        self.collection.drop_index()
+        self.collection.create_index(field_name="embedding", index_params=index_params)
+        self._load_collection()
+        self._read_index_config()
+
+    def insert(self, image_paths: list, embeddings: list, faces_meta: list = None, partitions: list = None):
+        faces_meta = faces_meta or [{} for _ in image_paths]
+        rows_by_partition = {}
+        for row, partition in enumerate(partitions or [DEFAULT_PARTITION] * len(image_paths)):
+            rows_by_partition.setdefault(partition, []).append(row)
+        for partition, rows in rows_by_partition.items():
+            self._create_partition(partition)
+            paths, vectors, metas = [image_paths[i] for i in rows], [embeddings[i] for i in rows], [faces_meta[i] for i in rows]
+            if not self.has_face_fields:
+                self.collection.insert([paths, vectors], partition_name=partition)
+                continue
+            self.collection.insert([
+                paths, vectors,
+                # Rows without metadata get values no filter excludes
+                [float(meta.get("det_score", 1.0)) for meta in metas],
+                [float(meta.get("face_size", 1e6)) for meta in metas],
+                [meta.get("bbox") or [] for meta in metas],
+                [meta.get("face_crop") or "" for meta in metas],
+            ], partition_name=partition)
+
+    def _create_partition(self, partition: str):
+        with self._partition_lock:
+            if partition in self._partitions: return
+            if not self.collection.has_partition(partition):
+                self.collection.create_partition(partition)
+            self._partitions.add(partition)
+            if self._loaded_partitions is None:
+                self.collection.load()  # Keeps a fully loaded collection fully loaded
+
+    def partition_names(self):
+        self._refresh_partitions()
+        return sorted(self._partitions)
+
+    def delete_paths(self, image_paths: list):
+        self._ensure_loaded()  # Deleting by image_path runs a query first
+        for i in range(0, len(image_paths), DELETE_BATCH_SIZE):
+            expr = f"image_path in {json.dumps(image_paths[i:i + DELETE_BATCH_SIZE])}"
+            self._while_loaded(lambda: self.collection.delete(expr))
+
+    def search(self, query_embeddings: list, top_k: int, min_det_score: float = None, min_face_size: float = None, nprobe: int = None,
+               partitions: list = None):
+        if partitions is not None:
+            if not set(partitions) <= self._partitions: self._refresh_partitions()
+            partitions = [name for name in partitions if name in self._partitions]
+            if not partitions: return [[] for _ in query_embeddings]
+        self._ensure_loaded(partitions)
+        output_fields, conditions = ["image_path"], []
+        if self.has_face_fields:
+            output_fields += list(FACE_FIELDS)
+            if min_det_score: conditions.append(f"det_score >= {float(min_det_score)}")
+            if min_face_size: conditions.append(f"face_size >= {float(min_face_size)}")
+        search_params = self.search_params
+        if nprobe or self.index_type == "HNSW":
+            search_params = get_search_params(self.index_type, self.metric_type, nprobe=nprobe, limit=top_k)
+        list_of_results = self._while_loaded(lambda: self.collection.search(data=query_embeddings, anns_field="embedding", param=search_params, limit=top_k,
+                                                                            expr=" && ".join(conditions) or None, output_fields=output_fields, partition_names=partitions), partitions)
+        return [
+            [_make_hit(hit.entity.get("image_path"), to_l2_distance(hit.distance, self.metric_type), hit.id, {field: hit.entity.get(field) for field in output_fields[1:]})
+             for hit in hits_for_one_face]
+            for hits_for_one_face in list_of_results
+        ]
+
+    def get_embeddings(self, row_ids: list):
+        vectors = {}
+        loaded = sorted(self._loaded_partitions) if self._loaded_partitions is not None else None
+        for i in range(0, len(row_ids), DELETE_BATCH_SIZE):
+            expr = f"pk_id in {[int(row_id) for row_id in row_ids[i:i + DELETE_BATCH_SIZE]]}"
+            for row in self._while_loaded(lambda: self.collection.query(expr=expr, output_fields=["embedding"], partition_names=loaded), loaded):
+                vectors[row["pk_id"]] = row["embedding"]
+        found = [row_id for row_id in row_ids if row_id in vectors]
+        return found, np.asarray([vectors[row_id] for row_id in found], dtype=np.float32).reshape(-1, self.dim)
+
+    def iter_image_paths(self, batch_size: int = 1000):
+        self._ensure_loaded()
+        iterator = self._while_loaded(lambda: self.collection.query_iterator(batch_size=batch_size, expr="pk_id >= 0", output_fields=["image_path"]))
+        while True:
+            batch = iterator.next()
+            if not batch:
+                iterator.close()
+                return
+            yield [item["image_path"] for item in batch]
+
+    def num_entities(self):
+        return self.collection.num_entities
+
+    def estimated_memory_mb(self):
+        if self._loaded_partitions is None: return super().estimated_memory_mb()
+        rows = sum(self.collection.partition(name).num_entities for name in self._loaded_partitions)
+        return rows * (self.dim * 4 + 256) / (1024 * 1024)
+
+    def flush(self):
+        self.collection.flush()
+
+    def release(self):
+        self.collection.release()
+        with self._partition_lock:
+            self._loaded_partitions = set()
+
+
+# ===================================================================
+# LOCAL MEMORY-MAPPED BACKEND
+# ===================================================================
+
+class LocalVectorStore(VectorStore):
+    """
+    In-process exact search over a memory-mapped float32 matrix, for edge deployments
+    without Milvus. Each collection is a folder holding an append-only embeddings.f32
+    matrix, a rows.jsonl line per row (image path, partition and face metadata) and a
+    deleted.npy tombstone mask. Embeddings are unit vectors, so a dot-product top-k gives
+    the exact nearest neighbours. Partitions are a per-row code; a partition-scoped search
+    skips every chunk of the matrix holding none of the requested partitions.
+    Several worker processes may share a collection: writes hold an fcntl lock on the
+    folder, and every use first catches up with rows and tombstones other workers wrote.
+    """
+
+    index_type = "EXACT"
+    metric_type = "IP"
+
+    def __init__(self, collection_name: str, dim: int):
+        if not COLLECTION_NAME_PATTERN.match(collection_name):
+            raise ValueError(f"Invalid collection name '{collection_name}'.")
+        self.collection_name = collection_name
+        self.dim = dim
+        self.directory = os.path.join(LOCAL_STORE_DIR, collection_name)
+        self._matrix_path = os.path.join(self.directory, "embeddings.f32")
+        self._rows_path = os.path.join(self.directory, "rows.jsonl")
+        self._deleted_path = os.path.join(self.directory, "deleted.npy")
+        self._lock_path = os.path.join(self.directory, ".lock")
+        self._lock = threading.RLock()
+        self._matrix = np.empty((0, dim), dtype=np.float32)
+        self._paths = []
+        self._metas = []  # Face metadata per row ({} for rows stored without it)
+        self._det_scores = np.zeros(0, dtype=np.float32)  # NaN where unknown, so filters let the row through
+        self._face_sizes = np.zeros(0, dtype=np.float32)
+        self._partition_codes = np.zeros(0, dtype=np.int32)  # Index into self._partition_list per row
+        self._partition_list = []
+        self._rows_by_path = {}
+        self._deleted = np.zeros(0, dtype=bool)
+        self._loaded = False
+        self._synced_state = None  # _disk_state() as of the last read or write of the files
+        self._rows_bytes = 0       # Bytes of rows.jsonl already in memory
+
+    def _ensure_loaded(self):
+        """
+        Reloads a released store before it is used again, and catches up with what other worker
+        processes wrote to the collection since this store last read its files.
+        """
+        with self._lock:
+            if self._loaded and self._disk_state() == self._synced_state: return
+            self._ensure_directory()
+            with self._file_lock():
+                self._catch_up()
+
+    def load(self, index_profile: str = None, metric_type: str = None):
+        with self._lock:
+            self._ensure_directory()
+            with self._file_lock():
+                self._read_files()
+
+    def _ensure_directory(self):
+        os.makedirs(self.directory, exist_ok=True)
+        for path in (self._matrix_path, self._rows_path):
+            if not os.path.exists(path): open(path, "wb").close()
+
+    @contextmanager
+    def _file_lock(self):
+        """
+        Exclusive advisory lock on the collection, shared by every worker process: held while
+        writing and while reading another process's writes, so nobody reads half an append.
+        """
+        if fcntl is None:
+            yield
+            return
+        with open(self._lock_path, "a") as f:
+            fcntl.flock(f, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(f, fcntl.LOCK_UN)
+
+    def _disk_state(self):
+        """Changes whenever any process appends rows, compacts the collection or saves tombstones."""
+        rows = os.stat(self._rows_path)
+        try:
+            deleted = os.stat(self._deleted_path)
+            deleted_state = (deleted.st_ino, deleted.st_mtime_ns, deleted.st_size)
+        except FileNotFoundError:
+            deleted_state = None
+        return rows.st_ino, rows.st_size, deleted_state
+
+    def _catch_up(self):
+        """
+        Brings the in-memory view up to date with the files: appended rows are read from where
+        this store stopped, a compaction (new rows file) means a full reload. Call with both locks held.
+        """
+        state = self._disk_state()
+        if self._loaded and state == self._synced_state: return
+        if not self._loaded or state[0] != self._synced_state[0] or state[1] < self._rows_bytes:
+            self._read_files()
+            return
+        if state[1] > self._rows_bytes:
+            with open(self._rows_path, "rb") as f:
+                f.seek(self._rows_bytes)
+                rows = [json.loads(line) for line in f.read().decode("utf-8").splitlines() if line.strip()]
+            self._append_rows([row.pop("image_path") for row in rows], rows)
+        if state[2] != self._synced_state[2]:
+            self._deleted = self._read_deleted(len(self._paths))
+        self._rows_bytes, self._synced_state = state[1], state
+
+    def _read_files(self):
+        """Full (re)load of the collection's files. Call with both locks held."""
+        with open(self._rows_path, "r", encoding="utf-8") as f:
+            rows = [json.loads(line) for line in f if line.strip()]
+        paths = [row.pop("image_path") for row in rows]
+        # A crash between the two appends leaves one file longer; keep only complete rows.
+        matrix_rows = os.path.getsize(self._matrix_path) // (self.dim * 4)
+        row_count = min(len(paths), matrix_rows)
+        if row_count != len(paths) or row_count != matrix_rows:
+            self._rewrite(np.memmap(self._matrix_path, dtype=np.float32, mode="r", shape=(matrix_rows, self.dim))[:row_count] if matrix_rows else np.empty((0, self.dim), np.float32), paths[:row_count], rows[:row_count])
+        self._paths = paths[:row_count]
+        self._metas = rows[:row_count]
+        self._det_scores, self._face_sizes = self._filter_columns(self._metas)
+        self._partition_list = []
+        self._partition_codes = self._encode_partitions(self._metas)
+        self._rows_by_path = {}
+        for row, path in enumerate(self._paths):
+            self._rows_by_path.setdefault(path, []).append(row)
+        self._deleted = self._read_deleted(row_count)
+        self._remap()
+        self._synced_state = self._disk_state()
+        self._rows_bytes = self._synced_state[1]
+        self._loaded = True
+
+    def _read_deleted(self, row_count: int):
+        deleted = np.load(self._deleted_path) if os.path.exists(self._deleted_path) else np.zeros(0, dtype=bool)
+        mask = np.zeros(row_count, dtype=bool)
+        mask[:min(len(deleted), row_count)] = deleted[:row_count]
+        return mask
+
+    def _save_deleted(self):
+        """Replaces the tombstone file atomically, so another process never reads it half written."""
+        np.save(self._deleted_path + ".tmp.npy", self._deleted)
+        os.replace(self._deleted_path + ".tmp.npy", self._deleted_path)
+
+    @staticmethod
+    def _filter_columns(metas: list):
+        det_scores = np.array([meta.get("det_score", np.nan) for meta in metas], dtype=np.float32)
+        face_sizes = np.array([meta.get("face_size", np.nan) for meta in metas], dtype=np.float32)
+        return det_scores, face_sizes
+
+    def _encode_partitions(self, metas: list):
+        """Per-row partition codes, registering partitions not seen before. Call with the lock held."""
+        codes = np.empty(len(metas), dtype=np.int32)
+        for row, meta in enumerate(metas):
+            name = meta.get("partition", DEFAULT_PARTITION)
+            if name not in self._partition_list: self._partition_list = self._partition_list + [name]
+            codes[row] = self._partition_list.index(name)
+        return codes
+
+    def _remap(self):
+        rows = len(self._paths)
+        self._matrix = np.memmap(self._matrix_path, dtype=np.float32, mode="r", shape=(rows, self.dim)) if rows else np.empty((0, self.dim), np.float32)
+
+    @staticmethod
+    def _row_lines(paths: list, metas: list):
+        return "".join(json.dumps({"image_path": path, **meta}) + "\n" for path, meta in zip(paths, metas))
+
+    def _rewrite(self, matrix, paths: list, metas: list):
+        """Atomically replaces the collection's files (used for crash repair and compaction)."""
+        np.asarray(matrix, dtype=np.float32).tofile(self._matrix_path + ".tmp")
+        with open(self._rows_path + ".tmp", "w", encoding="utf-8") as f:
+            f.write(self._row_lines(paths, metas))
+        os.replace(self._matrix_path + ".tmp", self._matrix_path)
+        os.replace(self._rows_path + ".tmp", self._rows_path)
+
+    def insert(self, image_paths: list, embeddings: list, faces_meta: list = None, partitions: list = None):
+        vectors = np.asarray(embeddings, dtype=np.float32).reshape(-1, self.dim)
+        metas = [{field: meta[field] for field in FACE_FIELDS if field in meta} for meta in faces_meta] if faces_meta else [{} for _ in image_paths]
+        for meta, partition in zip(metas, partitions or []):
+            if partition != DEFAULT_PARTITION: meta["partition"] = partition
+        lines = self._row_lines(image_paths, metas).encode("utf-8")
+        with self._lock:
+            self._ensure_directory()
+            with self._file_lock():
+                self._catch_up()  # Rows other workers appended come first, so the new rows are numbered after them
+                with open(self._matrix_path, "ab") as f:
+                    f.write(vectors.tobytes())
+                with open(self._rows_path, "ab") as f:
+                    f.write(lines)
+                self._append_rows(list(image_paths), metas)
+                self._synced_state = self._disk_state()
+                self._rows_bytes = self._synced_state[1]
+
+    def _append_rows(self, image_paths: list, metas: list):
+        """Adds rows already written to the files to the in-memory view. Call with the lock held."""
+        start = len(self._paths)
+        for offset, path in enumerate(image_paths):
+            self._rows_by_path.setdefault(path, []).append(start + offset)
+        # New objects, so concurrent searches keep a consistent snapshot
+        self._paths = self._paths + list(image_paths)
+        self._metas = self._metas + metas
+        det_scores, face_sizes = self._filter_columns(metas)
+        self._det_scores = np.concatenate([self._det_scores, det_scores])
+        self._face_sizes = np.concatenate([self._face_sizes, face_sizes])
+        self._partition_codes = np.concatenate([self._partition_codes, self._encode_partitions(metas)])
+        self._deleted = np.concatenate([self._deleted, np.zeros(len(image_paths), dtype=bool)])
+        self._remap()
+
+    def delete_paths(self, image_paths: list):
+        with self._lock:
+            self._ensure_directory()
+            with self._file_lock():
+                self._catch_up()  # Keeps the tombstones other workers saved
+                deleted = self._deleted.copy()
+                for path in image_paths:
+                    for row in self._rows_by_path.pop(path, []):
+                        deleted[row] = True
+                self._deleted = deleted
+                self._save_deleted()
+                self._synced_state = self._disk_state()
+
+    def search(self, query_embeddings: list, top_k: int, min_det_score: float = None, min_face_size: float = None, nprobe: int = None,
+               partitions: list = None):
+        queries = np.asarray(query_embeddings, dtype=np.float32).reshape(-1, self.dim)
+        with self._lock:
+            self._ensure_loaded()
+            matrix, paths, metas, deleted = self._matrix, self._paths, self._metas, self._deleted
+            det_scores, face_sizes = self._det_scores, self._face_sizes
+            partition_codes, partition_list = self._partition_codes, self._partition_list
+        rows = matrix.shape[0]
+        if rows == 0 or len(queries) == 0: return [[] for _ in range(len(queries))]
+        excluded = deleted.copy()
+        if min_det_score: excluded |= det_scores[:rows] < min_det_score  # NaN (unknown) compares False
+        if min_face_size: excluded |= face_sizes[:rows] < min_face_size
+        if partitions is not None:
+            wanted = [code for code, name in enumerate(partition_list) if name in partitions]
+            excluded |= ~np.isin(partition_codes[:rows], wanted)
+
+        top_scores = np.full((len(queries), 0), -np.inf, dtype=np.float32)
+        top_rows = np.zeros((len(queries), 0), dtype=np.int64)
+        for start in range(0, rows, LOCAL_SEARCH_CHUNK_ROWS):
+            end = min(start + LOCAL_SEARCH_CHUNK_ROWS, rows)
+            if excluded[start:end].all(): continue  # Never pages in chunks with nothing to score
+            scores = queries @ np.asarray(matrix[start:end]).T
+            scores[:, excluded[start:end]] = -np.inf
+            candidate_scores = np.concatenate([top_scores, scores], axis=1)
+            candidate_rows = np.concatenate([top_rows, np.broadcast_to(np.arange(start, end), scores.shape)], axis=1)
+            keep = min(top_k, candidate_scores.shape[1])
+            best = np.argpartition(-candidate_scores, keep - 1, axis=1)[:, :keep]
+            top_scores = np.take_along_axis(candidate_scores, best, axis=1)
+            top_rows = np.take_along_axis(candidate_rows, best, axis=1)
+
+        order = np.argsort(-top_scores, axis=1)
+        top_scores = np.take_along_axis(top_scores, order, axis=1)
+        top_rows = np.take_along_axis(top_rows, order, axis=1)
+        return [
+            [_make_hit(paths[row], to_l2_distance(float(score), self.metric_type), int(row), metas[row])
+             for score, row in zip(query_scores, query_rows) if score > -np.inf]
+            for query_scores, query_rows in zip(top_scores, top_rows)
+        ]
+
+    def partition_names(self):
+        self._ensure_loaded()
+        return sorted(self._partition_list)
+
+    def get_embeddings(self, row_ids: list):
+        with self._lock:
+            self._ensure_loaded()
+            matrix, deleted = self._matrix, self._deleted
+        found = [row_id for row_id in row_ids if 0 <= row_id < matrix.shape[0] and not deleted[row_id]]
+        return found, np.asarray(matrix[np.asarray(found, dtype=np.int64)], dtype=np.float32).reshape(-1, self.dim)
+
+    def iter_image_paths(self, batch_size: int = 1000):
+        with self._lock:
+            self._ensure_loaded()
+            paths, deleted = self._paths, self._deleted
+        live = [path for path, is_deleted in zip(paths, deleted) if not is_deleted]
+        for i in range(0, len(live), batch_size):
+            yield live[i:i + batch_size]
+
+    def rebuild_index(self, index_profile: str = None, metric_type: str = None):
+        """Exact search has no index to tune; a rebuild compacts away deleted rows instead."""
+        with self._lock:
+            self._ensure_directory()
+            with self._file_lock():
+                self._catch_up()
+                live = ~self._deleted
+                self._rewrite(np.asarray(self._matrix)[live], [path for path, keep in zip(self._paths, live) if keep],
+                              [meta for meta, keep in zip(self._metas, live) if keep])
+                if os.path.exists(self._deleted_path): os.remove(self._deleted_path)
+                self._read_files()
+
+    def num_entities(self):
+        self._ensure_loaded()
+        return len(self._paths)
+
+    def flush(self):
+        pass  # Rows and tombstones are written to disk as they are made
+
+    def release(self):
+        with self._lock:
+            self._matrix = np.empty((0, self.dim), np.float32)
+            self._paths, self._metas, self._rows_by_path, self._deleted = [], [], {}, np.zeros(0, dtype=bool)
+            self._det_scores, self._face_sizes = np.zeros(0, dtype=np.float32), np.zeros(0, dtype=np.float32)
+            self._partition_codes, self._partition_list = np.zeros(0, dtype=np.int32), []
+            self._loaded, self._synced_state = False, None  # The next use reloads from disk
+
+
+# ===================================================================
+# BACKEND-NEUTRAL COLLECTION HELPERS
+# ===================================================================
+
+def open_vector_store(collection_name: str, dim: int) -> VectorStore:
+    """Returns an unloaded store for the configured VECTOR_BACKEND."""
+    if VECTOR_BACKEND == "local":
+        return LocalVectorStore(collection_name, dim)
+    return MilvusVectorStore(collection_name, dim)
+
+def connect():
+    if VECTOR_BACKEND == "milvus" and not connections.has_connection("default"):
+        connections.connect("default", host=MILVUS_HOST, port=MILVUS_PORT)
+
+def disconnect():
+    if VECTOR_BACKEND == "milvus":
+        connections.disconnect("default")
+
+def list_collections():
+    """Photo collections only; internal collections such as the guest profile index are left out."""
+    if VECTOR_BACKEND == "local":
+        if not os.path.isdir(LOCAL_STORE_DIR): return []
+        names = sorted(name for name in os.listdir(LOCAL_STORE_DIR) if os.path.exists(os.path.join(LOCAL_STORE_DIR, name, "rows.jsonl")))
+    else:
+        connect()
+        names = utility.list_collections()
+    return [name for name in names if name not in INTERNAL_COLLECTIONS]
+
+def has_collection(collection_name: str):
+    if VECTOR_BACKEND == "local":
+        return os.path.exists(os.path.join(LOCAL_STORE_DIR, collection_name, "rows.jsonl")) if COLLECTION_NAME_PATTERN.match(collection_name) else False
+    connect()
+    return utility.has_collection(collection_name)
+
+def drop_collection(collection_name: str):
+    if VECTOR_BACKEND == "local":
+        if COLLECTION_NAME_PATTERN.match(collection_name):
+            shutil.rmtree(os.path.join(LOCAL_STORE_DIR, collection_name), ignore_errors=True)
+        return
+    connect()
+    utility.drop_collection(collection_name)
+
+def collection_row_count(collection_name: str):
+    """Number of stored face rows, without loading the collection."""
+    if VECTOR_BACKEND == "local":
+        directory = os.path.join(LOCAL_STORE_DIR, collection_name)
+        with open(os.path.join(directory, "rows.jsonl"), "rb") as f:
+            row_count = sum(1 for line in f if line.strip())
+        deleted_path = os.path.join(directory, "deleted.npy")
+        deleted = np.load(deleted_path)[:row_count] if os.path.exists(deleted_path) else np.zeros(0, dtype=bool)
+        return row_count - int(deleted.sum())  # Tombstoned rows stay in the files until a rebuild compacts them
+    connect()
+    stats = utility.get_collection_stats(collection_name=collection_name)
+    return int(stats.get("row_count", 0)) if isinstance(stats, dict) else int(next((stat.value for stat in stats if stat.key == 'row_count'), 0))
+
+def partition_name(capture_date: str = None, zone: str = None):
+    """
+    Partition for photos taken on capture_date ("YYYY-MM-DD", None if unknown) in zone,
+    e.g. "d20260704" or "d20260704__water_park". Undated, zoneless rows use DEFAULT_PARTITION.
+    """
+    zone = normalize_zone(zone)
+    if not capture_date and not zone: return DEFAULT_PARTITION
+    name = "d" + capture_date.replace("-", "") if capture_date else UNDATED_PARTITION_PREFIX
+    return f"{name}__{zone}" if zone else name
+
+def normalize_zone(zone: str = None):
+    """Lower-case letters, digits and single underscores, usable inside a partition name."""
+    return re.sub(r"[^a-z0-9]+", "_", zone.lower()).strip("_") if zone else ""
+
+def parse_partition_name(name: str):
+    """Inverse of partition_name: (capture_date or None, zone or None)."""
+    if name == DEFAULT_PARTITION: return None, None
+    date_part, _, zone = name.partition("__")
+    capture_date = f"{date_part[1:5]}-{date_part[5:7]}-{date_part[7:9]}" if date_part.startswith("d") and len(date_part) == 9 else None
+    return capture_date, zone or None
+
+def select_partitions(partition_names: list, dates: list = None, zones: list = None):
+    """
+    The partitions a date/zone filter has to search, or None (search everything) without a filter.
+    Partitions whose date or zone is unknown are always kept, so a filter never hides a photo
+    that merely lacks EXIF data or was ingested without a zone.
+    """
+    if not dates and not zones: return None
+    zones = {normalize_zone(zone) for zone in zones} if zones else None
+    selected = []
+    for name in partition_names:
+        capture_date, zone = parse_partition_name(name)
+        if dates and capture_date and capture_date not in dates: continue
+        if zones and zone and zone not in zones: continue
+        selected.append(name)
+    return selected
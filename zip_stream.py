@@ -0,0 +1,67 @@
+# zip_stream.py
+
+import os
+import zipfile
+from dotenv import load_dotenv
+
+load_dotenv()
+
+# --- ZIP STREAMING CONFIGURATION ---
+ZIP_CHUNK_SIZE = int(os.getenv("ZIP_CHUNK_SIZE", 1024 * 1024))  # Bytes read from each original per step
+STORED_EXTENSIONS = ('.jpg', '.jpeg', '.png', '.webp', '.heic')  # Already compressed, deflating only burns CPU
+
+
+class _ChunkSink:
+    """A write-only, non-seekable file object. zipfile then writes data descriptors instead of seeking back."""
+
+    def __init__(self):
+        self._chunks = []
+
+    def write(self, data):
+        self._chunks.append(bytes(data))
+        return len(data)
+
+    def flush(self):
+        pass
+
+    def drain(self):
+        data = b"".join(self._chunks)
+        self._chunks = []
+        return data
+
+
+def iter_zip_chunks(image_paths: list, chunk_size: int = ZIP_CHUNK_SIZE):
+    """
+    Yields a ZIP archive of the given files piece by piece, holding at most about one
+    chunk in memory. Missing paths are skipped. This is a plain (blocking) generator:
+    StreamingResponse iterates it in the threadpool, keeping file reads off the event loop.
+    """
+    sink = _ChunkSink()
+    with zipfile.ZipFile(sink, mode='w', allowZip64=True) as archive:
+        for original_path in image_paths:
+            if not os.path.isfile(original_path):
+                continue
+            zinfo = zipfile.ZipInfo.from_file(original_path, arcname=os.path.basename(original_path))
+            zinfo.compress_type = zipfile.ZIP_STORED if original_path.lower().endswith(STORED_EXTENSIONS) else zipfile.ZIP_DEFLATED
+            with open(original_path, 'rb') as src, archive.open(zinfo, mode='w') as dest:
+                while True:
+                    block = src.read(chunk_size)
+                    if not block:
+                        break
+                    dest.write(block)
+                    data = sink.drain()
+                    if data:
+                        yield data
+            data = sink.drain()
+            if data:
+                yield data
+    yield sink.drain()  # Central directory
+
+
+def write_zip(image_paths: list, fileobj):
+    """Streams the ZIP into `fileobj` and returns the number of bytes written."""
+    written = 0
+    for data in iter_zip_chunks(image_paths):
+        fileobj.write(data)
+        written += len(data)
+    return written